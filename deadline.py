@@ -0,0 +1,52 @@
+"""
+deadline.py — 运行截止时间与阶段预算（三个抓取流程共用）
+- Cloud Run 到 TIMEOUT（部署工作流中的 540s）直接杀实例，未写出的结果和 seen 记录全部丢失
+- 每次运行在 main() 开头 start()：工作截止时间 = RUN_TIMEOUT − COMMIT_RESERVE，
+  预留的时间只用于写入输出后端和 seen / 状态文件
+- stage(share)：从剩余工作时间中划出一段给某阶段（不超过整体截止时间）；
+  低优先级工作（剩余详情页、LLM 补请求轮 / 后备档位等）按 expired() / remaining() 取舍
+"""
+import os, threading, time
+
+
+def _seconds(value):
+    return float(str(value).strip().rstrip("s"))
+
+
+RUN_TIMEOUT    = _seconds(os.environ.get("RUN_TIMEOUT", "540"))
+COMMIT_RESERVE = _seconds(os.environ.get("COMMIT_RESERVE", "45"))
+
+
+class Deadline:
+    def __init__(self, seconds, parent=None):
+        self.at = time.monotonic() + seconds
+        if parent is not None:
+            self.at = min(self.at, parent.at)
+
+    def remaining(self):
+        return max(0.0, self.at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.at
+
+    def stage(self, share):
+        """当前剩余时间的 share 比例作为子阶段预算"""
+        return Deadline(self.remaining() * share, parent=self)
+
+    def arm(self, event):
+        """到期时 set(event)，用于打断仍在进行的流式调用；无限期时不启动计时器"""
+        if self.at == float("inf"):
+            return None
+        timer = threading.Timer(self.remaining(), event.set)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+
+NEVER = Deadline(float("inf"))
+
+
+def start(total=None):
+    """本次运行的工作截止时间（已扣除写入预留）"""
+    total = RUN_TIMEOUT if total is None else total
+    return Deadline(max(0.0, total - COMMIT_RESERVE))
@@ -0,0 +1,138 @@
+"""
+feed_dates.py — 各来源日期解析与 SGT 日期归一化（fetch_jobs / fetch_journals / fetch_reports 共用）
+- 支持的格式：RFC 822（RSS pubDate）、ISO 8601（Atom / dc:date）、'20th February 2026'
+- 按来源嗅探格式：某个 feed 第一次解析成功的格式缓存为该 feed 的快速路径，
+  后续条目直接走它；快速路径不匹配时才依次尝试其他格式
+- 解析器用正则预判，不匹配直接返回 None，不再每条都靠抛异常试错
+- 无时区的时间按 UTC 处理（与 Cloud Run 本地时区一致）；纯日期保持原日期
+- RFC 822 时区缩写不在 _ZONES 中（IST 等有歧义的缩写）时同样按 UTC 处理，不丢弃整条日期
+"""
+import re, threading
+from datetime import datetime, timedelta, timezone
+
+SGT = timezone(timedelta(hours=8))
+
+_MONTHS = {m: i for i, m in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], 1)}
+_ZONES = {"GMT": 0, "UT": 0, "UTC": 0, "Z": 0,
+          "EST": -5, "EDT": -4, "CST": -6, "CDT": -5, "MST": -7, "MDT": -6, "PST": -8, "PDT": -7,
+          "BST": 1, "CET": 1, "CEST": 2, "EET": 2, "EEST": 3,
+          "SGT": 8, "HKT": 8, "JST": 9, "KST": 9, "AEST": 10, "AEDT": 11}
+
+_RFC822_RE = re.compile(
+    r'(?:[A-Za-z]{3},?\s+)?(\d{1,2})\s+([A-Za-z]{3})[a-z]*\.?\s+(\d{2,4})'
+    r'(?:\s+(\d{1,2}):(\d{2})(?::(\d{2}))?)?\s*([+-]\d{4}|[A-Za-z]{1,5})?\s*$')
+_ISO_RE   = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+_DMY_RE   = re.compile(r'(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)\s+(\d{4})')
+
+_lock    = threading.Lock()
+_sniffed = {}   # feed → 格式名
+
+
+def _rfc822(s):
+    m = _RFC822_RE.match(s)
+    if not m:
+        return None
+    day, mon, year, hh, mm, ss, zone = m.groups()
+    month = _MONTHS.get(mon.lower())
+    if not month:
+        return None
+    year = int(year)
+    if year < 100:
+        year += 2000 if year < 50 else 1900
+    if zone and zone[0] in "+-":
+        minutes = int(zone[1:3]) * 60 + int(zone[3:5])
+        tz = timezone(timedelta(minutes=minutes if zone[0] == "+" else -minutes))
+    else:
+        # 未知缩写按 UTC：最多差一天，比整条丢弃好
+        tz = timezone(timedelta(hours=_ZONES.get((zone or "").upper(), 0)))
+    try:
+        return datetime(year, month, int(day), int(hh or 0), int(mm or 0), int(ss or 0), tzinfo=tz)
+    except ValueError:
+        return None
+
+
+def _iso(s):
+    m = _ISO_RE.match(s)
+    if not m:
+        return None
+    try:
+        dt = datetime.fromisoformat(s)
+    except ValueError:
+        # 非标准尾部（如 '2026-02-20 10:00 EST'）：只取日期部分
+        try:
+            dt = datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        except ValueError:
+            return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _dmy(s):
+    m = _DMY_RE.match(s)
+    if not m:
+        return None
+    month = _MONTHS.get(m.group(2)[:3].lower())
+    if not month:
+        return None
+    try:
+        return datetime(int(m.group(3)), month, int(m.group(1)), tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+_PARSERS = {"rfc822": _rfc822, "iso": _iso, "dmy": _dmy}
+
+
+def parse(s, feed=None):
+    """日期字符串 → 带时区 datetime；无法解析返回 None"""
+    s = (s or "").strip()
+    if not s:
+        return None
+    fast = _sniffed.get(feed) if feed else None
+    if fast:
+        dt = _PARSERS[fast](s)
+        if dt:
+            return dt
+    for name, fn in _PARSERS.items():
+        if name == fast:
+            continue
+        dt = fn(s)
+        if dt:
+            if feed:
+                with _lock:
+                    _sniffed[feed] = name
+            return dt
+    return None
+
+
+def to_sgt_date(s, feed=None):
+    """日期字符串 → SGT 'YYYY-MM-DD'；无法解析返回空串"""
+    dt = parse(s, feed)
+    return dt.astimezone(SGT).strftime("%Y-%m-%d") if dt else ""
+
+
+def to_sgt_dates(strings, feed=None):
+    """批量转换（同一 feed 共用嗅探结果；重复的原始字符串只解析一次）"""
+    memo = {}
+    out = []
+    for s in strings:
+        if s not in memo:
+            memo[s] = to_sgt_date(s, feed)
+        out.append(memo[s])
+    return out
+
+
+def parse_day_month_year(raw):
+    """'20th February 2026' → '2026-02-20'；无法解析返回空串"""
+    dt = _dmy((raw or "").strip())
+    return dt.strftime("%Y-%m-%d") if dt else ""
+
+
+def from_date_parts(parts):
+    """CrossRef date-parts [2026, 2, 20] → '2026-02-20'；不完整返回空串"""
+    if len(parts) < 3:
+        return ""
+    try:
+        return f"{int(parts[0]):04d}-{int(parts[1]):02d}-{int(parts[2]):02d}"
+    except (TypeError, ValueError):
+        return ""
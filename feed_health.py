@@ -0,0 +1,137 @@
+"""
+feed_health.py — 各 RSS 源的健康记录、自适应超时与熔断（fetch_jobs / fetch_reports 共用）
+- 每个源持久化到 STATE_DIR：最近成功率、p50 / p95 延迟、最近一次错误
+- 超时：样本足够时取 p95 × TIMEOUT_FACTOR + TIMEOUT_SLACK，夹在 [MIN_TIMEOUT, 调用方默认值] 之间；
+  上一次因超时失败、或处于半开探测时改用调用方默认值（延迟样本只来自成功请求，
+  源变慢后自适应超时不会自己变大）
+- 熔断：连续失败 BREAKER_THRESHOLD 次后打开，冷却期内直接跳过；冷却期满放行一次半开探测，
+  探测成功即关闭，失败则冷却期翻倍（上限 BREAKER_MAX_COOLDOWN）
+用法：
+  try:
+      with feed_health.probe(url, 15) as timeout:
+          ... urlopen(req, timeout=timeout) ...
+  except feed_health.CircuitOpen as e:
+      print(f"跳过: {e}")
+"""
+import os, threading, time
+from contextlib import contextmanager
+
+from state_store import state_path, load_json, save_json
+
+HEALTH_FILE          = state_path("feed_health.json")
+MIN_SAMPLES          = 5
+MAX_SAMPLES          = 30
+MIN_TIMEOUT          = 4.0
+TIMEOUT_FACTOR       = 1.5
+TIMEOUT_SLACK        = 1.0
+BREAKER_THRESHOLD    = 3
+BREAKER_COOLDOWN     = float(os.environ.get("FEED_BREAKER_COOLDOWN", str(12 * 3600)))   # 秒
+BREAKER_MAX_COOLDOWN = 7 * 24 * 3600
+
+_lock    = threading.Lock()
+_records = None
+_touched = set()
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def _load():
+    global _records
+    if _records is None:
+        _records = load_json(HEALTH_FILE, {})
+    return _records
+
+
+def _record(key):
+    return _load().setdefault(key, {
+        "latencies": [], "outcomes": [], "failures": 0,
+        "open_until": 0, "cooldown": 0, "last_error": "", "last_ok": 0, "timed_out": False,
+    })
+
+
+def _percentile(values, pct):
+    s = sorted(values)
+    return s[min(len(s) - 1, int(len(s) * pct / 100))]
+
+
+def _is_timeout(error):
+    return isinstance(error, TimeoutError) or isinstance(getattr(error, "reason", None), TimeoutError)
+
+
+def timeout_for(key, default):
+    with _lock:
+        r   = _load().get(key, {})
+        lat = list(r.get("latencies", []))
+    # 上次超时 / 半开探测（熔断打开过、尚未成功关闭）：给足默认超时
+    if len(lat) < MIN_SAMPLES or r.get("timed_out") or r.get("open_until"):
+        return default
+    t = _percentile(lat, 95) * TIMEOUT_FACTOR + TIMEOUT_SLACK
+    return round(min(default, max(MIN_TIMEOUT, t)), 1)
+
+
+def allow(key):
+    """熔断打开且仍在冷却期内时返回 False；冷却期已过则放行（半开探测）"""
+    with _lock:
+        return time.time() >= _load().get(key, {}).get("open_until", 0)
+
+
+def record(key, ok, seconds, error=None):
+    with _lock:
+        r = _record(key)
+        r["outcomes"] = (r["outcomes"] + [1 if ok else 0])[-MAX_SAMPLES:]
+        if ok:
+            r["latencies"] = (r["latencies"] + [round(seconds, 2)])[-MAX_SAMPLES:]
+            r["failures"], r["cooldown"], r["open_until"] = 0, 0, 0
+            r["last_ok"] = int(time.time())
+            r["timed_out"] = False
+        else:
+            r["failures"] += 1
+            r["last_error"] = str(error)[:200]
+            r["timed_out"] = _is_timeout(error)
+            if r["failures"] >= BREAKER_THRESHOLD:
+                # 首次打开用基础冷却期；半开探测失败则翻倍
+                r["cooldown"] = min(BREAKER_MAX_COOLDOWN,
+                                    r["cooldown"] * 2 if r["cooldown"] else BREAKER_COOLDOWN)
+                r["open_until"] = int(time.time() + r["cooldown"])
+        _touched.add(key)
+
+
+@contextmanager
+def probe(key, default_timeout):
+    """熔断检查 + 自适应超时 + 结果记录；块内抛出的异常计为失败并继续向外抛"""
+    if not allow(key):
+        with _lock:
+            r = _load()[key]
+        until = time.strftime("%m-%d %H:%M", time.localtime(r["open_until"]))
+        raise CircuitOpen(f"连续失败 {r['failures']} 次，熔断至 {until}（{r['last_error']}）")
+    t0 = time.monotonic()
+    try:
+        yield timeout_for(key, default_timeout)
+    except Exception as e:
+        record(key, False, time.monotonic() - t0, e)
+        raise
+    record(key, True, time.monotonic() - t0)
+
+
+def stats(key):
+    """(成功率, p50, p95, 最近错误)；无记录返回 None"""
+    with _lock:
+        r = _load().get(key)
+        if not r or not r["outcomes"]:
+            return None
+        lat = r["latencies"] or [0.0]
+        return (sum(r["outcomes"]) / len(r["outcomes"]),
+                _percentile(lat, 50), _percentile(lat, 95), r["last_error"])
+
+
+def save():
+    """只写回本次运行触及的源，与并行运行的其他流程合并"""
+    with _lock:
+        if not _touched:
+            return
+        updates = {k: _records[k] for k in _touched}
+    stored = load_json(HEALTH_FILE, {})
+    stored.update(updates)
+    save_json(HEALTH_FILE, stored)
@@ -1,22 +1,34 @@
 #!/usr/bin/env python3
 """
 fetch_jobs.py — 从多个学术招聘网站抓取职位，写入 Google Sheets（工作 tab）
-来源：jobs.ac.uk（按学科 RSS）、Times Higher Education Jobs（全球 RSS + 关键词过滤）、ReliefWeb RSS
+来源：jobs.ac.uk（按学科 RSS）、Times Higher Education Jobs（全球 RSS + 关键词过滤）、
+      ReliefWeb（设置 RELIEFWEB_APPNAME 时走 API，否则 RSS）
 用法：
   python fetch_jobs.py           # 增量模式（跳过已见职位）
   python fetch_jobs.py --all     # 全量模式（忽略 seen 记录，写入全部当前职位）
   python fetch_jobs.py --the-only  # 只跑 THE Jobs，快速测试
   python fetch_jobs.py --week    # 限速模式：jobs.ac.uk 每科只取5条，用于本地验证
 列：发现日期 | 学科 | 机构 | 职位 | 薪资 | 申请截止日期 | 申请链接 | 来源
+输出后端：默认 Google Sheets；OUTPUT_SINKS=sheets,sqlite,jsonl,parquet 可多选（见 sinks.py）
 """
 
-import re, sys, json, html, subprocess, os, time, random
+import re, sys, json, html, subprocess, os, time, random, codecs, threading
 from datetime import datetime, timedelta, timezone
 from xml.etree import ElementTree as ET
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import urllib.request
-import gspread
-from google.oauth2.service_account import Credentials
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import urllib.parse, urllib.request
+from text_match import KeywordMatcher
+import redirects
+import http_transport
+import feed_health
+import deadline
+import feed_dates
+import run_log
+import sinks
+import sheets_client
+from state_store import state_path, load_json, save_json
 
 # ── 配置 ─────────────────────────────────────────────────────────────────
 SHEET_ID    = "1MCcEqV2OGkxFofWSRI6BW2OFYG35cNDHC2olbm43NWc"
@@ -28,6 +40,8 @@ _date_from  = (_now - timedelta(days=7)).strftime("%Y/%m/%d")
 _date_to    = _now.strftime("%Y/%m/%d")
 DATE_LABEL  = f"{_date_from}-{_date_to}"
 SEEN_FILE   = "/tmp/seen_jobs.json"   # Cloud Run 只有 /tmp 可写
+CHECKPOINT_FILE  = state_path("jobs_checkpoint.json")
+CHECKPOINT_EVERY = 20     # 每抓完多少个详情页保存一次断点
 
 RESET_ALL   = "--all"      in sys.argv
 THE_ONLY    = "--the-only" in sys.argv
@@ -46,6 +60,38 @@ _CURL_BASE = [
     "-H", "Accept-Encoding: gzip, deflate, br",
     "-H", "Connection: keep-alive",
 ]
+# 详情页流式抓取：必需字段一齐就断开连接（DETAIL_STREAM=0 关闭，退回整页下载）
+DETAIL_STREAM      = os.environ.get("DETAIL_STREAM", "1") != "0"
+# 支持 Range 的主机（逗号分隔）：先只取前 DETAIL_RANGE_BYTES 字节，字段不齐再流式抓整页
+DETAIL_RANGE_HOSTS = {h.strip() for h in os.environ.get("DETAIL_RANGE_HOSTS", "").split(",") if h.strip()}
+DETAIL_RANGE_BYTES = int(os.environ.get("DETAIL_RANGE_BYTES", "131072"))
+# RSS 发现阶段：所有 feed 并发抓取，总线程数 FEED_FETCH_THREADS，同一主机最多 FEED_HOST_LIMIT 个
+FEED_FETCH_THREADS = int(os.environ.get("FEED_FETCH_THREADS", "12"))
+FEED_HOST_LIMIT    = int(os.environ.get("FEED_HOST_LIMIT", "4"))
+# 详情页解析进程数：默认取实例可用 CPU 数（受 cgroup CPU 配额限制，Cloud Run 的 vCPU 配额
+# 不会反映在 sched_getaffinity 里）；≤1 时在抓取线程内直接解析
+DETAIL_FETCH_THREADS = 5
+
+def _available_cpus():
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    # cgroup v2: "<quota> <period>" 或 "max <period>"；v1: cfs_quota_us / cfs_period_us
+    for quota_file, period_file in (("/sys/fs/cgroup/cpu.max", None),
+                                    ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us",
+                                     "/sys/fs/cgroup/cpu/cpu.cfs_period_us")):
+        try:
+            with open(quota_file) as f:
+                fields = f.read().split()
+            if period_file:
+                with open(period_file) as f:
+                    fields.append(f.read().strip())
+        except OSError:
+            continue
+        if len(fields) >= 2 and fields[0] not in ("max", "-1"):
+            cpus = min(cpus, int(int(fields[0]) / int(fields[1])))
+        break
+    return max(1, cpus)
+
+DETAIL_PARSE_WORKERS = int(os.environ.get("DETAIL_PARSE_WORKERS", "0")) or _available_cpus()
 
 # ── THE Jobs 配置 ─────────────────────────────────────────────────────────
 THE_RSS_FEEDS = [
@@ -96,6 +142,7 @@ THE_KEYWORD_MAP = [
     ("public policy",           "Other Social Sciences"),
     ("demography",              "Other Social Sciences"),
 ]
+_THE_MATCHER = KeywordMatcher(THE_KEYWORD_MAP)   # 编译一次，保持表中靠前者优先
 
 # ── jobs.ac.uk 学科配置 ────────────────────────────────────────────────────
 SUBJECT_FEEDS = [
@@ -130,6 +177,53 @@ RW_RSS_FEEDS = [
     ("Query",           "https://reliefweb.int/jobs/rss.xml?query%5Bvalue%5D=social+science"),
 ]
 
+# ── ReliefWeb API 配置 ────────────────────────────────────────────────────
+# 设置 RELIEFWEB_APPNAME（在 ReliefWeb 登记的 appname）后改走 v2 API：分页查询一次拿到
+# 机构、截止日期和链接，不再逐条抓详情页；未设置或 API 失败时退回上面的 RSS + 详情页
+RELIEFWEB_APPNAME = os.environ.get("RELIEFWEB_APPNAME", "")
+RW_API_URL        = "https://api.reliefweb.int/v2/jobs"
+RW_API_LIMIT      = 200
+RW_API_MAX_PAGES  = 5
+RW_API_FIELDS     = ["title", "url", "url_alias", "source.name", "date.created", "date.closing"]
+# 与 RW_RSS_FEEDS 一一对应
+RW_API_QUERIES = [
+    ("Social Sciences", {"filter": {"field": "career_categories.id", "value": 5}}),
+    ("Query",           {"query": {"value": "social science"}}),
+]
+
+# ── 断点续跑 ──────────────────────────────────────────────────────────────
+# 阶段：fetched（RSS 候选已确定）→ writing（开始写入）→ written（已写入，待更新 seen）
+# writing 阶段逐后端记录已写完的后端（written_sinks），续跑时只写其余后端
+# 同一抓取窗口 + 模式的未完成运行从断点继续：已抓详情页不重抓，已写入的不重复写
+def _run_key():
+    return f"{DATE_LABEL}|{'all' if RESET_ALL else 'week' if WEEK_MODE else 'inc'}|{int(THE_ONLY)}"
+
+def load_checkpoint():
+    cp = load_json(CHECKPOINT_FILE, None)
+    return cp if cp and cp.get("key") == _run_key() else None
+
+def save_checkpoint(phase, jobs_by_subject, all_links, enriched, written_sinks=()):
+    save_json(CHECKPOINT_FILE, {
+        "key": _run_key(), "phase": phase, "ts": int(time.time()),
+        "jobs": jobs_by_subject, "all_links": sorted(all_links), "enriched": sorted(enriched),
+        "written_sinks": sorted(written_sinks),
+    })
+
+def clear_checkpoint():
+    save_json(CHECKPOINT_FILE, None)
+
+def _already_in_sheet(jobs_by_subject):
+    """上次运行在 writing 阶段中断：检查表格顶部是否已有这批职位的申请链接"""
+    wanted = {j["apply"] for subj in TARGET_SUBJECTS for j in jobs_by_subject[subj]}
+    try:
+        ws = sheets_client.open_worksheet(SHEET_ID, SHEET_RANGE)
+        col = ws.batch_get([f"G2:G{len(wanted) * 2 + 10}"])[0]
+    except Exception as e:
+        print(f"⚠️  无法核对上次写入（按未写入处理）: {e}")
+        return False
+    return wanted <= {row[0] for row in col if row}
+
+
 # ── 已见职位记录 ──────────────────────────────────────────────────────────
 def load_seen():
     if RESET_ALL:
@@ -174,28 +268,6 @@ _MONTHS = (r'Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|Jun(?:e)?'
            r'|Jul(?:y)?|Aug(?:ust)?|Sep(?:tember)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?')
 _DATE_PAT = rf'\d{{1,2}}\s+(?:{_MONTHS})\s+\d{{4}}'
 
-_MONTHS_MAP = {"january":1,"february":2,"march":3,"april":4,"may":5,"june":6,
-               "july":7,"august":8,"september":9,"october":10,"november":11,"december":12}
-
-def _parse_go_live(raw):
-    """'20th February 2026' → '2026-02-20'"""
-    m = re.match(r'(\d{1,2})(?:st|nd|rd|th)?\s+(\w+)\s+(\d{4})',
-                 (raw or "").strip(), re.IGNORECASE)
-    if m:
-        d, mon, y = int(m.group(1)), m.group(2).lower(), int(m.group(3))
-        mo = _MONTHS_MAP.get(mon)
-        if mo:
-            return f"{y}-{mo:02d}-{d:02d}"
-    return ""
-
-def _parse_pubdate(date_str):
-    """解析 RSS pubDate（RFC 2822）→ 带时区 datetime；失败返回 None"""
-    from email.utils import parsedate_to_datetime
-    try:
-        return parsedate_to_datetime(date_str.strip())
-    except Exception:
-        return None
-
 # ── HTTP（curl）─────────────────────────────────────────────────────────
 def _curl_get(url):
     """curl 抓页面，返回 HTML 字符串；失败返回空串"""
@@ -205,22 +277,116 @@ def _curl_get(url):
     except Exception:
         return ""
 
-def _curl_head_location(url):
-    """curl HEAD 跟随重定向，返回最终 URL（用于 /click/ 跳转）"""
+def _curl_stream_until(url, done, markers=(), chunk_size=16384):
+    """curl 流式抓页面，用 done(text) 检查必需字段；齐了立即断开连接
+    markers：小写的结束标记；给出时只在新到的一块（连同上一块末尾，防止标记跨块）
+    出现某个标记时才对全文做 done 检查，避免每块都重新拼接、扫描整页
+    done 从未满足时读到 EOF，结果与 _curl_get 相同；失败返回空串"""
+    try:
+        proc = subprocess.Popen(_CURL_BASE + [url],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except Exception:
+        return ""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    overlap = 64 if markers else 0   # 覆盖跨块的标记及其后的少量字符（如 "};" 后的换行）
+    parts, tail = [], ""
     try:
-        result = subprocess.run(
-            ["curl", "-sI", "-L", "--max-time", "10",
-             "-H", "User-Agent: Mozilla/5.0 Chrome/120.0.0.0", url],
-            capture_output=True, timeout=15)
-        text = result.stdout.decode("utf-8", errors="replace")
-        locations = re.findall(r'^Location:\s*(\S+)', text, re.IGNORECASE | re.MULTILINE)
-        if locations:
-            last = locations[-1]
-            if last.startswith('http'):
-                return last
+        while True:
+            data = proc.stdout.read1(chunk_size)
+            if not data:
+                parts.append(decoder.decode(b"", final=True))
+                break
+            text = decoder.decode(data)
+            parts.append(text)
+            window = (tail + text).lower()
+            tail = window[-overlap:] if overlap else ""
+            if markers and not any(m in window for m in markers):
+                continue
+            if done("".join(parts)):
+                break
     except Exception:
         pass
-    return url
+    finally:
+        if proc.poll() is None:
+            proc.kill()   # 提前结束：关闭连接，不再下载剩余的脚本和样板
+        proc.wait()
+    return "".join(parts)
+
+def _curl_get_range(url, nbytes):
+    """HTTP Range 只取前 nbytes 字节（不压缩，避免截断的 gzip 流无法解码）"""
+    cmd, args = [], iter(_CURL_BASE)
+    for a in args:
+        if a == "--compressed":
+            continue
+        if a == "-H":
+            header = next(args)
+            if not header.lower().startswith("accept-encoding"):
+                cmd += [a, header]
+            continue
+        cmd.append(a)
+    try:
+        result = subprocess.run(cmd + ["-r", f"0-{nbytes - 1}", url],
+                                capture_output=True, timeout=25)
+        return result.stdout.decode("utf-8", errors="replace")
+    except Exception:
+        return ""
+
+# ── 详情页必需字段判定（用于提前断开连接）───────────────────────────────
+_LD_JSON_RE = re.compile(
+    r'<script[^>]*type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.DOTALL)
+
+def _ld_json_blocks(page):
+    for blk in _LD_JSON_RE.findall(page):
+        try:
+            d = json.loads(blk.strip())
+        except Exception:
+            continue
+        if isinstance(d, dict):
+            yield d
+
+def _jobs_ac_complete(page):
+    """var job JSON 已完整，且截止日期、发布日期、站外申请链接都在 JSON 里"""
+    job = _parse_job_json(page)
+    if not job:
+        return False
+    has_closing = any(job.get(k) for k in ("closing_date", "expiring_date", "date_closing", "date_expire"))
+    has_posted  = bool(job.get("go_live_date") or job.get("date_publish"))
+    apply       = str(job.get("apply_url") or "")
+    return has_closing and has_posted and apply.startswith("http") and "jobs.ac.uk" not in apply
+
+def _the_complete(page):
+    """applicationUrl 与 JSON-LD validThrough 都已出现"""
+    if not re.search(r'"applicationUrl"\s*:\s*"[^"]+"', page, re.IGNORECASE):
+        return False
+    return any(d.get("validThrough") for d in _ld_json_blocks(page))
+
+def _rw_complete(page):
+    """JSON-LD hiringOrganization 与文本截止日期都已出现"""
+    if not re.search(r'[Cc]losing\s+[Dd]ate\s*[:\-]?\s*(' + _DATE_PAT + r')', page, re.IGNORECASE):
+        return False
+    return any(isinstance(d.get("hiringOrganization"), dict) and d["hiringOrganization"].get("name")
+               for d in _ld_json_blocks(page))
+
+# 各站点的完整性判定与触发标记：必需字段里最后到达的那一段必然以其中某个标记结尾
+# （var job JSON 的 "};"、JSON-LD 的 </script>、applicationUrl / closing date 文本）
+def _detail_complete_check(url):
+    if "timeshighereducation.com" in url:
+        return _the_complete, ("</script>", '"applicationurl"')
+    if "reliefweb.int" in url:
+        return _rw_complete, ("</script>", "closing")
+    return _jobs_ac_complete, ("};",)
+
+def _fetch_detail_page(url):
+    """详情页抓取：Range 前缀 → 流式提前断开 → 整页（各模式字段不齐时逐级退回）"""
+    if not DETAIL_STREAM:
+        return _curl_get(url)
+    done, markers = _detail_complete_check(url)
+    host = re.sub(r'^https?://([^/]+).*$', r'\1', url)
+    if host in DETAIL_RANGE_HOSTS:
+        page = _curl_get_range(url, DETAIL_RANGE_BYTES)
+        if page and done(page):
+            return page
+    return _curl_stream_until(url, done, markers)
 
 # ── 职位详情页抓取 ────────────────────────────────────────────────────────
 def _parse_job_json(page):
@@ -235,17 +401,38 @@ def _parse_job_json(page):
         return {}
 
 def scrape_detail(url):
-    """返回 (closing_date, apply_url, posted_date, inst)
+    """返回 (closing_date, apply_url, posted_date, inst)：抓取 + 解析 + /click/ 链接处理"""
+    page = fetch_detail(url)
+    if not page:
+        return "", url, "", ""
+    return finish_detail(parse_detail(url, page))
+
+def fetch_detail(url):
+    """详情页网络部分（含随机延迟）；失败返回空串"""
+    time.sleep(random.uniform(0.3, 1.2))
+    try:
+        return _fetch_detail_page(url) or ""
+    except Exception:
+        return ""
+
+def finish_detail(parsed, dl=deadline.NEVER):
+    """在抓取线程中完成需要状态的部分：/click/ 链接查重定向缓存或生成解析端点链接
+    （inline 模式未命中时当场 HEAD 解析；dl 剩余不足时保留原 /click/ 链接）"""
+    closing, apply_url, posted_date, inst, click_url = parsed
+    if click_url:
+        # 查重定向缓存；延迟模式下只写解析端点链接，首次点击时才解析
+        apply_url = redirects.apply_link(click_url, dl)
+    return closing, apply_url, posted_date, inst
+
+def parse_detail(url, page):
+    """纯解析（无网络、无共享状态，可在子进程中运行），返回
+    (closing_date, apply_url, posted_date, inst, click_url)
     - jobs.ac.uk : var job JSON → closing / apply / go_live_date；inst=""
     - THE Jobs   : JSON-LD validThrough → closing；applicationUrl → apply；inst=""
     - ReliefWeb  : 详情页提取机构名和截止日期；apply_url 直接用 reliefweb.int 页面
+    - click_url  : jobs.ac.uk 只找到 /click/ 跳转链接时返回它，由 finish_detail 处理
     """
-    time.sleep(random.uniform(0.3, 1.2))
     try:
-        page = _curl_get(url)
-        if not page:
-            return "", url, "", ""
-
         is_the = "timeshighereducation.com" in url
         is_rw  = "reliefweb.int"           in url
         closing, apply_url, posted_date, inst = "", url, "", ""
@@ -295,7 +482,7 @@ def scrape_detail(url):
                 if cd_m:
                     closing = cd_m.group(1)
 
-            return closing, apply_url, posted_date, inst
+            return closing, apply_url, posted_date, inst, ""
 
         # ══ THE Jobs ═══════════════════════════════════════════════════
         if is_the:
@@ -344,7 +531,7 @@ def scrape_detail(url):
                         closing = mc.group(1).strip()
                         break
 
-            return closing, apply_url, posted_date, inst   # inst="" for THE Jobs
+            return closing, apply_url, posted_date, inst, ""   # inst="" for THE Jobs
 
         # ══ jobs.ac.uk ═════════════════════════════════════════════════
         job_data = _parse_job_json(page)
@@ -384,7 +571,7 @@ def scrape_detail(url):
         if job_data:
             gl = job_data.get("go_live_date", "")
             if gl:
-                posted_date = _parse_go_live(str(gl))
+                posted_date = feed_dates.parse_day_month_year(str(gl))
             if not posted_date:
                 dp = job_data.get("date_publish")
                 if isinstance(dp, (int, float)) and dp:
@@ -414,19 +601,17 @@ def scrape_detail(url):
                 r'href=["\']?(https?://(?:www\.)?jobs\.ac\.uk/job/[^"\'>\s]+/click/[^"\'>\s]*)',
                 page, re.IGNORECASE)
             if m3:
-                click_url = m3.group(1)
-                final = _curl_head_location(click_url)
-                apply_url = final if (final and 'jobs.ac.uk' not in final) else click_url
+                return closing, apply_url, posted_date, "", m3.group(1)
 
         if apply_url == url:
             m4 = re.search(r'href=["\']?(/job/[^"\'>\s]+/apply/?[^"\'>\s]*)', page, re.IGNORECASE)
             if m4:
                 apply_url = BASE + m4.group(1)
 
-        return closing, apply_url, posted_date, ""   # inst="" for jobs.ac.uk
+        return closing, apply_url, posted_date, "", ""   # inst="" for jobs.ac.uk
 
     except Exception:
-        return "", url, "", ""
+        return "", url, "", "", ""
 
 
 # ── jobs.ac.uk RSS 抓取 ───────────────────────────────────────────────────
@@ -434,13 +619,16 @@ def fetch_rss(subject, path):
     url = BASE + path
     try:
         req = urllib.request.Request(url, headers=RSS_HEADERS)
-        with urllib.request.urlopen(req, timeout=20) as r:
-            content = r.read()
-        content = _fix_entities(content)
-        root  = ET.fromstring(content)
+        with feed_health.probe(url, 20) as timeout:
+            with http_transport.urlopen(req, timeout=timeout) as r:
+                content = r.read()
+            root = ET.fromstring(_fix_entities(content))
         items = root.findall(".//item")
         print(f"  [{subject}] {len(items)} 条")
         return items
+    except feed_health.CircuitOpen as e:
+        print(f"  [{subject}] 跳过，{e}")
+        return []
     except Exception as e:
         print(f"  [{subject}] 失败: {e}")
         return []
@@ -449,30 +637,51 @@ def fetch_rss(subject, path):
 # ── THE Jobs 抓取 ────────────────────────────────────────────────────────
 def _the_classify(title, desc):
     """关键词映射学科；无匹配返回 None"""
-    text = (title + " " + desc).lower()
-    for keyword, subject in THE_KEYWORD_MAP:
-        if keyword in text:
-            return subject
-    return None
-
-def fetch_the_jobs(seen):
-    """从 THE Jobs 多个关键词 RSS 抓取职位，用 pubDate 过滤最近 THE_DAYS 天"""
+    return _THE_MATCHER.first(title + " " + desc)
+
+def _fetch_the_feed(feed_label, url):
+    """抓取一个 THE 关键词 RSS，返回 item 列表；失败返回空列表"""
+    try:
+        with feed_health.probe(url, 20) as timeout:
+            # 后出现的 --max-time 覆盖 _CURL_BASE 里的默认值
+            try:
+                result = subprocess.run(_CURL_BASE + ["--max-time", str(timeout), url],
+                                        capture_output=True, timeout=timeout + 5)
+            except subprocess.TimeoutExpired:
+                raise TimeoutError(f"curl 超时（{timeout}s）")
+            # 先看退出码：28 = 超时（记为超时，下次给足默认超时），其他非零 = 网络 / HTTP 错误；
+            # 不让空的或截断的输出落到 XML 解析里变成 ParseError
+            if result.returncode == 28:
+                raise TimeoutError(f"curl 超时（{timeout}s）")
+            if result.returncode != 0:
+                raise RuntimeError(f"curl 退出码 {result.returncode}")
+            root = ET.fromstring(_fix_entities(result.stdout))
+        return root.findall(".//item")
+    except feed_health.CircuitOpen as e:
+        print(f"  [THE/{feed_label}] 跳过，{e}")
+    except Exception as e:
+        print(f"  [THE/{feed_label}] 失败: {e}")
+    return []
+
+def _the_feed_tasks():
+    return [("timeshighereducation.com", lambda lb=lb, u=u: _fetch_the_feed(lb, u))
+            for lb, u in THE_RSS_FEEDS]
+
+def fetch_the_jobs(seen, feed_items=None):
+    """从 THE Jobs 多个关键词 RSS 抓取职位，用 pubDate 过滤最近 THE_DAYS 天
+    feed_items：与 THE_RSS_FEEDS 一一对应的已抓取结果（fetch_all 并发抓好后传入；None 表示未抓取）；
+    不传时在这里并发抓取。合并按 THE_RSS_FEEDS 顺序进行，跨 feed 去重结果与逐个抓取时相同"""
     from datetime import timezone as _tz
     cutoff     = datetime.now(_tz.utc) - timedelta(days=THE_DAYS)
     seen_links = set()
     all_links  = set()
     new_jobs   = []
+    if feed_items is None:
+        feed_items = _fetch_feeds(_the_feed_tasks())
 
-    for feed_label, url in THE_RSS_FEEDS:
-        try:
-            result  = subprocess.run(_CURL_BASE + [url], capture_output=True, timeout=25)
-            content = _fix_entities(result.stdout)
-            root    = ET.fromstring(content)
-            items   = root.findall(".//item")
-        except Exception as e:
-            print(f"  [THE/{feed_label}] 失败: {e}")
-            continue
-
+    for (feed_label, url), items in zip(THE_RSS_FEEDS, feed_items):
+        if items is None:
+            continue      # 截止时间到，未抓取
         new_in_feed = 0
         for item in items:
             raw_link = (item.findtext("link") or "").strip()
@@ -485,7 +694,7 @@ def fetch_the_jobs(seen):
                 continue
             seen_links.add(link)
 
-            pub_dt = _parse_pubdate(item.findtext("pubDate", ""))
+            pub_dt = feed_dates.parse(item.findtext("pubDate", ""), feed=url)
             if not RESET_ALL:
                 if pub_dt and pub_dt < cutoff:
                     continue
@@ -541,10 +750,10 @@ def fetch_reliefweb_rss(seen, all_links):
     for label, url in RW_RSS_FEEDS:
         try:
             req = urllib.request.Request(url, headers=RSS_HEADERS)
-            with urllib.request.urlopen(req, timeout=20) as r:
-                content = r.read()
-            content = _fix_entities(content)
-            root  = ET.fromstring(content)
+            with feed_health.probe(url, 20) as timeout:
+                with http_transport.urlopen(req, timeout=timeout) as r:
+                    content = r.read()
+                root = ET.fromstring(_fix_entities(content))
             items = root.findall(".//item")
             added = 0
             for item in items:
@@ -554,7 +763,7 @@ def fetch_reliefweb_rss(seen, all_links):
                 seen_here.add(link)
 
                 pub_raw  = item.findtext("pubDate", "")
-                pub_dt   = _parse_pubdate(pub_raw)
+                pub_dt   = feed_dates.parse(pub_raw, feed=url)
                 job_date = pub_dt.astimezone(SGT).strftime("%Y-%m-%d") if pub_dt else TODAY
 
                 title_raw = (item.findtext("title") or "").strip()
@@ -593,24 +802,119 @@ def fetch_reliefweb_rss(seen, all_links):
                 added += 1
 
             print(f"  [ReliefWeb/{label}] {len(items)} 条RSS → {added} 条新")
+        except feed_health.CircuitOpen as e:
+            print(f"  [ReliefWeb/{label}] 跳过，{e}")
         except Exception as e:
             print(f"  [ReliefWeb/{label}] 失败: {e}")
 
     return results
 
 
+# ── ReliefWeb API 抓取 ────────────────────────────────────────────────────
+def _rw_api_page(spec, offset, since):
+    body = {
+        "offset": offset, "limit": RW_API_LIMIT,
+        "sort":   ["date.created:desc"],
+        "fields": {"include": RW_API_FIELDS},
+    }
+    conditions = [{"field": "date.created", "value": {"from": since}}]
+    if "filter" in spec:
+        conditions.append(spec["filter"])
+    body["filter"] = {"operator": "AND", "conditions": conditions}
+    if "query" in spec:
+        body["query"] = spec["query"]
+    url = f"{RW_API_URL}?appname={urllib.parse.quote(RELIEFWEB_APPNAME)}"
+    with feed_health.probe(RW_API_URL, 30) as timeout:
+        with http_transport.request("POST", url, {"Content-Type": "application/json"},
+                                    json.dumps(body).encode("utf-8"), timeout) as r:
+            return json.loads(r.read())
+
+def fetch_reliefweb_api(seen, all_links):
+    """ReliefWeb v2 API：按抓取窗口分页查询，字段齐全，无需详情页；
+    任一查询失败返回 None（由调用方退回 RSS）"""
+    results   = []
+    seen_here = seen | all_links
+    since     = datetime.strptime(_date_from, "%Y/%m/%d").replace(tzinfo=SGT).isoformat()
+
+    for label, spec in RW_API_QUERIES:
+        try:
+            total = added = 0
+            for page in range(RW_API_MAX_PAGES):
+                data  = _rw_api_page(spec, page * RW_API_LIMIT, since)
+                items = data.get("data", [])
+                total += len(items)
+                for item in items:
+                    f    = item.get("fields", {})
+                    link = f.get("url_alias") or f.get("url") or ""
+                    if not link or link in seen_here:
+                        continue
+                    seen_here.add(link)
+                    dates   = f.get("date", {})
+                    sources = f.get("source") or [{}]
+                    results.append({
+                        "source":  "ReliefWeb",
+                        "date":    feed_dates.to_sgt_date(dates.get("created", ""), feed=RW_API_URL) or TODAY,
+                        "inst":    (sources[0].get("name") or "").strip(),
+                        "title":   (f.get("title") or "").strip(),
+                        "salary":  "",
+                        "link":    link,
+                        "closing": (dates.get("closing") or "")[:10],   # YYYY-MM-DD
+                        "apply":   link,    # reliefweb.int 页面（含申请信息）
+                        "api":     True,    # 字段已齐，enrich 不抓详情页
+                    })
+                    added += 1
+                if len(items) < RW_API_LIMIT or total >= data.get("totalCount", 0):
+                    break
+            print(f"  [ReliefWeb API/{label}] {total} 条 → {added} 条新")
+        except feed_health.CircuitOpen as e:
+            print(f"  [ReliefWeb API/{label}] 跳过，{e}")
+            return None
+        except Exception as e:
+            print(f"  [ReliefWeb API/{label}] 失败: {e}")
+            return None
+
+    return results
+
+
 # ── 主抓取流程 ────────────────────────────────────────────────────────────
-def fetch_all(seen):
+def _fetch_feeds(tasks, dl=deadline.NEVER):
+    """并发抓取 [(host, fetch_fn), ...]：同一主机最多 FEED_HOST_LIMIT 个并发。
+    结果按 tasks 顺序返回（截止时间到后未开始的为 None），合并逻辑与逐个抓取时一致"""
+    host_slots = {host: threading.Semaphore(FEED_HOST_LIMIT) for host, _ in tasks}
+
+    def run(host, fn):
+        with host_slots[host]:
+            return None if dl.expired() else fn()
+
+    with ThreadPoolExecutor(max_workers=max(1, FEED_FETCH_THREADS)) as ex:
+        futures = [ex.submit(run, host, fn) for host, fn in tasks]
+        return [f.result() for f in futures]
+
+def fetch_all(seen, dl=deadline.NEVER):
+    """dl：抓取阶段截止时间，到期后跳过其余来源
+    jobs.ac.uk 各学科与 THE 各关键词 feed 先一起并发抓取，再按原顺序逐个合并"""
     jobs_by_subject = {s: [] for s in TARGET_SUBJECTS}
     all_links = set()
 
+    subject_tasks = [] if THE_ONLY else [
+        ("jobs.ac.uk", lambda s=s, p=p: fetch_rss(s, p)) for s, p in SUBJECT_FEEDS]
+    the_tasks = _the_feed_tasks()
+    print(f"\n并发抓取 {len(subject_tasks) + len(the_tasks)} 个 RSS"
+          f"（{FEED_FETCH_THREADS} 线程，每主机 ≤{FEED_HOST_LIMIT}）...")
+    fetched = _fetch_feeds(subject_tasks + the_tasks, dl)
+    subject_items, the_items = fetched[:len(subject_tasks)], fetched[len(subject_tasks):]
+
     # 1. jobs.ac.uk
     print("\n--- jobs.ac.uk ---")
     if THE_ONLY:
         print("  (跳过，--the-only 模式)")
     else:
-        for subject, path in SUBJECT_FEEDS:
-            items = fetch_rss(subject, path)
+        skipped = sum(1 for items in subject_items if items is None)
+        if skipped:
+            print(f"  ⏰ 抓取阶段时间预算用尽，跳过 {skipped} 个学科")
+        for (subject, path), items in zip(SUBJECT_FEEDS, subject_items):
+            if items is None:
+                continue
             # --week 模式：每学科只取前5条，加速本地验证
             if WEEK_MODE:
                 items = items[:2]
@@ -637,64 +941,132 @@ def fetch_all(seen):
 
     # 2. THE Jobs
     print("\n--- THE Jobs ---")
-    the_jobs, the_links = fetch_the_jobs(seen)
+    the_jobs, the_links = fetch_the_jobs(seen, the_items)
     all_links |= the_links
     for j in the_jobs:
         jobs_by_subject[j["subject"]].append(j)
 
-    # 3. ReliefWeb RSS
+    # 3. ReliefWeb（API 或 RSS）
     print("\n--- ReliefWeb ---")
-    rw_jobs = fetch_reliefweb_rss(seen, all_links)
+    rw_jobs = []
+    if not dl.expired():
+        rw_jobs = fetch_reliefweb_api(seen, all_links) if RELIEFWEB_APPNAME else None
+        if rw_jobs is None:
+            if RELIEFWEB_APPNAME:
+                print("  [ReliefWeb] API 不可用，退回 RSS")
+            rw_jobs = fetch_reliefweb_rss(seen, all_links)
     for j in rw_jobs:
         jobs_by_subject["International_Orgs"].append(j)
         all_links.add(j["link"])
     if rw_jobs:
         print(f"  [ReliefWeb] 合计 {len(rw_jobs)} 条")
 
+    feed_health.save()
     return jobs_by_subject, all_links
 
 
 # ── 补充详情（并发）─────────────────────────────────────────────────────
-def enrich_with_details(jobs_by_subject):
+def _parse_pool():
+    """解析进程池；单核或无法创建子进程时返回 None（在抓取线程内解析）
+    用 forkserver：此时已有网络线程在跑，直接 fork 可能继承被锁住的锁"""
+    if DETAIL_PARSE_WORKERS <= 1:
+        return None
+    try:
+        ctx = multiprocessing.get_context("forkserver")
+        return ProcessPoolExecutor(max_workers=DETAIL_PARSE_WORKERS, mp_context=ctx)
+    except (ValueError, OSError) as e:
+        print(f"  ⚠️  无法创建解析进程池，改在线程内解析: {e}")
+        return None
+
+def enrich_with_details(jobs_by_subject, dl=deadline.NEVER, enriched=None, checkpoint=None):
     """并发抓取详情页，补充截止日期、申请链接、发布日期（jobs.ac.uk）、机构名（ReliefWeb）
-    scrape_detail 返回 (closing, apply_url, posted_date, inst)
+    抓取（网络 I/O）在线程池，正则解析 parse_detail 在进程池（绕开 GIL，按 CPU 数扩展），
+    子进程只返回小元组；/click/ 链接的缓存查询 / 解析在抓取线程的 finish_detail 中完成，
+    与其他详情页并发，受截止时间约束
     - jobs.ac.uk : JSON → closing / apply / go_live_date；inst 忽略
     - THE Jobs   : JSON-LD validThrough / applicationUrl；inst 忽略
-    - ReliefWeb  : 机构名从详情页提取；apply_url = reliefweb.int 页面
+    - ReliefWeb  : 机构名从详情页提取；apply_url = reliefweb.int 页面（API 来源的已有全部字段，跳过）
+    截止时间到后不再开始新的详情页，未抓取的职位保留 RSS 中的数据
+    enriched：已抓过详情页的 link 集合（断点续跑时跳过，抓完的会加入）；
+    checkpoint()：每完成 CHECKPOINT_EVERY 个调用一次，用于保存断点
     """
+    enriched = set() if enriched is None else enriched
     all_jobs = [j for subj in TARGET_SUBJECTS for j in jobs_by_subject[subj]
-                if j["source"] in ("jobs.ac.uk", "THE Jobs", "ReliefWeb")]
+                if j["source"] in ("jobs.ac.uk", "THE Jobs", "ReliefWeb")
+                and not j.get("api") and j["link"] not in enriched]
     total = len(all_jobs)
     if total == 0:
         return
+    if enriched:
+        print(f"\n断点续跑：{len(enriched)} 个详情页已抓取，跳过")
+
+    pool = _parse_pool()
+    parse_mode = f"{DETAIL_PARSE_WORKERS} 个解析进程" if pool else "线程内解析"
+    print(f"\n抓取 {total} 个职位详情页（并发 {DETAIL_FETCH_THREADS} 线程，含随机延迟；{parse_mode}）...")
+
+    def parse(link, page):
+        nonlocal pool
+        current = pool
+        if current is not None:
+            try:
+                return current.submit(parse_detail, link, page).result()
+            except BrokenProcessPool:
+                if pool is current:
+                    pool = None
+                    print("  ⚠️  解析进程池异常退出，改在线程内解析")
+        return parse_detail(link, page)
+
+    def fetch_one(link):
+        if dl.expired():
+            return None
+        page = fetch_detail(link)
+        if not page:
+            return "", link, "", ""
+        return finish_detail(parse(link, page), dl)
 
-    print(f"\n抓取 {total} 个职位详情页（并发 5 线程，含随机延迟）...")
-    done = 0
-    with ThreadPoolExecutor(max_workers=5) as ex:
-        f_map = {ex.submit(scrape_detail, j["link"]): j for j in all_jobs}
-        for f in as_completed(f_map):
-            j = f_map[f]
-            closing, apply_url, posted_date, inst = f.result()
-            if closing:
-                j["closing"] = closing
-            j["apply"] = apply_url
-            if posted_date:          # jobs.ac.uk 真实发布日期
-                j["date"] = posted_date
-            if inst and j["source"] == "ReliefWeb":   # ReliefWeb 机构名
-                j["inst"] = inst
-            done += 1
-            if done % 20 == 0 or done == total:
-                print(f"  {done}/{total} 完成")
-
-
-# ── 写入 Google Sheets ────────────────────────────────────────────────────
-def write_to_sheets(jobs_by_subject):
+    done = skipped = 0
+    try:
+        with ThreadPoolExecutor(max_workers=DETAIL_FETCH_THREADS) as ex:
+            f_map = {ex.submit(fetch_one, j["link"]): j for j in all_jobs}
+            for f in as_completed(f_map):
+                j = f_map[f]
+                result = f.result()
+                if result is None:
+                    skipped += 1
+                    continue
+                closing, apply_url, posted_date, inst = result
+                if closing:
+                    j["closing"] = closing
+                j["apply"] = apply_url
+                if posted_date:          # jobs.ac.uk 真实发布日期
+                    j["date"] = posted_date
+                if inst and j["source"] == "ReliefWeb":   # ReliefWeb 机构名
+                    j["inst"] = inst
+                enriched.add(j["link"])
+                done += 1
+                if done % 20 == 0 or done == total:
+                    print(f"  {done}/{total} 完成")
+                if checkpoint and done % CHECKPOINT_EVERY == 0:
+                    checkpoint()
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        redirects.flush()   # 本次新解析的 /click/ 跳转一次性写回缓存
+    if skipped:
+        print(f"  ⏰ 时间预算用尽，{skipped} 个详情页未抓取（保留 RSS 数据）")
+
+
+# ── 写入输出（Google Sheets / 本地后端，见 sinks.py）────────────────────────
+OUTPUT_HEADER = ["date", "subject", "institution", "title", "salary", "closing", "apply_url", "source"]
+
+def write_output(jobs_by_subject, sink_names=None, on_written=None):
+    """写入选中的后端，返回写入成功的后端名列表；on_written(name) 见 sinks.write_each"""
     rows = []
     for subj in TARGET_SUBJECTS:
         display_subj = "" if subj == "International_Orgs" else subj
         for j in jobs_by_subject[subj]:
             rows.append([
-                "'" + j["date"],   # 加 ' 防止 Sheets 把日期解析成其他格式
+                j["date"],
                 display_subj,
                 j["inst"],
                 j["title"],
@@ -706,66 +1078,90 @@ def write_to_sheets(jobs_by_subject):
 
     if not rows:
         print("没有新职位")
-        return False
+        return []
 
-    try:
-        import base64
-        cred_json = os.environ.get("GOOGLE_SERVICE_ACCOUNT", "")
-        if cred_json:
-            try:
-                sa_info = json.loads(base64.b64decode(cred_json))
-            except Exception:
-                sa_info = json.loads(cred_json)
-            creds = Credentials.from_service_account_info(
-                sa_info,
-                scopes=["https://www.googleapis.com/auth/spreadsheets",
-                        "https://www.googleapis.com/auth/drive"])
-        else:
-            import google.auth
-            creds, _ = google.auth.default(
-                scopes=["https://www.googleapis.com/auth/spreadsheets",
-                        "https://www.googleapis.com/auth/drive"])
-        gc = gspread.authorize(creds)
-        ws = gc.open_by_key(SHEET_ID).worksheet(SHEET_RANGE)
-        # 时间戳行（置顶）+ 数据 + 空行分隔
-        ts            = datetime.now(SGT).strftime("%Y/%m/%d, %H:%M") + "完成更新"
-        timestamp_row = [[ts] + [""] * (len(rows[0]) - 1)]
-        separator     = [[""] * len(rows[0])]
-        ws.insert_rows(timestamp_row + rows + separator, row=2,
-                       value_input_option="USER_ENTERED")
-        print(f"✓ 成功写入 {len(rows)} 条（已置顶）")
-        return True
-    except Exception as e:
-        print(f"Sheets 写入异常: {e}")
-        return False
+    done = sinks.write_each(SHEET_ID, SHEET_RANGE, OUTPUT_HEADER, rows,
+                            sinks=sink_names, on_written=on_written)
+    if done:
+        print(f"✓ 成功写入 {len(rows)} 条（{', '.join(done)}）")
+    return done
 
 
 # ── 主函数 ────────────────────────────────────────────────────────────────
-def main():
+def main(sink_names=None, force=False):
     mode = "全量模式（--all）" if RESET_ALL else ("限速模式（--week）" if WEEK_MODE else "增量模式")
     print(f"=== 抓取学术职位 [jobs.ac.uk + THE Jobs + ReliefWeb] [{mode}] ===")
     print(f"📅 抓取范围: {DATE_LABEL}")
 
+    dl = deadline.start()
     seen = load_seen()
     print(f"已记录 {len(seen)} 条历史职位")
 
-    jobs, all_links = fetch_all(seen)
+    cp = None if force else load_checkpoint()   # force：忽略断点，从头重跑
+    if cp:
+        jobs, all_links, enriched = cp["jobs"], set(cp["all_links"]), set(cp["enriched"])
+        print(f"♻️  发现未完成的运行（阶段 {cp['phase']}），从断点继续")
+    else:
+        with run_log.stage("fetch"):
+            jobs, all_links = fetch_all(seen, dl.stage(0.4))
+        enriched = set()
     total_new = sum(len(v) for v in jobs.values())
+    run_log.count("fetched", len(all_links))
+    run_log.count("kept", total_new)
 
     print(f"\n发现 {total_new} 条新职位")
     for subj in TARGET_SUBJECTS:
         if jobs[subj]:
             print(f"  {subj}: {len(jobs[subj])}")
 
-    if total_new:
-        enrich_with_details(jobs)
-        ok = write_to_sheets(jobs)
-        if ok:
-            save_seen(seen | all_links)
-            print(f"已更新记录（共 {len(seen | all_links)} 条）")
-    else:
+    if not total_new:
         save_seen(seen | all_links)
+        clear_checkpoint()
+        return
+
+    written_sinks = set(cp.get("written_sinks", [])) if cp else set()
+    cp_lock = threading.Lock()
+
+    def checkpoint(phase="fetched"):
+        with cp_lock:   # 各后端写完的回调来自写入线程
+            try:
+                save_checkpoint(phase, jobs, all_links, enriched, written_sinks)
+            except Exception as e:
+                print(f"⚠️  断点保存失败（非致命）: {e}")
+
+    def sink_written(name):
+        with cp_lock:
+            written_sinks.add(name)
+        checkpoint("writing")
+
+    phase   = cp["phase"] if cp else "fetched"
+    targets = sinks.names(sink_names)
+    if not targets:
+        print("没有可用的输出后端，不写入")
+        return
+    # 写完 Sheets 后、记录断点前被中断：断点里没有 sheets，核对表格
+    if phase == "writing" and "sheets" in targets and "sheets" not in written_sinks \
+            and _already_in_sheet(jobs):
+        print("上次运行已写入 Sheets，不再重复写入")
+        written_sinks.add("sheets")
+    remaining = [n for n in targets if n not in written_sinks]
+    if phase == "writing" and written_sinks:
+        print(f"♻️  已写入的后端：{', '.join(sorted(written_sinks))}；本次只写 {', '.join(remaining) or '（无）'}")
+    if phase != "written" and remaining:
+        checkpoint()
+        with run_log.stage("enrich"):
+            enrich_with_details(jobs, dl, enriched, checkpoint)
+        checkpoint("writing")
+        with run_log.stage("write"):
+            done = write_output(jobs, remaining, sink_written)
+        if len(done) < len(remaining):
+            return   # 保持 writing：下次运行只写未成功的后端（Sheets 先核对表格），详情页不重抓
+    if phase != "written":
+        checkpoint("written")
+    save_seen(seen | all_links)
+    clear_checkpoint()
+    print(f"已更新记录（共 {len(seen | all_links)} 条）")
 
 
 if __name__ == "__main__":
-    main()
+    main(force="--force" in sys.argv)
@@ -2,77 +2,56 @@
 """
 Sociology Journal Fetcher — CrossRef API Edition
 - 国际期刊：CrossRef API（按 ISSN + 日期查询，无需 RSS URL）
+- 增量模式（CROSSREF_MODE=incremental；STATE_DIR=gs:// 时默认）：按索引日期查询上次水位之后
+  新增 / 更新的记录，DOI 去重；晚几天才被 CrossRef 收录的文章也能补到。水位与已见 DOI
+  在写入成功后才推进；STATE_DIR 非共享时另外按表格中已有的链接去重
+- CROSSREF_MODE=pubdate（STATE_DIR 非共享时默认）：只查发表日期为昨天的文章
 - 过滤书评 → Gemini/Groq 评分 → 写入 Google Sheets
 """
 
-import subprocess, json, os, re, functools
-from datetime import datetime, timedelta, timezone
+import subprocess, json, os, re, sys, time, queue, threading
+from datetime import date, datetime, timedelta, timezone
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from urllib.request import urlopen, Request
+from urllib.request import Request
+from urllib.parse import quote
+from urllib.error import HTTPError
+from text_match import KeywordMatcher
+from rate_control import AdaptiveLimiter
+import llm_client
+import deadline
+import feed_dates
+from http_transport import urlopen
+import run_ledger
+import run_log
+import sinks
+import sheets_client
+from state_store import SHARED, state_path, load_json, load_json_generation, replace_json
 
 # ── Config ───────────────────────────────────────────────────────────────────
 SHEET_ID    = "1MCcEqV2OGkxFofWSRI6BW2OFYG35cNDHC2olbm43NWc"
 SHEET_RANGE = "论文"
 MAILTO      = "wangsenhu@gmail.com"   # CrossRef polite pool
-GEMINI_KEYS = [k for k in [
-    os.environ.get("GEMINI_API_KEY", ""),
-    os.environ.get("GEMINI_API_KEY_2", ""),
-    os.environ.get("GEMINI_API_KEY_3", ""),
-] if k]
-GROQ_API_KEY       = os.environ.get("GROQ_API_KEY", "")
-OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "")
+# 抓取与评分流水线：凑满 SCORE_BATCH_SIZE 篇或首篇入队后等满 SCORE_BATCH_WAIT 秒即送评一批
+SCORE_BATCH_SIZE = int(os.environ.get("SCORE_BATCH_SIZE", "20"))
+SCORE_BATCH_WAIT = float(os.environ.get("SCORE_BATCH_WAIT", "8"))
+SCORE_QUEUE_MAX  = 200
+# CrossRef 并发：从 3 起步，按响应头（X-Rate-Limit-*、X-Concurrency-Limit）自适应
+CROSSREF_MAX_CONCURRENCY = int(os.environ.get("CROSSREF_MAX_CONCURRENCY", "8"))
+# 增量模式：索引日期窗口 = 上次水位次日 ~ 昨天，最多回补 MAX_CATCHUP_DAYS 天；
+# 只收发表日期在 PUB_LOOKBACK_DAYS 天内的文章（排除旧文被重新索引）
+# 水位与已见 DOI 只有跨实例共享才可靠：冷启动实例状态为空时，索引窗口会带回大量旧文的元数据更新
+CROSSREF_MODE     = os.environ.get("CROSSREF_MODE") or ("incremental" if SHARED else "pubdate")
+SHEET_DEDUPE_ROWS = 3000   # 非共享状态时读取表格前多少行的链接用于去重
+CROSSREF_STATE    = state_path("crossref_state.json")
+MAX_CATCHUP_DAYS  = 14
+PUB_LOOKBACK_DAYS = 60
+SEEN_DOI_DAYS     = 120
+STATE_RETRIES     = 3      # 写回增量状态时版本冲突的重试次数
+CROSSREF_ROWS     = 100
+CROSSREF_MAX_PAGES = 5
 SGT = timezone(timedelta(hours=8))  # 新加坡时间 (SGT)
 TARGET_DATE = (datetime.now(SGT) - timedelta(days=1)).strftime("%Y-%m-%d")
 
-# ── Gemini 动态模型选择 ───────────────────────────────────────────────────────
-GEMINI_PREFERRED = [
-    "gemini-2.5-flash",       # 首选：最新最优 flash
-    "gemini-2.0-flash",       # 备选：上一代，极稳定
-    "gemini-2.0-flash-lite",  # 再备：更便宜
-    "gemini-1.5-flash",       # 兜底：老但极可靠
-    "gemini-1.5-flash-8b",    # 最终兜底：最便宜
-]
-_EXCLUDE_KEYWORDS = ("pro", "preview", "exp", "thinking")
-
-def _model_version_key(name):
-    m = re.search(r'gemini-(\d+)[.\-](\d+)', name)
-    return (int(m.group(1)), int(m.group(2))) if m else (0, 0)
-
-@functools.lru_cache(maxsize=8)
-def _list_gemini_models(api_key):
-    """列出指定 API key 可用的 Gemini 模型（纯 REST，不依赖 SDK，结果缓存）"""
-    try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models?key={api_key}&pageSize=200"
-        with urlopen(url, timeout=10) as r:
-            data = json.loads(r.read())
-        return frozenset(
-            m["name"].removeprefix("models/")
-            for m in data.get("models", [])
-            if "generateContent" in m.get("supportedGenerationMethods", [])
-        )
-    except Exception as e:
-        print(f"   ⚠️ 无法列出 Gemini 模型: {e}")
-        return frozenset()
-
-def get_best_gemini_model(api_key):
-    """按优先级选择最佳可用 flash 模型，排除 pro/preview/exp/thinking"""
-    available = _list_gemini_models(api_key)
-    if not available:
-        return "gemini-2.0-flash"  # 列表失败时的默认值
-    for model in GEMINI_PREFERRED:
-        if model in available:
-            return model
-    # 所有优先模型均不可用：自动寻找版本最高的 flash 模型
-    candidates = [
-        m for m in available
-        if "flash" in m and not any(kw in m for kw in _EXCLUDE_KEYWORDS)
-    ]
-    if candidates:
-        chosen = max(candidates, key=_model_version_key)
-        print(f"   📌 自动降级至: {chosen}")
-        return chosen
-    return "gemini-1.5-flash"
-
 # ── 国际期刊（CrossRef，按 ISSN）────────────────────────────────────────────
 JOURNALS = [
     # 综合社会学
@@ -126,102 +105,224 @@ BOOK_REVIEW_KEYWORDS = [
     "book notice", "book symposium", "review essay", "book forum",
 ]
 
+# 关键词 + ISBN + "书名. By 作者. 出版地:" 合并成一个正则；后者区分大小写
+_BOOK_REVIEW_MATCHER = KeywordMatcher(
+    [(kw, True) for kw in BOOK_REVIEW_KEYWORDS],
+    patterns=[(r'\bISBN\b', True), (r'(?-i:\. By [A-Z].+?\.\s+\w+:)', True)],
+)
+_PAGES_RE = re.compile(r'\bpp\.')
+_PRICE_RE = re.compile(r'[£$€]\d')
+
 def is_book_review(title):
-    t = title.lower()
-    if any(kw in t for kw in BOOK_REVIEW_KEYWORDS):
-        return True
-    if re.search(r'\bISBN\b', title, re.IGNORECASE):
-        return True
-    if re.search(r'\bpp\.', title) and re.search(r'[£$€]\d', title):
-        return True
-    if re.search(r'\. By [A-Z].+?\.\s+\w+:', title):
+    if _BOOK_REVIEW_MATCHER.matches(title):
         return True
-    return False
+    return bool(_PAGES_RE.search(title) and _PRICE_RE.search(title))
 
 # ── CrossRef 抓取 ─────────────────────────────────────────────────────────────
-def fetch_crossref(journal_name, field, issn):
-    import time
-    url = (
-        f"https://api.crossref.org/works"
-        f"?filter=issn:{issn},from-pub-date:{TARGET_DATE},until-pub-date:{TARGET_DATE}"
-        f"&rows=50&select=title,author,DOI,URL,published,published-online,type"
-        f"&mailto={MAILTO}"
-    )
+_CROSSREF = AdaptiveLimiter("crossref", start=3, ceiling=CROSSREF_MAX_CONCURRENCY)
+
+def _observe_crossref_headers(headers):
+    """X-Rate-Limit-Limit: 50 / X-Rate-Limit-Interval: 1s / X-Concurrency-Limit: 3"""
+    def num(name):
+        m = re.match(r'\s*(\d+(?:\.\d+)?)', headers.get(name) or "")
+        return float(m.group(1)) if m else None
+    concurrency = num("X-Concurrency-Limit")
+    _CROSSREF.observe(num("X-Rate-Limit-Limit"), num("X-Rate-Limit-Interval"),
+                      int(concurrency) if concurrency else None)
+
+# ── 增量状态：{"watermarks": {issn: 已完整覆盖的最后索引日期}, "dois": {doi: 首次见到的日期}} ──
+# 每次运行开始时 _reset_state()：热实例不沿用上一次运行的快照；写回时与存储中的最新内容合并
+_state_lock = threading.Lock()
+_state      = None
+_covered    = {}    # 本次运行成功抓完的 issn → 索引窗口终点
+
+_DOI_RE = re.compile(r'10\.\d{4,9}/[^\s?#]+')
+
+def _sheet_dois():
+    """表格中已有文章的 DOI（link 列）；状态不跨实例共享时的去重兜底"""
+    try:
+        ws = sheets_client.open_worksheet(SHEET_ID, SHEET_RANGE)
+        col = ws.batch_get([f"G2:G{SHEET_DEDUPE_ROWS}"])[0]
+    except Exception as e:
+        print(f"⚠️  无法读取表格已有链接（不做表格去重）: {e}")
+        return set()
+    return {m.group(0).lower() for row in col if row for m in [_DOI_RE.search(row[0])] if m}
+
+def _reset_state():
+    global _state
+    with _state_lock:
+        _state = None
+        _covered.clear()
+
+def _load_state():
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = load_json(CROSSREF_STATE, {"watermarks": {}, "dois": {}})
+            if not SHARED and CROSSREF_MODE != "pubdate":
+                for doi in _sheet_dois():
+                    _state["dois"].setdefault(doi, TARGET_DATE)
+        return _state
+
+def _index_window(issn):
+    """(from-index-date, until-index-date)；水位已到昨天时返回 None"""
+    last = _load_state()["watermarks"].get(issn)
+    until = date.fromisoformat(TARGET_DATE)
+    start = date.fromisoformat(last) + timedelta(days=1) if last else until
+    start = max(start, until - timedelta(days=MAX_CATCHUP_DAYS))
+    if start > until:
+        return None
+    return start.isoformat(), until.isoformat()
+
+def commit_crossref_state(articles):
+    """写入成功后推进各期刊水位、记录已见 DOI，并清理过旧的 DOI
+    与存储中的最新状态合并（水位取较晚者，DOI 取并集），按版本号前置条件写入，
+    不覆盖其他实例在本次运行期间写入的水位 / DOI"""
+    with _state_lock:
+        covered = dict(_covered)
+    new_dois = {a["doi"] for a in articles if a.get("doi")}
+    cutoff = (date.fromisoformat(TARGET_DATE) - timedelta(days=SEEN_DOI_DAYS)).isoformat()
+    for _ in range(STATE_RETRIES):
+        stored, generation = load_json_generation(CROSSREF_STATE)
+        stored = stored or {}
+        watermarks = dict(stored.get("watermarks", {}))
+        for issn, until in covered.items():
+            if until > watermarks.get(issn, ""):
+                watermarks[issn] = until
+        dois = dict(stored.get("dois", {}))
+        for doi in new_dois:
+            dois.setdefault(doi, TARGET_DATE)
+        dois = {d: seen for d, seen in dois.items() if seen >= cutoff}
+        try:
+            if replace_json(CROSSREF_STATE, {"watermarks": watermarks, "dois": dois}, generation):
+                return
+        except Exception as e:
+            print(f"⚠️  增量状态写入失败（非致命）: {e}")
+            return
+    print(f"⚠️  增量状态写入冲突 {STATE_RETRIES} 次，本次水位未推进（下次运行重抓该窗口）")
+
+def _crossref_get(url, journal_name, dl):
+    """带自适应限速与 429 退避的 GET；失败或超出预算返回 None"""
     req = Request(url, headers={"User-Agent": f"SociologyBot/1.0 (mailto:{MAILTO})"})
-    data = None
     for attempt in range(4):
+        if dl.expired():
+            print(f"   ⏰ {journal_name}: 抓取阶段时间预算用尽，跳过")
+            return None
         try:
-            with urlopen(req, timeout=30) as resp:
-                data = json.loads(resp.read())
-            break
+            with _CROSSREF.slot():
+                with urlopen(req, timeout=30) as resp:
+                    _observe_crossref_headers(resp.headers)
+                    data = json.loads(resp.read())
+            _CROSSREF.success()
+            return data
         except Exception as e:
-            if "429" in str(e) and attempt < 3:
-                wait = (attempt + 1) * 15
-                print(f"   ⏳ {journal_name}: 限速，{wait}秒后重试...")
-                time.sleep(wait)
+            if isinstance(e, HTTPError) and e.code == 429 and attempt < 3:
+                hdrs = e.headers or {}
+                _observe_crossref_headers(hdrs)
+                # 退避由限速器统一执行：所有线程一起暂停，下一次 slot() 时生效
+                wait = _CROSSREF.throttled(attempt, hdrs.get("Retry-After"))
+                print(f"   ⏳ {journal_name}: 限速，{wait:.0f}秒后重试（并发降至 {_CROSSREF.limit}）...")
             else:
                 print(f"   ⚠️  {journal_name}: 失败 ({e})")
-                return []
-    if data is None:
-        return []
-    try:
-        items = data.get("message", {}).get("items", [])
-        articles = []
-        for item in items:
-            if item.get("type") != "journal-article":
-                continue
-
-            title_list = item.get("title", [])
-            title = re.sub(r'<[^>]+>', '', title_list[0]).strip() if title_list else ""
-            if not title or is_book_review(title):
-                continue
-
-            # 日期：优先 published-online
-            pub = item.get("published-online") or item.get("published") or {}
-            parts = pub.get("date-parts", [[]])[0]
-            if len(parts) >= 3:
-                article_date = f"{parts[0]:04d}-{parts[1]:02d}-{parts[2]:02d}"
-            else:
-                continue  # 日期不完整跳过
-
-            if article_date != TARGET_DATE:
-                continue
-
-            # 作者
-            authors = []
-            for a in item.get("author", []):
-                name = f"{a.get('given','')} {a.get('family','')}".strip()
-                if name:
-                    authors.append(name)
-
-            doi  = item.get("DOI", "")
-            link = item.get("URL") or (f"https://doi.org/{doi}" if doi else "")
-
-            articles.append({
-                "journal": journal_name, "field": field,
-                "title":   title,
-                "authors": ", ".join(authors) or "N/A",
-                "date":    article_date,
-                "link":    link,
-            })
-
-        print(f"   ✅ {journal_name}: {len(articles)} 篇")
-        return articles
-    except Exception as e:
-        print(f"   ⚠️  {journal_name}: 失败 ({e})")
-        return []
+                return None
+    return None
+
+def _parse_item(item, journal_name, field, min_date, max_date):
+    if item.get("type") != "journal-article":
+        return None
+
+    title_list = item.get("title", [])
+    title = re.sub(r'<[^>]+>', '', title_list[0]).strip() if title_list else ""
+    if not title or is_book_review(title):
+        return None
+
+    # 日期：优先 published-online
+    pub = item.get("published-online") or item.get("published") or {}
+    article_date = feed_dates.from_date_parts(pub.get("date-parts", [[]])[0])
+    if not article_date:
+        return None  # 日期不完整跳过
+    if not (min_date <= article_date <= max_date):
+        return None
+
+    # 作者
+    authors = []
+    for a in item.get("author", []):
+        name = f"{a.get('given','')} {a.get('family','')}".strip()
+        if name:
+            authors.append(name)
+
+    doi  = item.get("DOI", "")
+    link = item.get("URL") or (f"https://doi.org/{doi}" if doi else "")
+    return {
+        "journal": journal_name, "field": field,
+        "title":   title,
+        "authors": ", ".join(authors) or "N/A",
+        "date":    article_date,
+        "link":    link,
+        "doi":     doi.lower(),
+    }
+
+def fetch_crossref(journal_name, field, issn, dl=deadline.NEVER):
+    base = (f"https://api.crossref.org/works?rows={CROSSREF_ROWS}"
+            f"&select=title,author,DOI,URL,published,published-online,type&mailto={MAILTO}")
+    if CROSSREF_MODE == "pubdate":
+        url = f"{base}&filter=issn:{issn},from-pub-date:{TARGET_DATE},until-pub-date:{TARGET_DATE}"
+        min_date = max_date = TARGET_DATE
+        window = None
+    else:
+        window = _index_window(issn)
+        if window is None:
+            print(f"   ✔️  {journal_name}: 已覆盖至 {TARGET_DATE}")
+            return []
+        min_date = (date.fromisoformat(TARGET_DATE) - timedelta(days=PUB_LOOKBACK_DAYS)).isoformat()
+        max_date = datetime.now(SGT).strftime("%Y-%m-%d")
+        url = (f"{base}&filter=issn:{issn},from-index-date:{window[0]},until-index-date:{window[1]},"
+               f"from-pub-date:{min_date}")
+
+    seen_dois = _load_state()["dois"]
+    articles, cursor = [], "*"
+    for _ in range(CROSSREF_MAX_PAGES):
+        data = _crossref_get(f"{url}&cursor={quote(cursor, safe='*')}", journal_name, dl)
+        if data is None:
+            return []     # 窗口未抓完：水位不推进，下次重抓
+        try:
+            message = data.get("message", {})
+            items = message.get("items", [])
+            for item in items:
+                a = _parse_item(item, journal_name, field, min_date, max_date)
+                if a and not (a["doi"] and a["doi"] in seen_dois):
+                    articles.append(a)
+        except Exception as e:
+            print(f"   ⚠️  {journal_name}: 失败 ({e})")
+            return []
+        cursor = message.get("next-cursor")
+        if len(items) < CROSSREF_ROWS or not cursor:
+            exhausted = True
+            break
+    else:
+        exhausted = False
+        print(f"   ⚠️  {journal_name}: 超过 {CROSSREF_MAX_PAGES} 页未取完，水位不推进")
+
+    # 同一 DOI 可能因更新被多次索引：只保留一条
+    articles = list({a["doi"] or a["link"]: a for a in articles}.values())
+    if window is not None and exhausted:
+        with _state_lock:
+            _covered[issn] = window[1]
+    span = f"（索引 {window[0]}~{window[1]}）" if window and window[0] != window[1] else ""
+    print(f"   ✅ {journal_name}: {len(articles)} 篇{span}")
+    return articles
 
 
 # ── 评分 ─────────────────────────────────────────────────────────────────────
-def score_articles(articles):
+def score_articles(articles, dl=None):
     if not articles:
         return articles
-    import time
 
-    titles_list = "\n".join([
-        f"{i+1}. [{a['journal']}] {a['title']}" for i, a in enumerate(articles)
-    ])
-    prompt = f"""你是社会学领域的专家教授。请根据以下学术论文的题目，逐一用一句中文简介说明这篇论文大概在研究什么。
+    def build_prompt(indices):
+        titles_list = "\n".join([
+            f"{i}. [{articles[i-1]['journal']}] {articles[i-1]['title']}" for i in indices
+        ])
+        return f"""你是社会学领域的专家教授。请根据以下学术论文的题目，逐一用一句中文简介说明这篇论文大概在研究什么。
 
 要求：
 - 只根据题目推断，不要编造内容
@@ -231,184 +332,129 @@ def score_articles(articles):
 论文列表：
 {titles_list}
 
-请严格按以下JSON格式返回，不要加任何其他文字：
-[
+请严格按以下JSON格式返回，index 与论文编号一致，不要加任何其他文字：
+{{"items": [
   {{"index": 1, "score": "一句话中文简介"}},
   {{"index": 2, "score": "一句话中文简介"}}
-]"""
-
-    def parse_scores(content):
-        content = content.strip()
-        if content.startswith("```"):
-            content = content.split("\n", 1)[-1].rsplit("```", 1)[0]
-        start, end = content.find("["), content.rfind("]") + 1
-        if start == -1 or end == 0:
-            raise ValueError(f"No JSON array: {content[:80]!r}")
-        return json.loads(content[start:end])
-
-    def apply_scores(scores):
-        score_map = {s["index"]: s["score"] for s in scores}
-        for i, a in enumerate(articles):
-            a["score"] = score_map.get(i + 1, "暂无简介")
-
-    # 1. Groq（默认，最稳定）
-    if GROQ_API_KEY:
-        try:
-            payload = json.dumps({
-                "model": "llama-3.3-70b-versatile",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 1000,
-            }).encode()
-            req = Request("https://api.groq.com/openai/v1/chat/completions", data=payload,
-                headers={"Authorization": f"Bearer {GROQ_API_KEY}",
-                         "Content-Type": "application/json", "User-Agent": "curl/7.88.1"})
-            with urlopen(req, timeout=30) as resp:
-                result = json.loads(resp.read())
-            apply_scores(parse_scores(result["choices"][0]["message"]["content"].strip()))
-            print("   ✅ 评分完成（Groq）")
-            return articles
-        except Exception as e:
-            print(f"   ⚠️  Groq: {e}，尝试 Gemini...")
-
-    # 2. Gemini（备用）
-    def call_gemini(api_key):
-        model = get_best_gemini_model(api_key)
-        print(f"   🤖 使用模型: {model}")
-        payload = json.dumps({
-            "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": {"maxOutputTokens": 2000},
-        }).encode()
-        req = Request(
-            f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}",
-            data=payload, headers={"Content-Type": "application/json"},
-        )
-        with urlopen(req, timeout=60) as resp:
-            result = json.loads(resp.read())
-        parts = result["candidates"][0]["content"]["parts"]
-        text = next((p["text"] for p in reversed(parts) if "text" in p), "").strip()
-        return parse_scores(text)
-
-    for key_idx, api_key in enumerate(GEMINI_KEYS):
-        label = f"Gemini key{key_idx+1}"
-        for attempt in range(3):
-            try:
-                apply_scores(call_gemini(api_key))
-                print(f"   ✅ 评分完成（{label}）")
-                return articles
-            except Exception as e:
-                if "429" in str(e) or "RESOURCE_EXHAUSTED" in str(e):
-                    if attempt < 2:
-                        time.sleep((attempt + 1) * 10)
-                        print(f"   ⏳ {label} 限速，重试中...")
-                    else:
-                        print(f"   ⏳ {label} 持续限速，换下一个 key")
-                else:
-                    print(f"   ⚠️  {label}: {e}，换下一个 key")
-                    break
-
-    # 3. OpenRouter
-    if OPENROUTER_API_KEY:
-        for attempt in range(3):
-            try:
-                payload = json.dumps({
-                    "model": "meta-llama/llama-3.3-70b-instruct:free",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 1000,
-                }).encode()
-                req = Request("https://openrouter.ai/api/v1/chat/completions", data=payload,
-                    headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                             "Content-Type": "application/json", "HTTP-Referer": "https://openclaw.ai"})
-                with urlopen(req, timeout=30) as resp:
-                    result = json.loads(resp.read())
-                apply_scores(parse_scores(result["choices"][0]["message"]["content"].strip()))
-                print("   ✅ 评分完成（OpenRouter）")
-                return articles
-            except Exception as e:
-                if "429" in str(e):
-                    time.sleep((attempt + 1) * 15)
-                else:
-                    print(f"   ⚠️  OpenRouter: {e}"); break
-
-    print("   ⚠️  所有评分模型失败，使用默认评分")
-    for a in articles:
-        a["score"] = "暂无简介"
+]}}"""
+
+    def apply_item(item):
+        """流式逐条应用；简介为空视为不合格，该条会被重新请求"""
+        score = item.get("score")
+        if not isinstance(score, str) or not score.strip():
+            return False
+        articles[item["index"] - 1]["score"] = score.strip()
+        return True
+
+    missing, providers = llm_client.complete_items(
+        build_prompt, len(articles), {"index": "INTEGER", "score": "STRING"},
+        apply_item, indent="   ", deadline=dl)
+    for i in missing:
+        articles[i - 1]["score"] = "暂无简介"
+    if providers:
+        note = f"，{len(missing)} 篇缺失" if missing else ""
+        print(f"   ✅ 评分完成（{' + '.join(dict.fromkeys(providers))}）{note}")
+    else:
+        print("   ⚠️  所有评分模型失败，使用默认评分")
     return articles
 
-# ── 写入 Google Sheets ────────────────────────────────────────────────────────
-def write_to_sheets(articles):
+# ── 抓取 + 评分流水线 ─────────────────────────────────────────────────────────
+_FETCH_DONE = object()
+
+def fetch_and_score(dl=deadline.NEVER):
+    """CrossRef 抓取线程把已完成期刊的文章放进有界队列，主线程按微批评分，
+    LLM 延迟与仍在进行（或 429 退避中）的抓取重叠，总耗时接近 max(抓取, 评分)
+    抓取阶段预算为剩余时间的 60%，评分可用到整体截止时间"""
+    q = queue.Queue(maxsize=SCORE_QUEUE_MAX)
+    fetch_dl = dl.stage(0.6)
+
+    def produce():
+        try:
+            # 线程数取上限，实际并发由 _CROSSREF 自适应控制
+            with ThreadPoolExecutor(max_workers=CROSSREF_MAX_CONCURRENCY) as ex:
+                futures = {ex.submit(fetch_crossref, n, f, i, fetch_dl): n for n, f, i in JOURNALS}
+                for future in as_completed(futures):
+                    try:
+                        articles = future.result()
+                        run_log.count("fetched", len(articles))
+                        for a in articles:
+                            q.put(a)
+                    except Exception as e:
+                        print(f"   ⚠️  {futures[future]}: 失败 ({e})")
+        finally:
+            q.put(_FETCH_DONE)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    scored, batch, flush_at, done = [], [], None, False
+    while not done:
+        timeout = None if flush_at is None else max(0.0, flush_at - time.monotonic())
+        try:
+            item = q.get(timeout=timeout)
+        except queue.Empty:
+            item = None
+        if item is _FETCH_DONE:
+            done = True
+        elif item is not None:
+            batch.append(item)
+            if flush_at is None:
+                flush_at = time.monotonic() + SCORE_BATCH_WAIT
+        if batch and (done or item is None or len(batch) >= SCORE_BATCH_SIZE):
+            print(f"🤖 正在评分（{len(batch)} 篇，抓取{'已完成' if done else '进行中'}）...")
+            scored.extend(score_articles(batch, dl))
+            batch, flush_at = [], None
+    return scored
+
+# ── 写入输出（Google Sheets / 本地后端，见 sinks.py）──────────────────────────
+OUTPUT_HEADER = ["date", "field", "journal", "authors", "title", "score", "link"]
+
+def write_output(articles, sink_names=None):
     if not articles:
-        print("没有新文章。"); return
-
-    from collections import defaultdict
-    dates_order, by_date = [], defaultdict(list)
-    for a in articles:
-        if a["date"] not in by_date:
-            dates_order.append(a["date"])
-        by_date[a["date"]].append(a)
-
-    rows = []
-    for i, date in enumerate(sorted(dates_order)):
-        day_articles = sorted(by_date[date], key=lambda x: x["field"])
-        for a in day_articles:
-            rows.append(["'" + a["date"], a["field"], a["journal"],
-                         a["authors"], a["title"], a["score"], a["link"]])
-        if i < len(dates_order) - 1:
-            rows.append(["", "", "", "", "", "", ""])
-
-    # 环境检测：如果有 GOOGLE_SERVICE_ACCOUNT，说明在 GitHub/云端运行
-    sa_json = os.environ.get("GOOGLE_SERVICE_ACCOUNT", "")
-    try:
-        import gspread, base64
-        from google.oauth2.service_account import Credentials
-
-        if sa_json:
-            # 本地/GitHub Actions：使用 JSON key（Base64 或原始 JSON）
-            try:
-                sa_info = json.loads(base64.b64decode(sa_json))
-            except:
-                sa_info = json.loads(sa_json)
-            creds = Credentials.from_service_account_info(
-                sa_info,
-                scopes=["https://www.googleapis.com/auth/spreadsheets"]
-            )
-        else:
-            # GCP Cloud Run：使用 Application Default Credentials
-            import google.auth
-            creds, _ = google.auth.default(
-                scopes=["https://www.googleapis.com/auth/spreadsheets"])
-
-        gc = gspread.authorize(creds)
-        ws = gc.open_by_key(SHEET_ID).worksheet(SHEET_RANGE)
-        # 时间戳行 + 数据 + 空行分隔（置顶）
-        ts = datetime.now(SGT).strftime("%Y/%m/%d, %H:%M") + "完成更新"
-        timestamp_row = [[ts] + [""] * (len(rows[0]) - 1)]
-        separator = [[""] * len(rows[0])]
-        ws.insert_rows(timestamp_row + rows + separator, row=2, value_input_option="USER_ENTERED")
-        print(f"✅ 成功写入 {len(articles)} 篇文章到 Google Sheets（已置顶）")
-    except Exception as e:
-        print(f"❌ gspread 写入失败: {e}")
+        print("没有新文章。"); return True
+
+    # 按日期、领域排序；Sheets 中不同日期之间插入空行
+    rows = [[a["date"], a["field"], a["journal"], a["authors"], a["title"], a["score"], a["link"]]
+            for a in sorted(articles, key=lambda x: (x["date"], x["field"]))]
+    ok = sinks.write(SHEET_ID, SHEET_RANGE, OUTPUT_HEADER, rows, sinks=sink_names, separate_by=0)
+    if ok:
+        print(f"✅ 成功写入 {len(articles)} 篇文章")
+    return ok
 
 # ── Main ─────────────────────────────────────────────────────────────────────
-def main():
+def _ledger_config(sink_names):
+    return {"mode": CROSSREF_MODE, "journals": JOURNALS, "sinks": sink_names or sinks.DEFAULT_SINKS}
+
+def main(sink_names=None, force=False):
     print(f"🔍 抓取日期: {TARGET_DATE}")
+    _reset_state()
+    ledger_config = _ledger_config(sink_names)
+    if run_ledger.completed("fetch-journals", TARGET_DATE, ledger_config, force):
+        run_log.count("ledger_skip")
+        return
+    llm_client.prefetch()   # 模型目录在后台刷新，与 CrossRef 抓取并行
     print(f"📚 {len(JOURNALS)} 个国际期刊（CrossRef）\n")
 
-    all_articles = []
+    dl = deadline.start()
+    with run_log.stage("fetch_score"):
+        all_articles = fetch_and_score(dl)
+    run_log.count("kept", len(all_articles))
 
-    with ThreadPoolExecutor(max_workers=3) as ex:
-        futures = {ex.submit(fetch_crossref, n, f, i): n for n, f, i in JOURNALS}
-        for future in as_completed(futures):
-            all_articles.extend(future.result())
-
-    print(f"\n📝 共找到 {len(all_articles)} 篇昨天的文章")
+    label = "新收录" if CROSSREF_MODE != "pubdate" else "昨天的"
+    print(f"\n📝 共找到 {len(all_articles)} 篇{label}文章")
     if not all_articles:
+        commit_crossref_state(all_articles)
         print("没有新文章，退出。"); return
 
-    print("🤖 正在评分（单次 LLM 调用）...")
-    all_articles = score_articles(all_articles)
-
-    print("📊 写入 Google Sheets...")
-    write_to_sheets(all_articles)
+    links = sorted(a["link"] for a in all_articles)
+    if run_ledger.written_elsewhere("fetch-journals", links, SHEET_ID, SHEET_RANGE, "G", sink_names, force):
+        written = True
+    else:
+        print("📊 写入输出...")
+        with run_log.stage("write"):
+            written = write_output(all_articles, sink_names)
+    if written:
+        commit_crossref_state(all_articles)
+        run_ledger.record("fetch-journals", TARGET_DATE, ledger_config, links)
 
     # 自动触发 fetch_reports（需设置环境变量 FETCH_REPORTS_URL）
     reports_url = os.environ.get("FETCH_REPORTS_URL", "")
@@ -425,4 +471,4 @@ def main():
             print(f"⚠️  触发 fetch_reports 失败: {e}")
 
 if __name__ == "__main__":
-    main()
+    main(force="--force" in sys.argv)
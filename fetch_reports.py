@@ -3,11 +3,23 @@
 Think Tank Report Fetcher — RSS Edition
 每天抓取主要智库最新报告 → 写入 Google Sheets「智库报告」标签
 """
-import json, os, re, time, base64, functools
+import os, re, sys, time
 from datetime import datetime, timedelta, timezone
-from urllib.request import urlopen, Request
+from urllib.request import Request
+from urllib.parse import urlparse
 from urllib.error import HTTPError, URLError
 import xml.etree.ElementTree as ET
+from text_match import KeywordMatcher
+import llm_client
+import deadline
+import feed_dates
+from http_transport import urlopen
+import relevance
+import run_ledger
+import feed_health
+import run_log
+import sinks
+import sheets_client
 
 # ── Config ────────────────────────────────────────────────────────────────────
 SGT         = timezone(timedelta(hours=8))  # 新加坡时间 (SGT)
@@ -21,64 +33,6 @@ DATE_TO     = _now.strftime("%Y-%m-%d") if LOOKBACK_DAYS > 1 else (_now - timede
 SHEET_ID  = "1MCcEqV2OGkxFofWSRI6BW2OFYG35cNDHC2olbm43NWc"
 SHEET_TAB = "报告"
 
-GEMINI_KEYS = [k for k in [
-    os.environ.get("GEMINI_API_KEY", ""),
-    os.environ.get("GEMINI_API_KEY_2", ""),
-    os.environ.get("GEMINI_API_KEY_3", ""),
-] if k]
-GROQ_API_KEY       = os.environ.get("GROQ_API_KEY", "")
-OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "")
-
-# ── Gemini 动态模型选择 ───────────────────────────────────────────────────────
-GEMINI_PREFERRED = [
-    "gemini-2.5-flash",       # 首选：最新最优 flash
-    "gemini-2.0-flash",       # 备选：上一代，极稳定
-    "gemini-2.0-flash-lite",  # 再备：更便宜
-    "gemini-1.5-flash",       # 兜底：老但极可靠
-    "gemini-1.5-flash-8b",    # 最终兜底：最便宜
-]
-_EXCLUDE_KEYWORDS = ("pro", "preview", "exp", "thinking")
-
-def _model_version_key(name):
-    m = re.search(r'gemini-(\d+)[.\-](\d+)', name)
-    return (int(m.group(1)), int(m.group(2))) if m else (0, 0)
-
-@functools.lru_cache(maxsize=8)
-def _list_gemini_models(api_key):
-    """列出指定 API key 可用的 Gemini 模型（纯 REST，不依赖 SDK，结果缓存）"""
-    try:
-        from urllib.request import urlopen as _urlopen
-        import json as _json
-        url = f"https://generativelanguage.googleapis.com/v1beta/models?key={api_key}&pageSize=200"
-        with _urlopen(url, timeout=10) as r:
-            data = _json.loads(r.read())
-        return frozenset(
-            m["name"].removeprefix("models/")
-            for m in data.get("models", [])
-            if "generateContent" in m.get("supportedGenerationMethods", [])
-        )
-    except Exception as e:
-        print(f"  ⚠️ 无法列出 Gemini 模型: {e}")
-        return frozenset()
-
-def get_best_gemini_model(api_key):
-    """按优先级选择最佳可用 flash 模型，排除 pro/preview/exp/thinking"""
-    available = _list_gemini_models(api_key)
-    if not available:
-        return "gemini-2.0-flash"  # 列表失败时的默认值
-    for model in GEMINI_PREFERRED:
-        if model in available:
-            return model
-    # 所有优先模型均不可用：自动寻找版本最高的 flash 模型
-    candidates = [
-        m for m in available
-        if "flash" in m and not any(kw in m for kw in _EXCLUDE_KEYWORDS)
-    ]
-    if candidates:
-        chosen = max(candidates, key=_model_version_key)
-        print(f"  📌 自动降级至: {chosen}")
-        return chosen
-    return "gemini-1.5-flash"
 
 # ── Think Tank RSS Feeds ──────────────────────────────────────────────────────
 THINK_TANKS = [
@@ -101,26 +55,6 @@ NS_ATOM = "{http://www.w3.org/2005/Atom}"
 NS_DC   = "{http://purl.org/dc/elements/1.1/}"
 
 # ── Helpers ───────────────────────────────────────────────────────────────────
-def norm_date(date_str):
-    if not date_str:
-        return ""
-    import email.utils
-    date_str = date_str.strip()
-    try:
-        parsed = email.utils.parsedate_to_datetime(date_str)
-        return parsed.astimezone(SGT).strftime("%Y-%m-%d")
-    except:
-        pass
-    try:
-        cleaned = date_str.replace("Z", "+00:00")
-        parsed = datetime.fromisoformat(cleaned)
-        return parsed.astimezone(SGT).strftime("%Y-%m-%d")
-    except:
-        pass
-    if len(date_str) >= 10 and date_str[4] == "-" and date_str[7] == "-":
-        return date_str[:10]
-    return ""
-
 def get_text(el):
     if el is None:
         return ""
@@ -136,13 +70,12 @@ _SKIP_TITLES = [
     "codebook", "about the data", "note on",
 ]
 
+_SKIP_EXACT  = KeywordMatcher([(t, True) for t in _SKIP_TITLES], mode="exact")
+_SKIP_PREFIX = KeywordMatcher(
+    [(p, True) for p in ("appendix", "errata:", "correction:")], mode="prefix")
+
 def is_supplementary(title):
-    t = title.lower().strip()
-    if t in _SKIP_TITLES:
-        return True
-    if any(t.startswith(kw) for kw in ("appendix", "errata:", "correction:")):
-        return True
-    return False
+    return _SKIP_EXACT.matches(title) or _SKIP_PREFIX.matches(title)
 
 def get_atom_link(item):
     for link_el in item.findall(f"{NS_ATOM}link"):
@@ -157,10 +90,11 @@ def get_atom_link(item):
 def fetch_think_tank(name, category, url):
     try:
         req = Request(url, headers=HEADERS)
-        with urlopen(req, timeout=15) as resp:
-            raw = resp.read()
-        content = raw.decode("utf-8", errors="replace").lstrip("\ufeff")
-        root = ET.fromstring(content.encode("utf-8"))
+        with feed_health.probe(url, 15) as timeout:
+            with urlopen(req, timeout=timeout) as resp:
+                raw = resp.read()
+            content = raw.decode("utf-8", errors="replace").lstrip("\ufeff")
+            root = ET.fromstring(content.encode("utf-8"))
 
         is_atom = (root.tag == f"{NS_ATOM}feed" or
                    root.find(f".//{NS_ATOM}entry") is not None)
@@ -170,7 +104,7 @@ def fetch_think_tank(name, category, url):
         else:
             items = root.findall(".//item")
 
-        articles = []
+        entries = []
         for item in items:
             if is_atom:
                 title_el = item.find(f"{NS_ATOM}title")
@@ -184,9 +118,12 @@ def fetch_think_tank(name, category, url):
                 link_el  = item.find("link")
                 link     = get_text(link_el) if link_el is not None else ""
 
-            title    = get_text(title_el)
-            pub_date = norm_date(get_text(date_el))
+            entries.append((get_text(title_el), get_text(date_el), link))
 
+        # 同一 feed 的日期格式一致：按首条嗅探出的格式批量转换为 SGT 日期
+        dates = feed_dates.to_sgt_dates([raw_date for _, raw_date, _ in entries], feed=url)
+        articles = []
+        for (title, _, link), pub_date in zip(entries, dates):
             if not title or not pub_date or pub_date < DATE_FROM or pub_date > DATE_TO:
                 continue
             if is_supplementary(title):
@@ -203,6 +140,9 @@ def fetch_think_tank(name, category, url):
         print(f"  ✅ {name}: {len(articles)} 篇")
         return articles
 
+    except feed_health.CircuitOpen as e:
+        print(f"  ⏭️  {name}: 跳过，{e}")
+        return []
     except HTTPError as e:
         print(f"  ⚠️  {name}: HTTP {e.code}")
         return []
@@ -210,15 +150,105 @@ def fetch_think_tank(name, category, url):
         print(f"  ⚠️  {name}: 失败 ({e})")
         return []
 
+# ── 近重复聚类 ────────────────────────────────────────────────────────────────
+# 同一来源家族（"Our World in Data" 与 "Our World in Data (Insights)"）内：
+#   1. 标题几乎相同：词集合 Jaccard ≥ CLUSTER_TITLE_SIM，或一个标题完整包含另一个
+#      （至少 CLUSTER_CONTAIN_MIN 个词，如 "X" 与 "X: Methodology"）
+#   2. 一篇链接是另一篇的子路径（主报告 /slug/ 与 /slug/methodology/ 等附属页）
+# 同目录下不同 slug 的页面只按规则 1 合并：标题只差一个词（"views of China" / "of Russia"）
+# 的往往是不同报告，简介不能互相复制
+# 每簇只让代表（链接路径最短者，通常是主报告）进入 LLM，结果复制给其余成员
+CLUSTER_TITLE_SIM   = 0.85
+CLUSTER_CONTAIN_MIN = 4
+_TITLE_WORD_RE = re.compile(r"[a-z0-9]+")
+_TITLE_STOP    = frozenset("the and for with from into about how what why are was its of in on to a an".split())
+
+def _source_family(source):
+    return re.sub(r'\s*\([^)]*\)\s*$', '', source)
+
+def _title_tokens(title):
+    return {w for w in _TITLE_WORD_RE.findall(title.lower()) if len(w) > 2 and w not in _TITLE_STOP}
+
+def _title_words(title):
+    return " ".join(_TITLE_WORD_RE.findall(title.lower()))
+
+def _link_parts(link):
+    u = urlparse(link or "")
+    return u.netloc.lower().removeprefix("www."), [seg for seg in u.path.split("/") if seg]
+
+def _same_title(a, b):
+    ta, tb = a["_tokens"], b["_tokens"]
+    if ta and tb and len(ta & tb) / len(ta | tb) >= CLUSTER_TITLE_SIM:
+        return True
+    wa, wb = sorted((a["_words"], b["_words"]), key=len)
+    return len(wa.split()) >= CLUSTER_CONTAIN_MIN and f" {wa} " in f" {wb} "
+
+def _near_duplicate(a, b):
+    if _same_title(a, b):
+        return True
+    (host_a, path_a), (host_b, path_b) = a["_link"], b["_link"]
+    if not path_a or not path_b or host_a != host_b:
+        return False
+    short, long_ = sorted((path_a, path_b), key=len)
+    return len(short) < len(long_) and long_[:len(short)] == short
+
+def cluster_near_duplicates(articles):
+    """返回簇列表 [[代表, 成员...], ...]"""
+    for a in articles:
+        a["_tokens"] = _title_tokens(a["title"])
+        a["_words"]  = _title_words(a["title"])
+        a["_link"]   = _link_parts(a["link"])
+    parent = list(range(len(articles)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(articles)):
+        for j in range(i + 1, len(articles)):
+            if (_source_family(articles[i]["source"]) == _source_family(articles[j]["source"])
+                    and _near_duplicate(articles[i], articles[j])):
+                parent[find(j)] = find(i)
+
+    groups = {}
+    for i, a in enumerate(articles):
+        groups.setdefault(find(i), []).append(i)
+    clusters = []
+    for idxs in groups.values():   # dict 保持插入顺序：簇按首个成员的原顺序排列
+        rep = min(idxs, key=lambda i: (len(articles[i]["_link"][1]) or 99, i))
+        clusters.append([articles[rep]] + [articles[i] for i in idxs if i != rep])
+    for a in articles:
+        del a["_tokens"], a["_words"], a["_link"]
+    merged = sum(len(c) - 1 for c in clusters)
+    if merged:
+        print(f"  🧩 近重复聚类：{len(articles)} 篇 → {len(clusters)} 簇（{merged} 篇复用代表结果）")
+    return clusters
+
+def expand_clusters(clusters, kept_reps):
+    """把代表的简介 / 相关性复制给同簇成员；代表被过滤掉的簇整簇丢弃"""
+    kept_ids = {id(a) for a in kept_reps}
+    out = []
+    for rep, *members in clusters:
+        if id(rep) not in kept_ids:
+            continue
+        out.append(rep)
+        for m in members:
+            m["intro"], m["relevant"] = rep.get("intro", "暂无简介"), rep.get("relevant", True)
+            out.append(m)
+    return out
+
 # ── LLM 中文简介 ──────────────────────────────────────────────────────────────
-def summarize_reports(articles):
+def summarize_reports(articles, dl=None):
     if not articles:
         return articles
 
-    titles_list = "\n".join([
-        f"{i+1}. [{a['source']}] {a['title']}" for i, a in enumerate(articles)
-    ])
-    prompt = f"""你是一位社会科学领域的编辑，负责为社会学公众号筛选智库报告。
+    def build_prompt(indices):
+        titles_list = "\n".join([
+            f"{i}. [{articles[i-1]['source']}] {articles[i-1]['title']}" for i in indices
+        ])
+        return f"""你是一位社会科学领域的编辑，负责为社会学公众号筛选智库报告。
 请对以下标题完成：
 1. 判断相关性（relevant true/false）
 2. 若相关，用一句中文简介（35字以内）；不相关 score 留空。
@@ -227,103 +257,35 @@ def summarize_reports(articles):
 列表：
 {titles_list}
 
-请严格按 JSON 返回：
-[
+请严格按 JSON 返回，index 与列表编号一致：
+{{"items": [
   {{"index": 1, "relevant": true,  "score": "简介文本"}},
   ...
-]"""
-
-    def parse_scores(content):
-        content = content.strip()
-        if content.startswith("```"):
-            content = content.split("\n", 1)[-1].rsplit("```", 1)[0]
-        start, end = content.find("["), content.rfind("]") + 1
-        return json.loads(content[start:end])
-
-    def apply_scores(scores):
-        score_map    = {s["index"]: s.get("score", "暂无简介") for s in scores}
-        relevant_set = {s["index"] for s in scores if s.get("relevant", True)}
-        for i, a in enumerate(articles):
-            a["intro"]    = score_map.get(i + 1, "暂无简介")
-            a["relevant"] = (i + 1) in relevant_set
-
-    # 1. Groq（默认，最稳定）
-    if GROQ_API_KEY:
-        try:
-            payload = json.dumps({
-                "model": "llama-3.3-70b-versatile",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 1000,
-            }).encode()
-            req = Request("https://api.groq.com/openai/v1/chat/completions", data=payload,
-                headers={"Authorization": f"Bearer {GROQ_API_KEY}",
-                         "Content-Type": "application/json", "User-Agent": "curl/7.88.1"})
-            with urlopen(req, timeout=30) as resp:
-                result = json.loads(resp.read())
-            apply_scores(parse_scores(result["choices"][0]["message"]["content"].strip()))
-            print("  ✅ 简介生成完成（Groq）")
-            return _filter_relevant(articles)
-        except Exception as e:
-            print(f"  ⚠️  Groq: {e}，尝试 Gemini...")
-
-    # 2. Gemini（备用）
-    def call_gemini(api_key):
-        model = get_best_gemini_model(api_key)
-        print(f"  🤖 使用模型: {model}")
-        payload = json.dumps({
-            "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": {"maxOutputTokens": 2000}
-        }).encode()
-        req = Request(
-            f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}",
-            data=payload, headers={"Content-Type": "application/json"},
-        )
-        with urlopen(req, timeout=60) as resp:
-            result = json.loads(resp.read())
-        parts = result["candidates"][0]["content"]["parts"]
-        text = next((p["text"] for p in reversed(parts) if "text" in p), "").strip()
-        return parse_scores(text)
-
-    for key_idx, api_key in enumerate(GEMINI_KEYS):
-        label = f"Gemini key{key_idx+1}"
-        for attempt in range(3):
-            try:
-                apply_scores(call_gemini(api_key))
-                print(f"  ✅ 简介生成完成（{label}）")
-                return _filter_relevant(articles)
-            except Exception as e:
-                if "429" in str(e) or "RESOURCE_EXHAUSTED" in str(e):
-                    if attempt < 2:
-                        time.sleep((attempt + 1) * 10)
-                        print(f"  ⏳ {label} 限速，重试中...")
-                    else:
-                        print(f"  ⏳ {label} 持续限速，换下一个 key")
-                else:
-                    print(f"  ⚠️  {label}: {e}，换下一个 key")
-                    break
-
-    # 3. OpenRouter
-    if OPENROUTER_API_KEY:
-        for attempt in range(3):
-            try:
-                payload = json.dumps({
-                    "model": "meta-llama/llama-3.3-70b-instruct:free",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 1000,
-                }).encode()
-                req = Request("https://openrouter.ai/api/v1/chat/completions", data=payload,
-                    headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                             "Content-Type": "application/json", "HTTP-Referer": "https://openclaw.ai"})
-                with urlopen(req, timeout=30) as resp:
-                    result = json.loads(resp.read())
-                apply_scores(parse_scores(result["choices"][0]["message"]["content"].strip()))
-                print("  ✅ 简介生成完成（OpenRouter）")
-                return _filter_relevant(articles)
-            except Exception as e:
-                if "429" in str(e):
-                    time.sleep((attempt + 1) * 15)
-                else:
-                    print(f"  ⚠️  OpenRouter: {e}"); break
+]}}"""
+
+    def apply_item(item):
+        """流式逐条应用；relevant 不是布尔值视为不合格，该条会被重新请求"""
+        relevant = item.get("relevant", True)
+        if not isinstance(relevant, bool):
+            return False
+        intro = item.get("score")
+        a = articles[item["index"] - 1]
+        a["intro"]    = intro.strip() if isinstance(intro, str) and intro.strip() else "暂无简介"
+        a["relevant"] = relevant
+        return True
+
+    missing, providers = llm_client.complete_items(
+        build_prompt, len(articles),
+        {"index": "INTEGER", "relevant": "BOOLEAN", "score": "STRING"},
+        apply_item, indent="  ", deadline=dl)
+    if providers:
+        relevance.record_decisions([a for i, a in enumerate(articles, 1) if i not in missing])
+        for i in missing:   # 模型漏掉的条目按不相关处理（与整批解析时一致）
+            articles[i - 1]["intro"]    = "暂无简介"
+            articles[i - 1]["relevant"] = False
+        note = f"，{len(missing)} 篇缺失" if missing else ""
+        print(f"  ✅ 简介生成完成（{' + '.join(dict.fromkeys(providers))}）{note}")
+        return _filter_relevant(articles)
 
     print("  ⚠️  所有模型失败，使用默认值")
     for a in articles:
@@ -336,56 +298,76 @@ def _filter_relevant(articles):
     print(f"  🔍 保留 {len(kept)}/{len(articles)} 篇报告")
     return kept
 
-# ── 写入 Google Sheets ────────────────────────────────────────────────────────
-def write_to_sheets(articles):
-    if not articles: return
-    rows = []
-    for a in sorted(articles, key=lambda x: x["category"]):
-        rows.append(["'" + a["date"], a["category"], a["source"],
-                     a["title"], a["intro"], a["link"]])
+# ── 读取历史 / 写入输出（Google Sheets / 本地后端，见 sinks.py）──────────────
+OUTPUT_HEADER = ["date", "category", "source", "title", "intro", "link"]
 
-    sa_json = os.environ.get("GOOGLE_SERVICE_ACCOUNT", "")
+def load_sheet_titles():
+    """报告 tab 已写入的 (标题, 来源)，作为本地预筛的正例；读取失败返回空列表"""
     try:
-        import gspread
-        from google.oauth2.service_account import Credentials
-
-        if sa_json:
-            sa_info = json.loads(base64.b64decode(sa_json))
-            creds = Credentials.from_service_account_info(
-                sa_info, scopes=["https://www.googleapis.com/auth/spreadsheets"]
-            )
-        else:
-            import google.auth
-            creds, _ = google.auth.default(
-                scopes=["https://www.googleapis.com/auth/spreadsheets"])
-
-        gc = gspread.authorize(creds)
-        ws = gc.open_by_key(SHEET_ID).worksheet(SHEET_TAB)
-        # 时间戳行 + 数据 + 空行分隔（置顶）
-        ts = datetime.now(SGT).strftime("%Y/%m/%d, %H:%M") + "完成更新"
-        timestamp_row = [[ts] + [""] * (len(rows[0]) - 1)]
-        separator = [[""] * len(rows[0])]
-        ws.insert_rows(timestamp_row + rows + separator, row=2, value_input_option="USER_ENTERED")
-        print(f"✅ 成功写入 {len(articles)} 篇报告（已置顶）")
+        cols = sheets_client.open_worksheet(SHEET_ID, SHEET_TAB).batch_get(["C2:D"])[0]
+        return [(row[1], row[0]) for row in cols if len(row) >= 2 and row[1].strip()]
     except Exception as e:
-        print(f"❌ gspread 写入失败: {e}")
+        print(f"  ⚠️  读取历史报告失败（跳过本地预筛训练正例）: {e}")
+        return []
+
+def write_output(articles, sink_names=None):
+    if not articles: return True
+    rows = [[a["date"], a["category"], a["source"], a["title"], a["intro"], a["link"]]
+            for a in sorted(articles, key=lambda x: x["category"])]
+    ok = sinks.write(SHEET_ID, SHEET_TAB, OUTPUT_HEADER, rows, sinks=sink_names)
+    if ok:
+        print(f"✅ 成功写入 {len(articles)} 篇报告")
+    return ok
 
 # ── Main ──────────────────────────────────────────────────────────────────────
-def main():
+def main(sink_names=None, force=False):
     print(f"🔍 抓取范围: {DATE_FROM} 至 {DATE_TO}")
+    window = f"{DATE_FROM}~{DATE_TO}"
+    ledger_config = {"tanks": THINK_TANKS, "sinks": sink_names or sinks.DEFAULT_SINKS}
+    if run_ledger.completed("fetch-reports", window, ledger_config, force):
+        run_log.count("ledger_skip")
+        return
+    llm_client.prefetch()   # 模型目录在后台刷新，与 RSS 抓取并行
+    dl = deadline.start()
+    fetch_dl = dl.stage(0.4)
     all_articles = []
-    for name, category, url in THINK_TANKS:
-        all_articles.extend(fetch_think_tank(name, category, url))
-        time.sleep(0.5)
+    with run_log.stage("fetch"):
+        for i, (name, category, url) in enumerate(THINK_TANKS):
+            if fetch_dl.expired():
+                print(f"  ⏰ 抓取阶段时间预算用尽，跳过其余 {len(THINK_TANKS) - i} 个来源")
+                break
+            all_articles.extend(fetch_think_tank(name, category, url))
+            time.sleep(0.5)
+    feed_health.save()
+    run_log.count("fetched", len(all_articles))
 
     if not all_articles:
         print("没有新报告，退出。"); return
 
+    clusters = cluster_near_duplicates(all_articles)
+    reps = [c[0] for c in clusters]
+
+    print("🧮 本地相关性预筛...")
+    with run_log.stage("prefilter"):
+        model = relevance.build_model(load_sheet_titles)
+        reps, _ = relevance.prefilter(reps, model)
+    if not reps:
+        print("预筛后没有候选报告，退出。"); return
+
     print("🤖 正在生成简介...")
-    all_articles = summarize_reports(all_articles)
+    with run_log.stage("summarize"):
+        all_articles = expand_clusters(clusters, summarize_reports(reps, dl))
+    run_log.count("kept", len(all_articles))
     
-    print("📊 写入 Google Sheets...")
-    write_to_sheets(all_articles)
+    links = sorted(a["link"] for a in all_articles)
+    if run_ledger.written_elsewhere("fetch-reports", links, SHEET_ID, SHEET_TAB, "F", sink_names, force):
+        written = True
+    else:
+        print("📊 写入输出...")
+        with run_log.stage("write"):
+            written = write_output(all_articles, sink_names)
+    if written:
+        run_ledger.record("fetch-reports", window, ledger_config, links)
 
 if __name__ == "__main__":
-    main()
+    main(force="--force" in sys.argv)
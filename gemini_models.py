@@ -0,0 +1,128 @@
+"""
+gemini_models.py — Gemini 动态模型选择（fetch_journals / fetch_reports 共用）
+- 模型目录（/v1beta/models）持久缓存到 STATE_DIR，带 TTL；STATE_DIR 为 gs:// 时所有实例共享
+- 过期或缺失时后台线程刷新，get_best_gemini_model 永远直接从缓存作答，
+  不再把最长 10 秒的目录请求放在第一次 LLM 调用之前
+- 冷启动且无任何缓存时先用 DEFAULT_MODEL，刷新完成后的调用自动用上最佳模型
+"""
+import hashlib, json, os, re, threading, time
+
+from http_transport import urlopen
+import run_log
+from state_store import state_path, load_json, save_json
+
+GEMINI_PREFERRED = [
+    "gemini-2.5-flash",       # 首选：最新最优 flash
+    "gemini-2.0-flash",       # 备选：上一代，极稳定
+    "gemini-2.0-flash-lite",  # 再备：更便宜
+    "gemini-1.5-flash",       # 兜底：老但极可靠
+    "gemini-1.5-flash-8b",    # 最终兜底：最便宜
+]
+_EXCLUDE_KEYWORDS = ("pro", "preview", "exp", "thinking")
+DEFAULT_MODEL = "gemini-2.0-flash"   # 目录不可用时的默认值
+
+CATALOG_FILE = state_path("gemini_models.json")
+CATALOG_TTL  = int(os.environ.get("GEMINI_CATALOG_TTL", str(6 * 3600)))   # 秒
+
+_lock       = threading.Lock()
+_catalogs   = None        # key_id → {"models": [...], "ts": epoch}
+_refreshing = set()
+
+
+def _model_version_key(name):
+    m = re.search(r'gemini-(\d+)[.\-](\d+)', name)
+    return (int(m.group(1)), int(m.group(2))) if m else (0, 0)
+
+
+def _key_id(api_key):
+    """缓存文件里只存 key 的哈希，不落盘明文 key"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+def _list_gemini_models(api_key):
+    """列出指定 API key 可用的 Gemini 模型（纯 REST，不依赖 SDK）；失败返回 None"""
+    try:
+        url = f"https://generativelanguage.googleapis.com/v1beta/models?key={api_key}&pageSize=200"
+        with urlopen(url, timeout=10) as r:
+            data = json.loads(r.read())
+        return sorted(
+            m["name"].removeprefix("models/")
+            for m in data.get("models", [])
+            if "generateContent" in m.get("supportedGenerationMethods", [])
+        )
+    except Exception as e:
+        print(f"  ⚠️ 无法列出 Gemini 模型: {e}")
+        return None
+
+
+def _load_catalogs():
+    global _catalogs
+    if _catalogs is None:
+        _catalogs = load_json(CATALOG_FILE, {})
+    return _catalogs
+
+
+def _refresh(api_key):
+    try:
+        models = _list_gemini_models(api_key)
+        if models is None:
+            return
+        stored = load_json(CATALOG_FILE, {})
+        with _lock:
+            catalogs = _load_catalogs()
+            # 合并其他实例 / 其他 key 写入的更新结果后再写回
+            catalogs.update({k: v for k, v in stored.items()
+                             if v.get("ts", 0) > catalogs.get(k, {}).get("ts", 0)})
+            catalogs[_key_id(api_key)] = {"models": models, "ts": int(time.time())}
+            snapshot = dict(catalogs)
+        save_json(CATALOG_FILE, snapshot)
+    finally:
+        with _lock:
+            _refreshing.discard(_key_id(api_key))
+
+
+def refresh_async(api_key):
+    """后台刷新目录（同一 key 同时只跑一个刷新线程）"""
+    kid = _key_id(api_key)
+    with _lock:
+        if kid in _refreshing:
+            return
+        _refreshing.add(kid)
+    threading.Thread(target=_refresh, args=(api_key,), daemon=True).start()
+
+
+def prefetch(api_keys):
+    """流程开头调用：过期 / 缺失的目录提前在后台刷新，与抓取阶段并行"""
+    for api_key in api_keys:
+        _cached_models(api_key)
+
+
+def _cached_models(api_key):
+    """缓存中的模型集合（可能已过期）；过期或缺失时触发后台刷新"""
+    with _lock:
+        entry = _load_catalogs().get(_key_id(api_key))
+    fresh = bool(entry) and time.time() - entry.get("ts", 0) <= CATALOG_TTL
+    run_log.cache("gemini_models", fresh)
+    if not fresh:
+        refresh_async(api_key)
+    return frozenset(entry["models"]) if entry else frozenset()
+
+
+def get_best_gemini_model(api_key):
+    """按优先级选择最佳可用 flash 模型，排除 pro/preview/exp/thinking"""
+    available = _cached_models(api_key)
+    if not available:
+        return DEFAULT_MODEL
+    for model in GEMINI_PREFERRED:
+        if model in available:
+            return model
+    # 所有优先模型均不可用：自动寻找版本最高的 flash 模型
+    candidates = [
+        m for m in available
+        if "flash" in m and not any(kw in m for kw in _EXCLUDE_KEYWORDS)
+    ]
+    if candidates:
+        chosen = max(candidates, key=_model_version_key)
+        print(f"  📌 自动降级至: {chosen}")
+        return chosen
+    return "gemini-1.5-flash"
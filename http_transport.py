@@ -0,0 +1,252 @@
+"""
+http_transport.py — 共享 HTTP 传输（三个抓取流程 + LLM / 模型目录调用共用）
+- 按 (scheme, host, port) 复用 keep-alive 连接，省去重复的 TCP / TLS 握手
+- 自动声明 Accept-Encoding: gzip, deflate 并透明解压（流式读取同样逐块解压）
+- DNS 解析结果进程内缓存 DNS_TTL 秒
+- 默认超时 HTTP_TIMEOUT 秒，调用方可逐次覆盖；自动跟随 3xx 重定向
+- urlopen(url_or_request, timeout) 与 urllib.request.urlopen 用法兼容：
+  4xx/5xx 抛 urllib.error.HTTPError，连接失败抛 URLError，调用方异常处理不变
+curl 子进程抓取（fetch_jobs 详情页、redirects）不经过这里
+"""
+import http.client, io, os, socket, ssl, sys, threading, time, zlib
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin, urlsplit
+from urllib.request import Request
+
+HTTP_TIMEOUT      = float(os.environ.get("HTTP_TIMEOUT", "30"))
+DNS_TTL           = 300    # 秒
+IDLE_MAX_AGE      = 30     # 空闲连接超过该秒数不再复用（服务端多半已关闭）
+MAX_IDLE_PER_HOST = 8
+MAX_REDIRECTS     = 5
+_DEFAULT_UA = "Python-urllib/%d.%d" % sys.version_info[:2]   # 与 urllib 默认 UA 一致
+
+_ssl_ctx = ssl.create_default_context()
+_lock    = threading.Lock()
+_idle    = {}   # (scheme, host, port) → [(conn, last_used), ...]
+_dns     = {}   # (host, port) → (expires_at, addrinfo)
+
+
+# ── DNS 缓存 ─────────────────────────────────────────────────────────────────
+def _resolve(host, port):
+    now = time.monotonic()
+    with _lock:
+        hit = _dns.get((host, port))
+    if hit and hit[0] > now:
+        return hit[1]
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    with _lock:
+        _dns[(host, port)] = (now + DNS_TTL, infos)
+    return infos
+
+
+def _create_connection(address, timeout=None, source_address=None):
+    """替代 socket.create_connection：地址来自 DNS 缓存，全部失败时清掉该条缓存"""
+    host, port = address
+    err = None
+    for family, type_, proto, _, sockaddr in _resolve(host, port):
+        sock = socket.socket(family, type_, proto)
+        try:
+            sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            err = e
+            sock.close()
+    with _lock:
+        _dns.pop((host, port), None)
+    raise err or OSError(f"无法连接 {host}:{port}")
+
+
+# ── 连接池 ───────────────────────────────────────────────────────────────────
+def _checkout(key, timeout):
+    """返回 (连接, 是否复用)；过期的空闲连接直接关闭"""
+    now = time.monotonic()
+    with _lock:
+        pool = _idle.get(key, [])
+        while pool:
+            conn, last_used = pool.pop()
+            if now - last_used <= IDLE_MAX_AGE and conn.sock is not None:
+                try:
+                    conn.sock.settimeout(timeout)
+                    conn.timeout = timeout
+                    return conn, True
+                except OSError:
+                    pass
+            conn.close()
+    scheme, host, port = key
+    if scheme == "https":
+        conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=_ssl_ctx)
+    else:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    conn._create_connection = _create_connection
+    return conn, False
+
+
+def _checkin(key, conn):
+    with _lock:
+        pool = _idle.setdefault(key, [])
+        if len(pool) < MAX_IDLE_PER_HOST:
+            pool.append((conn, time.monotonic()))
+            return
+    conn.close()
+
+
+# ── 响应 ─────────────────────────────────────────────────────────────────────
+class Response:
+    """类文件响应：read / read1 / readline / 逐行迭代；响应体读完即把连接还回池中，
+    中途 close（如对冲取消的流）则直接关闭连接"""
+
+    def __init__(self, raw, conn, key, url):
+        self._raw, self._conn, self._key = raw, conn, key
+        self.url     = url
+        self.status  = raw.status
+        self.reason  = raw.reason
+        self.headers = raw.headers
+        enc = (raw.getheader("Content-Encoding") or "").strip().lower()
+        self._enc = enc if enc in ("gzip", "x-gzip", "deflate") else ""
+        self._dec = zlib.decompressobj(32 + zlib.MAX_WBITS) if self._enc else None
+        self._buf = bytearray()
+
+    def getcode(self):
+        return self.status
+
+    def _decompress(self, chunk):
+        try:
+            return self._dec.decompress(chunk)
+        except zlib.error:
+            # 少数服务器的 deflate 是不带 zlib 头的裸流
+            if self._enc != "deflate" or self._dec.unused_data or self._buf:
+                raise
+            self._dec = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._dec.decompress(chunk)
+
+    def _fill(self, n=65536):
+        if self._conn is None:
+            return False
+        chunk = self._raw.read1(n)
+        if not chunk or self._raw.length == 0:
+            # read() 让 http.client 把响应标记为已结束（read1 读满 Content-Length 后不会）
+            chunk += self._raw.read()
+            eof = True
+        else:
+            eof = False
+        if chunk:
+            self._buf += self._decompress(chunk) if self._dec else chunk
+        if eof:
+            if self._dec:
+                self._buf += self._dec.flush()
+            self._release()
+        return bool(chunk)
+
+    def _take(self, n):
+        out = bytes(self._buf[:n])
+        del self._buf[:n]
+        return out
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            while self._fill():
+                pass
+            return self._take(len(self._buf))
+        while len(self._buf) < n and self._fill():
+            pass
+        return self._take(n)
+
+    def read1(self, n=65536):
+        while not self._buf and self._fill(n):
+            pass
+        return self._take(n)
+
+    def readline(self):
+        while b"\n" not in self._buf and self._fill():
+            pass
+        idx = self._buf.find(b"\n")
+        return self._take(idx + 1 if idx >= 0 else len(self._buf))
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def _release(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._raw.will_close:
+            conn.close()
+        else:
+            _checkin(self._key, conn)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:   # 响应体未读完：连接状态未知，不复用
+            self._raw.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ── 请求 ─────────────────────────────────────────────────────────────────────
+def _send(method, url, headers, data, timeout):
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https"):
+        raise URLError(f"不支持的协议: {url}")
+    port = parts.port or (443 if scheme == "https" else 80)
+    key  = (scheme, parts.hostname, port)
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+    for attempt in range(2):
+        conn, reused = _checkout(key, timeout)
+        try:
+            conn.request(method, path, body=data, headers=headers)
+            return Response(conn.getresponse(), conn, key, url)
+        except (ConnectionResetError, BrokenPipeError, http.client.BadStatusLine) as e:
+            conn.close()
+            if reused and attempt == 0:   # 复用的连接已被服务端关闭：换新连接重发一次
+                continue
+            raise URLError(e)
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            if isinstance(e, TimeoutError):
+                raise
+            raise URLError(e)
+
+
+def request(method, url, headers=None, data=None, timeout=None):
+    hdrs = {"User-Agent": _DEFAULT_UA, "Accept-Encoding": "gzip, deflate"}
+    for k, v in (headers or {}).items():
+        hdrs[k.title()] = v
+    timeout = timeout or HTTP_TIMEOUT
+
+    for _ in range(MAX_REDIRECTS + 1):
+        resp = _send(method, url, hdrs, data, timeout)
+        location = resp.headers.get("Location")
+        if resp.status in (301, 302, 303, 307, 308) and location:
+            resp.read()
+            url = urljoin(url, location)
+            if resp.status == 303 or (resp.status in (301, 302) and method == "POST"):
+                method, data = "GET", None
+                hdrs.pop("Content-Type", None)
+            continue
+        if resp.status >= 400:
+            body = resp.read()
+            raise HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(body))
+        return resp
+    raise URLError(f"重定向次数过多: {url}")
+
+
+def urlopen(req, timeout=None):
+    """urllib.request.urlopen 的替代：接受 URL 字符串或 urllib.request.Request"""
+    if isinstance(req, str):
+        req = Request(req)
+    return request(req.get_method(), req.full_url, dict(req.header_items()),
+                   req.data, timeout)
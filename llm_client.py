@@ -0,0 +1,415 @@
+"""
+llm_client.py — Groq → Gemini（多 key）→ OpenRouter 级联调用（fetch_journals / fetch_reports 共用）
+- complete_items(build_prompt, total, fields, on_item)：逐条结果型调用
+  · 结构化输出：Groq / OpenRouter 用 JSON mode，Gemini 用 responseSchema，统一返回 {"items": [...]}
+  · 流式读取（Gemini / OpenRouter 走 SSE），每解析出一个完整条目就立即交给 on_item
+  · 单个条目格式错误只丢弃该条；一轮结束后只把缺失的 index 重新请求
+- 对冲模式（LLM_HEDGE=1）：当前档位超过其历史延迟的 LLM_HEDGE_PERCENTILE 分位仍未完成时，
+  并发启动下一档；最先完成的一档胜出，其余流立即断开
+- 各档成功调用的延迟持久化到 STATE_DIR，用于计算对冲阈值
+- 截止时间（deadline.Deadline）：到期时打断在途流（已交付条目保留）；剩余时间不足某档
+  历史延迟时跳过该后备档位，不足 LLM_MIN_ROUND 秒时不再发起补请求轮
+"""
+import json, os, threading, time, queue
+from urllib.request import Request
+
+import gemini_models
+from http_transport import urlopen
+from gemini_models import get_best_gemini_model
+from deadline import NEVER
+import run_log
+from state_store import state_path, load_json, save_json
+
+GEMINI_KEYS = [k for k in [
+    os.environ.get("GEMINI_API_KEY", ""),
+    os.environ.get("GEMINI_API_KEY_2", ""),
+    os.environ.get("GEMINI_API_KEY_3", ""),
+] if k]
+GROQ_API_KEY       = os.environ.get("GROQ_API_KEY", "")
+OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "")
+
+LLM_HEDGE            = os.environ.get("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "90"))
+LLM_HEDGE_DEFAULT    = float(os.environ.get("LLM_HEDGE_DEFAULT", "8"))   # 样本不足时的对冲阈值（秒）
+LLM_MAX_ROUNDS       = 3     # 首轮 + 最多两轮只补缺失 index
+LLM_MIN_ROUND        = 10    # 剩余时间（秒）不足时不再发起补请求轮
+LLM_MIN_TIER         = 3     # 剩余时间（秒）不足时不再启动任何档位（含首档）
+_MIN_SAMPLES = 5
+_MAX_SAMPLES = 50
+
+LATENCY_FILE = state_path("llm_latency.json")
+_lat_lock  = threading.Lock()
+_latencies = None   # provider → [秒, ...]
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def prefetch():
+    """流程开头调用：Gemini 模型目录在后台刷新"""
+    gemini_models.prefetch(GEMINI_KEYS)
+
+
+# ── 增量解析 ─────────────────────────────────────────────────────────────────
+class _ItemScanner:
+    """逐块喂入文本，吐出数组里每个已闭合的 {...} 对象
+
+    只跟踪括号深度和字符串转义，不依赖整体 JSON 合法；
+    {"items": [...]}、裸数组、带 ``` 代码块的输出都能识别
+    """
+
+    def __init__(self):
+        self.buf    = []
+        self.stack  = []     # [(容器字符, 在 buf 中的起点)]
+        self.in_str = False
+        self.escape = False
+        self.pos    = 0
+
+    def feed(self, chunk):
+        items = []
+        for ch in chunk:
+            self.buf.append(ch)
+            if self.in_str:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_str = False
+            elif ch == '"':
+                self.in_str = True
+            elif ch in "[{":
+                self.stack.append((ch, self.pos))
+            elif ch in "]}" and self.stack:
+                opener, start = self.stack.pop()
+                if ch == "}" and opener == "{" and self.stack and self.stack[-1][0] == "[":
+                    try:
+                        obj = json.loads("".join(self.buf[start:self.pos + 1]))
+                    except ValueError:
+                        obj = None      # 单条损坏：丢弃该条，稍后按缺失 index 重新请求
+                    if isinstance(obj, dict):
+                        items.append(obj)
+            self.pos += 1
+        return items
+
+    @property
+    def head(self):
+        return "".join(self.buf[:80])
+
+
+def _iter_sse(resp):
+    """Server-Sent Events：逐行读取 data: 负载"""
+    for raw in resp:
+        line = raw.decode("utf-8", errors="replace").strip()
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        yield json.loads(data)
+
+
+def _items_schema(fields):
+    """fields: {名称: "INTEGER"/"STRING"/"BOOLEAN"} → Gemini responseSchema"""
+    return {
+        "type": "OBJECT",
+        "properties": {"items": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {k: {"type": t} for k, t in fields.items()},
+                "required": list(fields),
+            },
+        }},
+        "required": ["items"],
+    }
+
+
+# ── 各提供方单次调用（文本分块交给 on_text）──────────────────────────────────
+def _call_groq(prompt, fields, on_text, budget):
+    # Groq 的 JSON mode 不支持流式：整段返回后一次性交给增量解析
+    payload = json.dumps({
+        "model": "llama-3.3-70b-versatile",
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 1000,
+        "response_format": {"type": "json_object"},
+    }).encode()
+    req = Request("https://api.groq.com/openai/v1/chat/completions", data=payload,
+        headers={"Authorization": f"Bearer {GROQ_API_KEY}",
+                 "Content-Type": "application/json", "User-Agent": "curl/7.88.1"})
+    with urlopen(req, timeout=min(30, budget)) as resp:
+        result = json.loads(resp.read())
+    on_text(result["choices"][0]["message"]["content"])
+
+
+def _call_gemini(api_key, prompt, fields, on_text, indent, budget):
+    model = get_best_gemini_model(api_key)
+    print(f"{indent}🤖 使用模型: {model}")
+    payload = json.dumps({
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "maxOutputTokens": 2000,
+            "responseMimeType": "application/json",
+            "responseSchema": _items_schema(fields),
+        },
+    }).encode()
+    req = Request(
+        f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent"
+        f"?alt=sse&key={api_key}",
+        data=payload, headers={"Content-Type": "application/json"},
+    )
+    with urlopen(req, timeout=min(60, budget)) as resp:
+        for event in _iter_sse(resp):
+            for cand in event.get("candidates", [])[:1]:
+                for part in cand.get("content", {}).get("parts", []):
+                    if "text" in part and not part.get("thought"):
+                        on_text(part["text"])
+
+
+def _call_openrouter(prompt, fields, on_text, budget):
+    payload = json.dumps({
+        "model": "meta-llama/llama-3.3-70b-instruct:free",
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 1000,
+        "response_format": {"type": "json_object"},
+        "stream": True,
+    }).encode()
+    req = Request("https://openrouter.ai/api/v1/chat/completions", data=payload,
+        headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}",
+                 "Content-Type": "application/json", "HTTP-Referer": "https://openclaw.ai"})
+    with urlopen(req, timeout=min(30, budget)) as resp:
+        for event in _iter_sse(resp):
+            if "error" in event:
+                raise RuntimeError(f"OpenRouter stream error: {event['error']}")
+            for choice in event.get("choices", [])[:1]:
+                text = (choice.get("delta") or {}).get("content")
+                if text:
+                    on_text(text)
+
+
+# ── 级联档位 ─────────────────────────────────────────────────────────────────
+def _tiers(indent):
+    """[(label, 延迟统计名, call(prompt, fields, on_text, budget), 重试策略)]；重试策略 = (次数, 429 退避基数秒)
+    budget：本次调用可用的秒数（截止时间剩余），作为连接 / 读取超时的上限"""
+    tiers = []
+    if GROQ_API_KEY:
+        tiers.append(("Groq", "Groq", _call_groq, (1, 0)))
+    for key_idx, api_key in enumerate(GEMINI_KEYS):
+        tiers.append((f"Gemini key{key_idx+1}", "Gemini",
+                      lambda p, f, cb, t, k=api_key: _call_gemini(k, p, f, cb, indent, t), (3, 10)))
+    if OPENROUTER_API_KEY:
+        tiers.append(("OpenRouter", "OpenRouter", _call_openrouter, (3, 15)))
+    return tiers
+
+
+def _is_rate_limited(e):
+    return "429" in str(e) or "RESOURCE_EXHAUSTED" in str(e)
+
+
+def _run_tier(tier, prompt, fields, deliver, indent, cancelled, dl=NEVER):
+    """按该档重试策略流式调用；条目边到边 deliver。
+    成功返回 (交付条数, 延迟)；一条都没交付视为失败，抛出最后一个异常
+    每次调用的超时不超过 dl 的剩余时间：阻塞的连接 / 读取不会拖过截止时间"""
+    label, stat_name, call, (attempts, backoff) = tier
+    for attempt in range(attempts):
+        if cancelled.is_set() or dl.remaining() < LLM_MIN_TIER:
+            raise _Cancelled()
+        scanner   = _ItemScanner()
+        delivered = 0
+
+        def on_text(chunk):
+            nonlocal delivered
+            if cancelled.is_set():
+                raise _Cancelled()   # 对冲已有胜者：抛出即关闭连接
+            for item in scanner.feed(chunk):
+                if deliver(item):
+                    delivered += 1
+
+        t0 = time.monotonic()
+        try:
+            call(prompt, fields, on_text, max(1.0, dl.remaining()))
+            if not delivered:
+                raise ValueError(f"No valid items: {scanner.head!r}")
+            return delivered, time.monotonic() - t0
+        except Exception as e:
+            if cancelled.is_set():
+                raise _Cancelled()
+            if delivered:
+                # 流中途断开但已有条目：保留已交付的，缺失部分由下一轮补请求
+                print(f"{indent}⚠️  {label}: {e}（已收到 {delivered} 条）")
+                return delivered, time.monotonic() - t0
+            if backoff and _is_rate_limited(e) and attempt < attempts - 1:
+                print(f"{indent}⏳ {label} 限速，重试中...")
+                if cancelled.wait((attempt + 1) * backoff):
+                    raise _Cancelled()
+                continue
+            if backoff and _is_rate_limited(e):
+                print(f"{indent}⏳ {label} 持续限速，换下一档")
+            else:
+                print(f"{indent}⚠️  {label}: {e}，换下一档")
+            raise
+
+
+# ── 延迟统计 ─────────────────────────────────────────────────────────────────
+def _load_latencies():
+    global _latencies
+    if _latencies is None:
+        _latencies = load_json(LATENCY_FILE, {})
+    return _latencies
+
+
+def _record_latency(stat_name, seconds):
+    with _lat_lock:
+        samples = _load_latencies().setdefault(stat_name, [])
+        samples.append(round(seconds, 2))
+        del samples[:-_MAX_SAMPLES]
+
+
+def _save_latencies():
+    with _lat_lock:
+        snapshot = {k: list(v) for k, v in _load_latencies().items()}
+    save_json(LATENCY_FILE, snapshot)
+
+
+def hedge_delay(stat_name):
+    """该档历史成功延迟的 LLM_HEDGE_PERCENTILE 分位；样本不足时用 LLM_HEDGE_DEFAULT"""
+    with _lat_lock:
+        samples = sorted(_load_latencies().get(stat_name, []))
+    if len(samples) < _MIN_SAMPLES:
+        return LLM_HEDGE_DEFAULT
+    k = min(len(samples) - 1, int(round(LLM_HEDGE_PERCENTILE / 100 * (len(samples) - 1))))
+    return samples[k]
+
+
+# ── 对外接口 ─────────────────────────────────────────────────────────────────
+def complete_items(build_prompt, total, fields, on_item, indent="  ", hedge=None, deadline=None):
+    """对 index 1..total 逐条请求 LLM 结果，返回 (未完成的 index 集合, 用到的档位名列表)
+
+    - build_prompt(indices)：只包含这些 index 的提示词，条目编号沿用原 index
+    - fields：每条结果的字段及类型，如 {"index": "INTEGER", "score": "STRING"}
+    - on_item(item)：应用一条结果；内容不合格时返回 False，该 index 会被重新请求
+    - deadline：到期后不再发起新请求，在途的流被打断
+    """
+    pending = set(range(1, total + 1))
+    lock    = threading.Lock()
+    used    = []
+    hedge   = LLM_HEDGE if hedge is None else hedge
+    dl      = deadline or NEVER
+
+    def deliver(item):
+        idx = item.get("index")
+        with lock:
+            if not isinstance(idx, int) or idx not in pending:
+                return False      # 越界 / 重复（对冲时两档都可能返回同一条）
+            try:
+                ok = on_item(item)
+            except Exception:
+                ok = False
+            if ok:
+                pending.discard(idx)
+            return bool(ok)
+
+    tiers = _tiers(indent)
+    try:
+        for round_no in range(LLM_MAX_ROUNDS):
+            with lock:
+                todo = sorted(pending)
+            if not todo or not tiers:
+                break
+            if dl.remaining() < (LLM_MIN_ROUND if round_no else 1):
+                print(f"{indent}⏰ 时间预算不足，{len(todo)} 条不再请求")
+                break
+            if round_no:
+                print(f"{indent}🔁 补请求缺失的 {len(todo)} 条")
+            prompt = build_prompt(todo)
+            if hedge and len(tiers) > 1:
+                provider = _complete_hedged(tiers, prompt, fields, deliver, indent, dl)
+            else:
+                provider = _complete_sequential(tiers, prompt, fields, deliver, indent, dl)
+            if provider is None:
+                break             # 所有档位都失败：再补请求也没有意义
+            used.append(provider)
+            run_log.provider(provider)
+    finally:
+        _save_latencies()
+    with lock:
+        return set(pending), used
+
+
+def _complete_sequential(tiers, prompt, fields, deliver, indent, dl):
+    expired = threading.Event()
+    timer   = dl.arm(expired)
+    try:
+        for i, tier in enumerate(tiers):
+            # 剩余时间不足 LLM_MIN_TIER 时任何档位都不启动；
+            # 后备档位：剩余时间连它的历史延迟都不够时直接放弃
+            if expired.is_set() or dl.remaining() < LLM_MIN_TIER \
+                    or (i and dl.remaining() < hedge_delay(tier[1])):
+                print(f"{indent}⏰ 时间预算不足，跳过 {', '.join(t[0] for t in tiers[i:])}")
+                return None
+            try:
+                _, seconds = _run_tier(tier, prompt, fields, deliver, indent, expired, dl)
+            except Exception:
+                continue
+            _record_latency(tier[1], seconds)
+            return tier[0]
+        return None
+    finally:
+        if timer:
+            timer.cancel()
+
+
+def _complete_hedged(tiers, prompt, fields, deliver, indent, dl):
+    cancelled = threading.Event()
+    done_q    = queue.Queue()
+    timer     = dl.arm(cancelled)   # 到期即取消所有在途档位
+
+    def worker(tier):
+        try:
+            _, seconds = _run_tier(tier, prompt, fields, deliver, indent, cancelled, dl)
+            done_q.put((tier, seconds, None))
+        except Exception as e:
+            done_q.put((tier, None, e))
+
+    launched = in_flight = 0
+
+    def launch():
+        """剩余时间不足 LLM_MIN_TIER 时不再启动新档位，返回 False"""
+        nonlocal launched, in_flight
+        if dl.remaining() < LLM_MIN_TIER:
+            print(f"{indent}⏰ 时间预算不足，跳过 {', '.join(t[0] for t in tiers[launched:])}")
+            return False
+        threading.Thread(target=worker, args=(tiers[launched],), daemon=True).start()
+        launched  += 1
+        in_flight += 1
+        return True
+
+    try:
+        if not launch():
+            return None
+        while in_flight:
+            # 还有后备档位时，最多等到当前最新一档的对冲阈值
+            timeout = hedge_delay(tiers[launched - 1][1]) if launched < len(tiers) else None
+            try:
+                tier, seconds, err = done_q.get(timeout=timeout)
+            except queue.Empty:
+                if cancelled.is_set():
+                    continue      # 已到截止时间：等在途档位退出，不再对冲
+                if dl.remaining() < LLM_MIN_TIER:
+                    continue      # 不够再启动一档：只等在途档位
+                print(f"{indent}⏱️  {tiers[launched - 1][0]} 超过 p{LLM_HEDGE_PERCENTILE:g} 延迟，"
+                      f"对冲启动 {tiers[launched][0]}")
+                launch()
+                continue
+            in_flight -= 1
+            if err is None:
+                _record_latency(tier[1], seconds)
+                return tier[0]
+            if launched < len(tiers) and not cancelled.is_set():
+                launch()   # 某档失败：立即启动下一档（与顺序级联一致）
+        return None
+    finally:
+        if timer:
+            timer.cancel()
+        cancelled.set()   # 其余在途流在下一块数据到达时断开，不再重试、不再退避
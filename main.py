@@ -4,27 +4,132 @@ entryPoint 对应关系：
   fetch-jobs      → fetch_jobs_handler
   fetch-journals  → fetch_journals_handler
   fetch-reports   → fetch_reports_handler
+  resolve-apply   → resolve_apply_handler（jobs.ac.uk /click/ 申请链接延迟解析）
+  run-metrics     → run_metrics_handler（运行历史趋势与回归标记，见 run_log.py）
+  run-status      → run_status_handler（?run_id= 查询异步运行的状态，见 run_lease.py）
+抓取 handler 支持 ?sinks=sheets,sqlite,jsonl,parquet 覆盖 OUTPUT_SINKS（见 sinks.py）
+抓取 handler 支持 ?profile=1（或 PROFILE=1）：该次调用做性能剖析，响应体返回汇总（见 profiling.py）
+抓取 handler 支持 ?async=1（或 ASYNC_RUNS=1）：立即返回 202 与 run_id，流程在后台线程运行
+  （需要实例在响应后仍分配 CPU，部署工作流已对抓取服务设置 --no-cpu-throttling；
+   需要 STATE_DIR=gs://，否则 run-status 查不到状态，异步请求返回 400）
+每次运行都先取得该流程的租约；已有运行在进行时直接返回 202 与其 run_id，不重复启动
+  （租约在 STATE_DIR 中：gs:// 时跨实例互斥，部署工作流已设置；本地 /tmp 只在同一实例内有效）
+抓取 handler 支持 ?force=1（或 FORCE_RUN=1）：忽略运行台账，已完成的日期窗口也重跑（见 run_ledger.py）
 """
+import json, os, threading, time
+
 import functions_framework
 
 from fetch_jobs    import main as _run_jobs
 from fetch_journals import main as _run_journals
 from fetch_reports  import main as _run_reports
+from redirects      import resolve_limited as _resolve_apply, is_click_url
+import profiling
+import run_ledger
+import run_lease
+import run_log
+from state_store import SHARED
+
+ASYNC_RUNS = os.environ.get("ASYNC_RUNS", "0") == "1"
+
+
+def _json(body, status=200):
+    return (json.dumps(body, ensure_ascii=False, indent=2), status,
+            {"Content-Type": "application/json; charset=utf-8"})
+
+
+def _execute(pipeline, label, run_id, sink_names, profile, force):
+    """持有租约时执行一次运行：更新运行状态、记录运行历史，结束后释放租约；
+    返回剖析汇总（未剖析时为 None）"""
+    run_lease.set_status(run_id, "running", pipeline=label, started=int(time.time()))
+    summary = None
+    try:
+        with run_log.run(label):
+            if profile:
+                with profiling.Session(label) as prof:
+                    pipeline(sink_names, force)
+                summary = prof.summary
+            else:
+                pipeline(sink_names, force)
+    except Exception as e:
+        run_lease.set_status(run_id, "error", finished=int(time.time()),
+                             error=f"{type(e).__name__}: {e}"[:500])
+        raise
+    finally:
+        run_lease.release(label, run_id)
+    run_lease.set_status(run_id, "ok", finished=int(time.time()))
+    return summary
+
+
+def _run(pipeline, label, request):
+    sink_names = request.args.get("sinks")
+    profile    = profiling.requested(request)
+    force      = run_ledger.force_requested(request)
+    run_id     = run_lease.new_run_id(label)
+    run_async  = request.args.get("async", "").lower() in ("1", "true", "yes") or ASYNC_RUNS
+    if run_async and not SHARED:
+        return "async 模式需要 STATE_DIR=gs://（运行状态与租约需跨实例共享）", 400
+
+    holder = run_lease.acquire(label, run_id)
+    if holder:
+        print(f"⏭️  {label} 已有运行在进行（{holder}），本次触发不再启动")
+        return _json({"run_id": holder, "status": "running", "duplicate": True}, 202)
+
+    if run_async:
+        run_lease.set_status(run_id, "queued", pipeline=label, accepted=int(time.time()))
+        threading.Thread(target=_execute, name=f"run-{label}",
+                         args=(pipeline, label, run_id, sink_names, profile, force)).start()
+        return _json({"run_id": run_id, "status": "queued"}, 202)
+
+    summary = _execute(pipeline, label, run_id, sink_names, profile, force)
+    if summary is None:
+        return "OK", 200
+    return summary, 200, {"Content-Type": "text/plain; charset=utf-8"}
 
 
 @functions_framework.http
 def fetch_jobs_handler(request):
-    _run_jobs()
-    return "OK", 200
+    return _run(_run_jobs, "fetch-jobs", request)
 
 
 @functions_framework.http
 def fetch_journals_handler(request):
-    _run_journals()
-    return "OK", 200
+    return _run(_run_journals, "fetch-journals", request)
 
 
 @functions_framework.http
 def fetch_reports_handler(request):
-    _run_reports()
-    return "OK", 200
+    return _run(_run_reports, "fetch-reports", request)
+
+
+@functions_framework.http
+def resolve_apply_handler(request):
+    """?u=<jobs.ac.uk /click/ 链接> → 302 到最终申请地址（结果写入重定向缓存）；
+    未命中缓存的解析按实例限速，超出时 302 到原链接"""
+    click_url = request.args.get("u", "")
+    if not is_click_url(click_url):
+        return "Bad Request", 400
+    return "", 302, {"Location": _resolve_apply(click_url)}
+
+
+@functions_framework.http
+def run_metrics_handler(request):
+    """?window=30&pipeline=fetch-jobs → 各流程最近 window 次运行的耗时分位数、阶段耗时、
+    条目计数、LLM 档位分布、缓存命中率，与上一窗口对比的回归标记"""
+    try:
+        window = max(1, int(request.args.get("window", "30")))
+    except ValueError:
+        return "Bad Request", 400
+    return _json(run_log.trends(window, request.args.get("pipeline") or None))
+
+
+@functions_framework.http
+def run_status_handler(request):
+    """?run_id=<抓取 handler 返回的 run_id> → 该次运行的状态记录"""
+    run_id = request.args.get("run_id", "")
+    if not run_id:
+        return "Bad Request", 400
+    record = run_lease.get_status(run_id)
+    if record is None:
+        return _json({"run_id": run_id, "status": "unknown"}, 404)
+    return _json(record)
@@ -0,0 +1,149 @@
+"""
+profiling.py — 抓取 handler 的按需性能剖析（main.py 使用）
+开启：请求参数 ?profile=1 或环境变量 PROFILE=1，只影响该次调用
+- cProfile：调用线程内按累计耗时排序的前 PROFILE_TOP_N 个函数
+- tracemalloc：峰值内存与分配最多的代码行
+- 墙钟采样：独立线程每 PROFILE_SAMPLE_INTERVAL 秒抓取所有线程的调用栈，
+  统计各线程组与各函数（含等待网络的时间）的墙钟占比——cProfile 看不到
+  详情页、CrossRef、LLM 对冲等工作线程，这里补上
+产物写入 PROFILE_DIR（默认 /tmp/profiles）：.pstats 与汇总 .txt；
+汇总同时存一份 JSON 到 STATE_DIR（gs:// 时跨实例可查），并作为响应体返回
+"""
+import cProfile, io, os, pstats, re, sys, threading, time, tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from state_store import state_path, save_json
+
+PROFILE_DIR             = os.environ.get("PROFILE_DIR", "/tmp/profiles")
+PROFILE_TOP_N           = int(os.environ.get("PROFILE_TOP_N", "25"))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.05"))
+SGT = timezone(timedelta(hours=8))
+
+_THREAD_NUM_RE = re.compile(r'[_-]\d+$')
+_PROJECT_DIR   = os.path.dirname(os.path.abspath(__file__))
+
+
+def requested(request):
+    flag = request.args.get("profile", "") if request is not None else ""
+    return flag.lower() in ("1", "true", "yes") or os.environ.get("PROFILE") == "1"
+
+
+def _frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+class _Sampler(threading.Thread):
+    """周期性采样所有线程的调用栈：线程组计数、栈顶函数计数（自身耗时，含 stdlib / C 调用所在帧）、
+    本项目函数的包含计数（同一样本内同一函数只计一次）"""
+
+    def __init__(self, interval):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.interval  = interval
+        self.samples   = 0
+        self.by_thread = Counter()
+        self.by_func   = Counter()
+        self.by_leaf   = Counter()
+        self._stop_evt = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self._stop_evt.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            self.samples += 1
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                self.by_thread[_THREAD_NUM_RE.sub("", names.get(tid, str(tid)))] += 1
+                self.by_leaf[_frame_label(frame.f_code)] += 1
+                seen = set()
+                while frame is not None:
+                    code = frame.f_code
+                    if code.co_filename.startswith(_PROJECT_DIR):
+                        label = _frame_label(code)
+                        if label not in seen:
+                            seen.add(label)
+                            self.by_func[label] += 1
+                    frame = frame.f_back
+
+    def stop(self):
+        self._stop_evt.set()
+        self.join()
+
+
+class Session:
+    """with profiling.Session("fetch-jobs") as prof: ... ；结束后 prof.summary 为文本汇总"""
+
+    def __init__(self, label):
+        self.label   = label
+        self.stamp   = datetime.now(SGT).strftime("%Y%m%d-%H%M%S")
+        self.summary = ""
+        self.report  = {}
+
+    def __enter__(self):
+        self._own_tracemalloc = not tracemalloc.is_tracing()
+        if self._own_tracemalloc:
+            tracemalloc.start(5)
+        tracemalloc.reset_peak()
+        self._sampler = _Sampler(PROFILE_SAMPLE_INTERVAL)
+        self._sampler.start()
+        self._profiler = cProfile.Profile()
+        self._t0 = time.monotonic()
+        self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self._profiler.disable()
+        wall = time.monotonic() - self._t0
+        self._sampler.stop()
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+        self._build(wall, peak, snapshot)
+        self._write()
+        return False
+
+    def _build(self, wall, peak, snapshot):
+        n = PROFILE_TOP_N
+        buf = io.StringIO()
+        pstats.Stats(self._profiler, stream=buf).sort_stats("cumulative").print_stats(n)
+        self._pstats_text = buf.getvalue()
+
+        s = self._sampler
+        per_sample = wall / s.samples if s.samples else 0.0
+        allocs = snapshot.statistics("lineno")[:n]
+        self.report = {
+            "label": self.label, "stamp": self.stamp,
+            "wall_s": round(wall, 2), "peak_mb": round(peak / 2**20, 1),
+            "samples": s.samples,
+            "threads": [(name, round(c * per_sample, 2)) for name, c in s.by_thread.most_common()],
+            "wall_top": [(f, round(c * per_sample, 2)) for f, c in s.by_func.most_common(n)],
+            "leaf_top": [(f, round(c * per_sample, 2)) for f, c in s.by_leaf.most_common(n)],
+            "alloc_top": [(str(st.traceback[0]), round(st.size / 2**10, 1)) for st in allocs],
+        }
+
+        r = self.report
+        lines = [f"=== profile {self.label} @ {self.stamp} ===",
+                 f"wall {r['wall_s']}s | peak {r['peak_mb']} MiB | {r['samples']} samples",
+                 "", "-- 线程组墙钟（秒，含阻塞等待）--"]
+        lines += [f"{t:>8.2f}  {name}" for name, t in r["threads"]]
+        lines += ["", f"-- 本项目函数墙钟 top {n}（全部线程，包含子调用）--"]
+        lines += [f"{t:>8.2f}  {f}" for f, t in r["wall_top"]]
+        lines += ["", f"-- 栈顶帧墙钟 top {n}（全部线程，自身耗时 / 阻塞位置）--"]
+        lines += [f"{t:>8.2f}  {f}" for f, t in r["leaf_top"]]
+        lines += ["", f"-- 分配 top {n}（KiB，运行结束时仍存活）--"]
+        lines += [f"{kb:>8.1f}  {where}" for where, kb in r["alloc_top"]]
+        lines += ["", "-- cProfile（调用线程，按累计耗时）--", self._pstats_text]
+        self.summary = "\n".join(lines)
+
+    def _write(self):
+        base = f"{self.label}-{self.stamp}"
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            self._profiler.dump_stats(os.path.join(PROFILE_DIR, base + ".pstats"))
+            with open(os.path.join(PROFILE_DIR, base + ".txt"), "w", encoding="utf-8") as f:
+                f.write(self.summary)
+        except Exception as e:
+            print(f"⚠️  剖析产物写入失败: {e}")
+        save_json(state_path(f"profile-{base}.json"), self.report)
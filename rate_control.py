@@ -0,0 +1,78 @@
+"""
+rate_control.py — 自适应并发 / 节奏控制（AIMD）
+- 并发上限从 start 起步，每连续成功 limit 次 +1（加性增），被限速时减半（乘性减），
+  介于 floor 与 ceiling 之间；ceiling 可由服务端提示（如 CrossRef 并发头）下调
+- 服务端公布速率（limit 次 / interval 秒）时按 interval/limit 间隔发起请求
+- 被限速时优先遵守 Retry-After，否则用带抖动的指数退避；退避期间所有线程一起暂停
+"""
+import random, threading, time
+from contextlib import contextmanager
+
+BACKOFF_BASE = 5.0    # 秒
+BACKOFF_CAP  = 60.0
+
+
+class AdaptiveLimiter:
+    def __init__(self, name, start=3, floor=1, ceiling=8):
+        self.name      = name
+        self.limit     = start
+        self.floor     = floor
+        self.ceiling   = ceiling
+        self.hint      = None      # 服务端并发提示
+        self.spacing   = 0.0       # 相邻请求的最小间隔（秒）
+        self._active   = 0
+        self._streak   = 0
+        self._next_at  = 0.0       # 下一次允许发起请求的时间（monotonic）
+        self._cond     = threading.Condition()
+
+    def _cap(self):
+        return min(self.ceiling, self.hint) if self.hint else self.ceiling
+
+    @contextmanager
+    def slot(self):
+        """占用一个并发名额，并按节奏 / 退避等待到允许发起请求的时刻"""
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self.spacing
+        try:
+            if start_at > now:
+                time.sleep(start_at - now)
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def observe(self, rate_limit=None, interval_s=None, concurrency=None):
+        """根据服务端公布的速率 / 并发提示调整节奏与上限（缺失的项保持不变）"""
+        with self._cond:
+            if rate_limit and interval_s:
+                self.spacing = interval_s / rate_limit
+            if concurrency:
+                self.hint = max(self.floor, concurrency)
+            if self.limit > self._cap():
+                self.limit = self._cap()
+
+    def success(self):
+        with self._cond:
+            self._streak += 1
+            if self._streak >= self.limit and self.limit < self._cap():
+                self.limit += 1
+                self._streak = 0
+                self._cond.notify_all()
+
+    def throttled(self, attempt, retry_after=None):
+        """被限速：并发减半，所有线程暂停；返回本次应等待的秒数"""
+        try:
+            wait = float(retry_after)
+        except (TypeError, ValueError):
+            wait = random.uniform(0.5, 1.0) * min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)
+        with self._cond:
+            self.limit   = max(self.floor, self.limit // 2)
+            self._streak = 0
+            self._next_at = max(self._next_at, time.monotonic() + wait)
+        return wait
@@ -0,0 +1,170 @@
+"""
+redirects.py — jobs.ac.uk /click/ 申请链接的重定向解析 + 持久缓存
+- resolve(click_url)   : 先查缓存，未命中才 curl HEAD 跟随跳转，结果记入内存中的待写条目
+- flush()              : 待写条目一次性写回：与存储中的最新内容合并，按版本号前置条件写入
+                         （被其他实例抢先写入时重读合并再试），不覆盖其他实例写入的条目；
+                         fetch_jobs 在详情页阶段结束时调用，解析端点每次解析后调用
+- apply_link(click_url): 抓取阶段使用；APPLY_LINK_MODE=deferred 且配置了 RESOLVER_URL 时
+                         不解析，只返回解析端点链接，用户第一次点击时由
+                         main.resolve_apply_handler 解析并 302 跳转
+- resolve_limited(click_url): 解析端点使用；端点允许匿名访问，未命中缓存的解析（每次起一个
+                         curl 子进程访问 jobs.ac.uk）每实例每分钟最多 RESOLVE_PER_MINUTE 次，
+                         超出时直接返回原 click_url（用户经 jobs.ac.uk 自己跳转）
+- 缓存在 STATE_DIR：gs:// 时抓取流程与解析端点共用（部署工作流已设置）；解析端点未命中时
+  先重读存储中的缓存再解析
+"""
+import os, re, subprocess, threading, time
+from urllib.parse import quote
+
+import run_log
+from deadline import NEVER
+from state_store import state_path, load_json, load_json_generation, replace_json
+
+CACHE_FILE         = state_path("apply_redirects.json")
+CACHE_TTL_DAYS     = 30
+APPLY_LINK_MODE    = os.environ.get("APPLY_LINK_MODE", "inline")   # inline | deferred
+RESOLVER_URL       = os.environ.get("RESOLVER_URL", "")           # resolve-apply 函数地址
+RESOLVE_PER_MINUTE = float(os.environ.get("RESOLVE_PER_MINUTE", "30"))   # 解析端点未命中缓存的解析
+FLUSH_RETRIES      = 3
+HEAD_TIMEOUT       = 15     # 单次 curl HEAD 最长秒数；截止时间剩余不足时不再解析
+
+_CLICK_RE = re.compile(r'^https?://(?:www\.)?jobs\.ac\.uk/job/[^\s"\'<>]+/click/[^\s"\'<>]*$', re.IGNORECASE)
+
+_lock    = threading.Lock()
+_cache   = None
+_pending = {}                     # 本实例新解析、尚未写回的条目
+_tokens = RESOLVE_PER_MINUTE      # 令牌桶：每分钟补满 RESOLVE_PER_MINUTE 个
+_refill = time.monotonic()
+
+
+def is_click_url(url):
+    """只接受 jobs.ac.uk 的 /click/ 链接，避免解析端点成为任意跳转"""
+    return bool(url) and bool(_CLICK_RE.match(url))
+
+
+def curl_head_location(url):
+    """curl HEAD 跟随重定向，返回最终 URL（用于 /click/ 跳转）"""
+    try:
+        result = subprocess.run(
+            ["curl", "-sI", "-L", "--max-time", "10",
+             "-H", "User-Agent: Mozilla/5.0 Chrome/120.0.0.0", url],
+            capture_output=True, timeout=HEAD_TIMEOUT)
+        text = result.stdout.decode("utf-8", errors="replace")
+        locations = re.findall(r'^Location:\s*(\S+)', text, re.IGNORECASE | re.MULTILINE)
+        if locations:
+            last = locations[-1]
+            if last.startswith('http'):
+                return last
+    except Exception:
+        pass
+    return url
+
+
+def _fresh(raw):
+    cutoff = time.time() - CACHE_TTL_DAYS * 86400
+    return {k: v for k, v in (raw or {}).items()
+            if isinstance(v, dict) and v.get("ts", 0) >= cutoff and v.get("url")}
+
+
+def _load(reload=False):
+    global _cache
+    if _cache is None or reload:
+        _cache = _fresh(load_json(CACHE_FILE, {}))
+        _cache.update(_pending)
+    return _cache
+
+
+def cached(click_url):
+    """缓存中的最终地址；未命中返回 None"""
+    with _lock:
+        entry = _load().get(click_url)
+    return entry["url"] if entry else None
+
+
+def _reload_cached(click_url):
+    """热实例上的缓存可能已过时（其他实例刚写入）：重读存储后再查"""
+    with _lock:
+        entry = _load(reload=True).get(click_url)
+    return entry["url"] if entry else None
+
+
+def resolve(click_url):
+    """解析 /click/ 链接的最终站外地址；解析不到站外地址时返回原 click_url"""
+    final = cached(click_url)
+    if final:
+        return final
+    final = curl_head_location(click_url)
+    if not final or "jobs.ac.uk" in final:
+        return click_url
+    with _lock:
+        entry = {"url": final, "ts": int(time.time())}
+        _load()[click_url] = _pending[click_url] = entry
+    return final
+
+
+def flush():
+    """待写条目与存储中的最新内容合并后写回；返回是否写入（没有待写条目时返回 True）"""
+    with _lock:
+        pending = dict(_pending)
+    if not pending:
+        return True
+    for _ in range(FLUSH_RETRIES):
+        stored, generation = load_json_generation(CACHE_FILE)
+        merged = _fresh(stored)
+        merged.update(pending)
+        try:
+            if not replace_json(CACHE_FILE, merged, generation):
+                continue          # 其他实例刚写入：重读合并再试
+        except Exception as e:
+            print(f"⚠️  重定向缓存写入失败（非致命）: {e}")
+            return False
+        with _lock:
+            for k in pending:
+                _pending.pop(k, None)
+            _load().update(merged)
+        return True
+    print(f"⚠️  重定向缓存写入冲突 {FLUSH_RETRIES} 次，{len(pending)} 条留待下次写回")
+    return False
+
+
+def _take_token():
+    global _tokens, _refill
+    with _lock:
+        now = time.monotonic()
+        _tokens = min(RESOLVE_PER_MINUTE, _tokens + (now - _refill) * RESOLVE_PER_MINUTE / 60)
+        _refill = now
+        if _tokens < 1:
+            return False
+        _tokens -= 1
+        return True
+
+
+def resolve_limited(click_url):
+    """解析端点用：命中缓存直接返回；未命中且超出速率限制时返回原 click_url"""
+    final = cached(click_url) or _reload_cached(click_url)
+    if final:
+        return final
+    if not _take_token():
+        print(f"⚠️  解析速率超过 {RESOLVE_PER_MINUTE:g}/分钟，直接跳转原链接")
+        return click_url
+    final = resolve(click_url)
+    flush()
+    return final
+
+
+def resolver_link(click_url):
+    return f"{RESOLVER_URL}?u={quote(click_url, safe='')}"
+
+
+def apply_link(click_url, dl=NEVER):
+    """抓取阶段的申请链接：命中缓存直接用最终地址；延迟模式返回解析端点链接；否则当场解析
+    （dl 剩余时间不足一次 HEAD 时不解析，直接用原 click_url）"""
+    final = cached(click_url)
+    run_log.cache("redirects", bool(final))
+    if final:
+        return final
+    if APPLY_LINK_MODE == "deferred" and RESOLVER_URL:
+        return resolver_link(click_url)
+    if dl.remaining() < HEAD_TIMEOUT:
+        return click_url
+    return resolve(click_url)
@@ -0,0 +1,120 @@
+"""
+relevance.py — fetch_reports 的本地相关性预筛（进程内打分，不调用 LLM）
+- 训练数据：报告 sheet 里已写入的标题（正例）+ 历次 LLM 的相关性判定（正 / 负例，
+  持久化到 STATE_DIR；被判不相关的条目从不写入 sheet，只能从这里学到负例）
+- 判定记录需要跨运行累积：STATE_DIR 须为 gs://（部署工作流已设置），本地 /tmp 随实例回收丢失
+- 负例不足 MIN_PER_CLASS 条时模型无论如何不会启用，此时不读取 sheet 的历史标题（省一次整表读取）
+- 模型：朴素贝叶斯对数几率关键词权重（单词 + 相邻词对 + 来源），NumPy 向量化打分
+- 只丢弃明显不相关（概率 < RELEVANCE_DROP_P）的条目；其余照常交给 LLM（相关的还需要它写简介）
+- 两类样本都不足 MIN_PER_CLASS 条时不预筛
+"""
+import math, os, re, time
+
+import numpy as np
+
+from state_store import state_path, load_json, save_json
+
+DECISIONS_FILE   = state_path("report_decisions.json")
+RELEVANCE_DROP_P = float(os.environ.get("RELEVANCE_DROP_P", "0.05"))
+MIN_PER_CLASS    = 30
+MAX_DECISIONS    = 5000
+
+_TOKEN_RE = re.compile(r"[a-z][a-z0-9'\-]+")
+_STOPWORDS = frozenset(
+    "the and for with from into over under about after before this that these those "
+    "are was were has have had its their our your how why what when where who new "
+    "more most than not but can will all one two".split())
+
+
+def _features(title, source):
+    toks = [t for t in _TOKEN_RE.findall(title.lower()) if len(t) > 2 and t not in _STOPWORDS]
+    feats = set(toks)
+    feats.update(f"{a} {b}" for a, b in zip(toks, toks[1:]))
+    feats.add(f"src:{source}")
+    return feats
+
+
+class RelevanceModel:
+    """伯努利朴素贝叶斯，只累加出现特征的对数几率（关键词权重）"""
+
+    def __init__(self, examples):
+        """examples: [(title, source, relevant), ...]"""
+        self.vocab = {}
+        rows, cols, labels = [], [], []
+        for r, (title, source, relevant) in enumerate(examples):
+            labels.append(1 if relevant else 0)
+            for f in _features(title, source):
+                rows.append(r)
+                cols.append(self.vocab.setdefault(f, len(self.vocab)))
+        labels = np.asarray(labels, dtype=np.int64)
+        self.n_pos = int(labels.sum())
+        self.n_neg = int(len(labels) - self.n_pos)
+
+        # 每个特征在正 / 负例中出现的文档数
+        cols = np.asarray(cols, dtype=np.int64)
+        row_labels = labels[np.asarray(rows, dtype=np.int64)] if rows else np.zeros(0, dtype=np.int64)
+        pos_counts = np.bincount(cols[row_labels == 1], minlength=len(self.vocab))
+        neg_counts = np.bincount(cols[row_labels == 0], minlength=len(self.vocab))
+        p_pos = (pos_counts + 1.0) / (self.n_pos + 2.0)
+        p_neg = (neg_counts + 1.0) / (self.n_neg + 2.0)
+        self.weights = np.log(p_pos) - np.log(p_neg)
+        self.bias    = math.log((self.n_pos + 1.0) / (self.n_neg + 1.0))
+
+    @property
+    def ready(self):
+        return self.n_pos >= MIN_PER_CLASS and self.n_neg >= MIN_PER_CLASS
+
+    def predict_proba(self, items):
+        """items: [(title, source), ...] → 相关概率数组"""
+        rows, cols = [], []
+        for r, (title, source) in enumerate(items):
+            for f in _features(title, source):
+                j = self.vocab.get(f)
+                if j is not None:
+                    rows.append(r)
+                    cols.append(j)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        z = np.bincount(rows, weights=self.weights[cols], minlength=len(items)) + self.bias
+        return 1.0 / (1.0 + np.exp(-z))
+
+
+# ── 训练数据 ─────────────────────────────────────────────────────────────────
+def load_decisions():
+    return load_json(DECISIONS_FILE, [])
+
+
+def record_decisions(articles):
+    """记录 LLM 的判定结果（只记录模型真正给出判定的条目）"""
+    decisions = load_decisions()
+    now = int(time.time())
+    decisions.extend({"title": a["title"], "source": a["source"],
+                      "relevant": bool(a["relevant"]), "ts": now} for a in articles)
+    save_json(DECISIONS_FILE, decisions[-MAX_DECISIONS:])
+
+
+def build_model(load_sheet_rows):
+    """load_sheet_rows() → 报告 sheet 已写入的 [(title, source), ...]（全部视为正例），
+    只在判定记录中的负例足够训练时才调用；同一标题以 LLM 判定记录为准"""
+    decisions = load_decisions()
+    examples = {}
+    if sum(1 for d in decisions if not d["relevant"]) >= MIN_PER_CLASS:
+        for title, source in load_sheet_rows():
+            examples[title] = (title, source, True)
+    for d in decisions:
+        examples[d["title"]] = (d["title"], d["source"], d["relevant"])
+    return RelevanceModel(list(examples.values()))
+
+
+def prefilter(articles, model, indent="  "):
+    """返回 (交给 LLM 的条目, 本地判为不相关而丢弃的条目)"""
+    if not articles or not model.ready:
+        if articles:
+            print(f"{indent}🧮 本地预筛未启用（训练样本 正 {model.n_pos} / 负 {model.n_neg}，"
+                  f"每类需 ≥{MIN_PER_CLASS}）")
+        return articles, []
+    proba = model.predict_proba([(a["title"], a["source"]) for a in articles])
+    keep    = [a for a, p in zip(articles, proba) if p >= RELEVANCE_DROP_P]
+    dropped = [a for a, p in zip(articles, proba) if p <  RELEVANCE_DROP_P]
+    print(f"{indent}🧮 本地预筛：丢弃 {len(dropped)} 篇明显不相关，{len(keep)} 篇交给 LLM")
+    return keep, dropped
@@ -0,0 +1,68 @@
+"""
+run_lease.py — 抓取流程的运行租约与运行状态（main.py 使用）
+- 租约：每个流程一个 lease-{流程}.json，只在不存在时创建；持有期间同一流程的其他触发
+  （Cloud Scheduler 超时重试、手动重复调用）不会再启动一次运行，而是拿到正在进行的 run_id
+- 租约带过期时间（RUN_TIMEOUT + LEASE_SLACK）：实例被杀、未能释放时，过期后下一次触发
+  按版本号删除旧租约再接管，不会误删别人刚抢到的新租约
+- 运行状态：run-{run_id}.json，记录 queued / running / ok / error、起止时间与错误信息，
+  供 run-status 端点查询
+- 与其他状态文件一样存放在 STATE_DIR；跨实例互斥与跨实例查询需要 STATE_DIR=gs://
+  （Cloud Run 每个实例一次只处理一个请求，重试通常落到别的实例上；部署工作流已设置）
+"""
+import os, time
+from datetime import datetime, timedelta, timezone
+
+from deadline import RUN_TIMEOUT
+from state_store import state_path, load_json, save_json, \
+    load_json_generation, create_json, delete_json
+
+LEASE_SLACK = 60
+LEASE_TTL   = RUN_TIMEOUT + LEASE_SLACK
+SGT = timezone(timedelta(hours=8))
+
+
+def _lease_file(pipeline):
+    return state_path(f"lease-{pipeline}.json")
+
+
+def _status_file(run_id):
+    return state_path(f"run-{run_id}.json")
+
+
+def new_run_id(pipeline):
+    return f"{pipeline}-{datetime.now(SGT).strftime('%Y%m%d-%H%M%S')}-{os.urandom(3).hex()}"
+
+
+def acquire(pipeline, run_id):
+    """取得租约返回 None；已被未过期的运行持有时返回持有者的 run_id"""
+    path = _lease_file(pipeline)
+    for _ in range(2):
+        if create_json(path, {"run_id": run_id, "expires": time.time() + LEASE_TTL}):
+            return None
+        holder, generation = load_json_generation(path)
+        if holder is None:
+            continue      # 刚被释放
+        if time.time() < holder.get("expires", 0):
+            return holder.get("run_id", "?")
+        print(f"⚠️  租约已过期（{holder.get('run_id')}），接管")
+        delete_json(path, generation)
+    holder = load_json(path, {})
+    return holder.get("run_id", "?")
+
+
+def release(pipeline, run_id):
+    """只释放自己持有的租约"""
+    path = _lease_file(pipeline)
+    holder, generation = load_json_generation(path)
+    if holder and holder.get("run_id") == run_id:
+        delete_json(path, generation)
+
+
+def set_status(run_id, status, **fields):
+    record = load_json(_status_file(run_id), {"run_id": run_id})
+    record.update(fields, status=status, updated=int(time.time()))
+    save_json(_status_file(run_id), record)
+
+
+def get_status(run_id):
+    return load_json(_status_file(run_id), None)
@@ -0,0 +1,78 @@
+"""
+run_ledger.py — 已完成运行的台账（fetch_journals / fetch_reports 使用）
+- 键：(流程, 日期窗口, 配置哈希)；配置包括期刊 / 来源列表、抓取模式、输出后端等，
+  任何一项变化都视为新的运行
+- 写入成功后 record()：记录完成时间、行数、输出指纹（行内容的哈希）
+- 同一键再次调用（Scheduler 重试、手动重跑）时 completed() 命中，流程直接返回，
+  不再请求 CrossRef / RSS、LLM，也不会向表格重复插入；force=True（?force=1、FORCE_RUN=1、
+  命令行 --force）跳过检查
+- 没有写出任何行的运行不记账：同一窗口稍后重跑仍可能抓到晚到的条目
+- 存放在 STATE_DIR，只保留最近 RETENTION_DAYS 天；只有 gs://（部署工作流已设置）时跨实例生效
+- STATE_DIR 不共享时（本地 /tmp，重试多半落到别的实例）台账查不到别的实例的记录：
+  写入 Sheets 之前用 written_elsewhere() 对照表格 link 列，本次输出已全部在表中时不再插入
+"""
+import hashlib, json, os, time
+
+import sheets_client
+import sinks
+from state_store import SHARED, state_path, load_json, save_json
+
+LEDGER_FILE    = state_path("run_ledger.json")
+RETENTION_DAYS = 60
+FORCE_RUN      = os.environ.get("FORCE_RUN") == "1"
+SHEET_CHECK_ROWS = 3000   # 对照表格前多少行的链接
+
+
+def _hash(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _key(pipeline, window, config):
+    return f"{pipeline}|{window}|{_hash(config)[:12]}"
+
+
+def force_requested(request):
+    flag = request.args.get("force", "") if request is not None else ""
+    return flag.lower() in ("1", "true", "yes") or FORCE_RUN
+
+
+def completed(pipeline, window, config, force=False):
+    """已完成时返回台账记录并打印跳过信息；未完成或 force 时返回 None"""
+    if force or FORCE_RUN:
+        return None
+    entry = load_json(LEDGER_FILE, {}).get(_key(pipeline, window, config))
+    if entry:
+        when = time.strftime("%m-%d %H:%M", time.localtime(entry["completed"]))
+        print(f"⏭️  {pipeline} {window} 已于 {when} 完成（{entry['rows']} 行，指纹 {entry['fingerprint'][:8]}），"
+              f"跳过；需要重跑请加 force")
+    return entry
+
+
+def record(pipeline, window, config, rows):
+    key = _key(pipeline, window, config)
+    ledger = load_json(LEDGER_FILE, {})
+    cutoff = time.time() - RETENTION_DAYS * 86400
+    ledger = {k: v for k, v in ledger.items() if v.get("completed", 0) >= cutoff}
+    ledger[key] = {
+        "pipeline": pipeline, "window": window, "config": _hash(config)[:12],
+        "completed": int(time.time()), "rows": len(rows), "fingerprint": _hash(rows),
+    }
+    save_json(LEDGER_FILE, ledger)
+
+
+def written_elsewhere(pipeline, links, sheet_id, tab, column, sink_names=None, force=False):
+    """状态不共享时的兜底：本次要写入 Sheets 的链接已全部在表格 column 列中时返回 True
+    （多半是同一窗口的重试在别的实例上已写入）；状态共享、不写 Sheets、force 或读取失败时返回 False"""
+    if SHARED or force or FORCE_RUN or not links or "sheets" not in sinks.names(sink_names):
+        return False
+    try:
+        ws  = sheets_client.open_worksheet(sheet_id, tab)
+        col = ws.batch_get([f"{column}2:{column}{SHEET_CHECK_ROWS}"])[0]
+    except Exception as e:
+        print(f"⚠️  无法读取表格已有链接（不做重复写入检查）: {e}")
+        return False
+    existing = {row[0].strip() for row in col if row and row[0].strip()}
+    if not set(links) <= existing:
+        return False
+    print(f"⏭️  {pipeline} 本次 {len(links)} 条输出已全部在表格中（指纹 {_hash(sorted(links))[:8]}），不再插入")
+    return True
@@ -0,0 +1,160 @@
+"""
+run_log.py — 运行历史与趋势（main.py 各抓取 handler 记录，run-metrics 端点汇总）
+- 每次运行一条记录：流程名、开始时间、总耗时、状态、各阶段耗时、条目计数
+  （fetched / kept / written 等）、各 LLM 档位完成的请求轮数、缓存命中 / 未命中
+- 持久化到 STATE_DIR，每个流程一个文件 run_log-{流程}.json（保留最近 MAX_RUNS 条）：
+  同一流程的运行由租约串行化，不同流程各写各的文件，结束时间相近也不会互相覆盖；
+  STATE_DIR 为 gs://（部署工作流已设置）时所有实例与 run-metrics 端点共享同一份历史
+- 运行中的记录放在模块级 _current；stage / count / cache 在没有进行中的运行时为空操作，
+  因此流水线在本地直接运行（python fetch_jobs.py）时不受影响
+- trends()：最近 window 次的 p50 / p95 耗时与上一窗口对比，超过 REGRESSION_RATIO 倍
+  或接近 RUN_TIMEOUT 时标记回归
+"""
+import threading, time
+from collections import Counter
+from contextlib import contextmanager
+
+from deadline import RUN_TIMEOUT
+from state_store import state_path, load_json, save_json
+
+PIPELINES        = ("fetch-jobs", "fetch-journals", "fetch-reports")
+MAX_RUNS         = 200
+REGRESSION_RATIO = 1.25
+TIMEOUT_WARN     = 0.8    # p95 超过 RUN_TIMEOUT 的该比例即告警
+
+_lock    = threading.Lock()
+_current = None
+
+
+def _log_file(pipeline):
+    return state_path(f"run_log-{pipeline}.json")
+
+
+class _Run:
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.started  = time.time()
+        self.t0       = time.monotonic()
+        self.stages   = {}
+        self.counts   = Counter()
+        self.cache    = {}      # name → [hits, misses]
+
+
+@contextmanager
+def run(pipeline):
+    """记录一次运行；异常照常抛出，记录状态为 error"""
+    global _current
+    r = _Run(pipeline)
+    with _lock:
+        _current = r
+    status = "ok"
+    try:
+        yield r
+    except BaseException as e:
+        status = f"error: {type(e).__name__}: {e}"[:200]
+        raise
+    finally:
+        with _lock:
+            _current = None
+        _append(r, status)
+
+
+@contextmanager
+def stage(name):
+    t0 = time.monotonic()
+    try:
+        yield
+    finally:
+        with _lock:
+            if _current is not None:
+                _current.stages[name] = round(
+                    _current.stages.get(name, 0) + time.monotonic() - t0, 2)
+
+
+def count(key, n=1):
+    with _lock:
+        if _current is not None:
+            _current.counts[key] += n
+
+
+def provider(name):
+    """一轮 LLM 请求最终由哪一档完成"""
+    count(f"llm:{name}")
+
+
+def cache(name, hit):
+    with _lock:
+        if _current is not None:
+            _current.cache.setdefault(name, [0, 0])[0 if hit else 1] += 1
+
+
+def _append(r, status):
+    rec = {
+        "started": int(r.started), "duration": round(time.monotonic() - r.t0, 2),
+        "status": status, "stages": r.stages, "counts": dict(r.counts), "cache": r.cache,
+    }
+    try:
+        runs = load_json(_log_file(r.pipeline), [])
+        runs.append(rec)
+        save_json(_log_file(r.pipeline), runs[-MAX_RUNS:])
+    except Exception as e:
+        print(f"⚠️  运行记录写入失败（非致命）: {e}")
+
+
+# ── 汇总 ─────────────────────────────────────────────────────────────────────
+def _pct(values, pct):
+    if not values:
+        return None
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(pct / 100 * (len(s) - 1))))]
+
+
+def _summary(runs):
+    durations = [r["duration"] for r in runs]
+    stage_names = sorted({k for r in runs for k in r["stages"]})
+    counts = Counter()
+    cache = {}
+    for r in runs:
+        counts.update(r["counts"])
+        for name, (h, m) in r["cache"].items():
+            c = cache.setdefault(name, [0, 0])
+            c[0] += h
+            c[1] += m
+    return {
+        "runs": len(runs),
+        "errors": sum(1 for r in runs if r["status"] != "ok"),
+        "p50": _pct(durations, 50), "p95": _pct(durations, 95),
+        "stages_p95": {k: _pct([r["stages"][k] for r in runs if k in r["stages"]], 95)
+                       for k in stage_names},
+        "counts_avg": {k: round(v / len(runs), 1) for k, v in counts.items()
+                       if not k.startswith("llm:")},
+        "providers": {k[4:]: v for k, v in counts.most_common() if k.startswith("llm:")},
+        "cache_hit_rate": {k: round(h / (h + m), 3) for k, (h, m) in cache.items() if h + m},
+    }
+
+
+def trends(window=30, pipeline=None):
+    """{流程: {"current": 最近 window 次汇总, "previous": 再往前 window 次汇总, "flags": [...],
+    "last": 最近一次记录}}"""
+    out = {}
+    for name in ([pipeline] if pipeline else PIPELINES):
+        runs = load_json(_log_file(name), [])
+        if not runs:
+            continue
+        cur, prev = runs[-window:], runs[-2 * window:-window]
+        cur_s = _summary(cur)
+        prev_s = _summary(prev) if prev else None
+        flags = []
+        if prev_s and prev_s["p95"] and cur_s["p95"] > prev_s["p95"] * REGRESSION_RATIO:
+            flags.append(f"p95 耗时 {prev_s['p95']}s → {cur_s['p95']}s")
+        if cur_s["p95"] and cur_s["p95"] > RUN_TIMEOUT * TIMEOUT_WARN:
+            flags.append(f"p95 耗时 {cur_s['p95']}s 接近超时 {RUN_TIMEOUT:g}s")
+        if prev_s:
+            for st, p95 in cur_s["stages_p95"].items():
+                old = prev_s["stages_p95"].get(st)
+                if old and p95 and p95 > old * REGRESSION_RATIO and p95 - old > 5:
+                    flags.append(f"阶段 {st} p95 {old}s → {p95}s")
+        if cur_s["errors"]:
+            flags.append(f"最近 {len(cur)} 次中 {cur_s['errors']} 次失败")
+        out[name] = {"current": cur_s, "previous": prev_s, "flags": flags, "last": runs[-1]}
+    return out
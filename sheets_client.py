@@ -0,0 +1,93 @@
+"""
+sheets_client.py — Google Sheets 授权与 worksheet 打开（三个抓取流程共用）
+- 有 GOOGLE_SERVICE_ACCOUNT（Base64 或原始 JSON）：本地 / GitHub Actions 用 JSON key
+- 否则：GCP Cloud Run 使用 Application Default Credentials
+- 授权后的 client、spreadsheet 和各 tab 的 worksheet 句柄在模块级缓存，热实例的后续调用
+  不再重复解码凭证 / authorize / open_by_key / worksheet() 元数据请求
+- access token 距过期不足 TOKEN_REFRESH_MARGIN 秒时主动刷新，避免写入中途 401 重试
+- 句柄失效（tab 被改名 / 删除等）时调用方可 invalidate() 后重新打开
+"""
+import base64, json, os, threading
+from datetime import datetime, timedelta, timezone
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets",
+          "https://www.googleapis.com/auth/drive"]
+TOKEN_REFRESH_MARGIN = 300   # 秒
+
+_lock         = threading.RLock()
+_creds        = None
+_client       = None
+_spreadsheets = {}   # sheet_id → gspread.Spreadsheet
+_worksheets   = {}   # (sheet_id, tab) → gspread.Worksheet
+
+
+def _credentials():
+    sa_json = os.environ.get("GOOGLE_SERVICE_ACCOUNT", "")
+    if sa_json:
+        from google.oauth2.service_account import Credentials
+        try:
+            sa_info = json.loads(base64.b64decode(sa_json))
+        except Exception:
+            sa_info = json.loads(sa_json)
+        return Credentials.from_service_account_info(sa_info, scopes=SCOPES)
+    import google.auth
+    creds, _ = google.auth.default(scopes=SCOPES)
+    return creds
+
+
+def _ensure_fresh_token():
+    """token 缺失或即将过期时主动刷新（google-auth 的 expiry 是 naive UTC）"""
+    expiry = getattr(_creds, "expiry", None)
+    if _creds.token and expiry:
+        remaining = expiry.replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)
+        if remaining > timedelta(seconds=TOKEN_REFRESH_MARGIN):
+            return
+    elif _creds.token:
+        return
+    import google.auth.transport.requests
+    _creds.refresh(google.auth.transport.requests.Request())
+
+
+def client():
+    global _creds, _client
+    with _lock:
+        if _client is None:
+            import gspread
+            _creds  = _credentials()
+            _client = gspread.authorize(_creds)
+        _ensure_fresh_token()
+        return _client
+
+
+def open_worksheet(sheet_id, tab):
+    with _lock:
+        gc = client()
+        ws = _worksheets.get((sheet_id, tab))
+        if ws is not None:
+            return ws
+        sh = _spreadsheets.get(sheet_id)
+        if sh is None:
+            sh = _spreadsheets[sheet_id] = gc.open_by_key(sheet_id)
+        # 一次元数据请求拿到所有 tab 的句柄，其余流程的 tab 也直接命中
+        for w in sh.worksheets():
+            _worksheets[(sheet_id, w.title)] = w
+        if (sheet_id, tab) not in _worksheets:
+            _worksheets[(sheet_id, tab)] = sh.worksheet(tab)   # 找不到时抛 WorksheetNotFound
+        return _worksheets[(sheet_id, tab)]
+
+
+def invalidate(sheet_id=None, tab=None):
+    """丢弃缓存的句柄；不带参数时连同 client 一起丢弃"""
+    global _creds, _client
+    with _lock:
+        if sheet_id is None:
+            _creds = _client = None
+            _spreadsheets.clear()
+            _worksheets.clear()
+            return
+        _spreadsheets.pop(sheet_id, None)
+        if tab is None:
+            for k in [k for k in _worksheets if k[0] == sheet_id]:
+                del _worksheets[k]
+        else:
+            _worksheets.pop((sheet_id, tab), None)
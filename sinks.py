@@ -0,0 +1,185 @@
+"""
+sinks.py — 输出后端（fetch_jobs / fetch_journals / fetch_reports 共用）
+- sheets : Google Sheets（默认）；时间戳行 + 数据 + 空行分隔，置顶插入
+- sqlite : 本地 SQLite，每个 tab 一张表，附 run_ts 列，可直接 SQL 查询历史
+- jsonl  : gzip 压缩 JSONL，每个 tab 一个文件，按次追加
+- parquet: 列式文件，每次运行一个文件（需要 pyarrow，缺失时该后端报错跳过）
+选择：请求参数 ?sinks=sqlite,jsonl 优先，其次环境变量 OUTPUT_SINKS（默认 sheets）；
+多个后端并行写入。本地文件写到 OUTPUT_DIR（默认 /tmp/output）
+"""
+import gzip, json, os, sqlite3, threading
+from abc import ABC, abstractmethod
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import run_log
+import sheets_client
+
+SGT        = timezone(timedelta(hours=8))
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "/tmp/output")
+DEFAULT_SINKS = os.environ.get("OUTPUT_SINKS", "sheets")
+
+
+def _ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class Sink(ABC):
+    """后端基类：write 成功返回 True，失败抛异常"""
+    name = ""
+
+    @abstractmethod
+    def write(self, table):
+        ...
+
+
+class Table:
+    """一次写入的数据：tab 名、列名、行（纯数据，不含展示格式）"""
+
+    def __init__(self, sheet_id, tab, header, rows, separate_by=None):
+        self.sheet_id    = sheet_id
+        self.tab         = tab
+        self.header      = list(header)
+        self.rows        = [list(r) for r in rows]
+        self.separate_by = separate_by     # Sheets 中该列取值变化处插入空行
+        self.run_ts      = datetime.now(SGT)
+
+    def records(self):
+        return [dict(zip(self.header, r)) for r in self.rows]
+
+
+class SheetsSink(Sink):
+    name = "sheets"
+
+    def write(self, table):
+        rows, prev = [], None
+        for r in table.rows:
+            if table.separate_by is not None and prev is not None and r[table.separate_by] != prev:
+                rows.append([""] * len(r))
+            prev = r[table.separate_by] if table.separate_by is not None else None
+            rows.append(["'" + r[0]] + r[1:])   # 加 ' 防止 Sheets 把日期解析成其他格式
+        width = len(table.header)
+        ts = table.run_ts.strftime("%Y/%m/%d, %H:%M") + "完成更新"
+        timestamp_row = [[ts] + [""] * (width - 1)]
+        separator     = [[""] * width]
+        ws = sheets_client.open_worksheet(table.sheet_id, table.tab)
+        try:
+            ws.insert_rows(timestamp_row + rows + separator, row=2,
+                           value_input_option="USER_ENTERED")
+        except Exception:
+            # 缓存的句柄可能已失效；不在此重试（insert 非幂等），下次运行重新打开
+            sheets_client.invalidate(table.sheet_id, table.tab)
+            raise
+        return True
+
+
+class SQLiteSink(Sink):
+    name = "sqlite"
+    _lock = threading.Lock()
+
+    def write(self, table):
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        cols = ["run_ts"] + table.header
+        path = os.path.join(OUTPUT_DIR, "history.sqlite3")
+        # closing 负责关闭连接；连接自身的 with 只提交 / 回滚事务，不关闭（热实例上会泄漏句柄）
+        with self._lock, closing(sqlite3.connect(path)) as db, db:
+            db.execute(f"CREATE TABLE IF NOT EXISTS {_ident(table.tab)} "
+                       f"({', '.join(_ident(c) + ' TEXT' for c in cols)})")
+            ts = table.run_ts.isoformat(timespec="seconds")
+            db.executemany(
+                f"INSERT INTO {_ident(table.tab)} ({', '.join(map(_ident, cols))}) "
+                f"VALUES ({', '.join('?' * len(cols))})",
+                [[ts] + r for r in table.rows])
+        return True
+
+
+class JSONLSink(Sink):
+    name = "jsonl"
+
+    def write(self, table):
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        ts = table.run_ts.isoformat(timespec="seconds")
+        # gzip 追加写入会产生多个 member，gzip / zcat 均可顺序读出
+        with gzip.open(os.path.join(OUTPUT_DIR, f"{table.tab}.jsonl.gz"), "at", encoding="utf-8") as f:
+            for rec in table.records():
+                f.write(json.dumps({"run_ts": ts, **rec}, ensure_ascii=False) + "\n")
+        return True
+
+
+class ParquetSink(Sink):
+    name = "parquet"
+
+    def write(self, table):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("parquet 后端需要 pyarrow（pip install pyarrow）")
+        out_dir = os.path.join(OUTPUT_DIR, table.tab)
+        os.makedirs(out_dir, exist_ok=True)
+        columns = {"run_ts": [table.run_ts.isoformat(timespec="seconds")] * len(table.rows)}
+        for j, col in enumerate(table.header):
+            columns[col] = [r[j] for r in table.rows]
+        pq.write_table(pa.table(columns),
+                       os.path.join(out_dir, table.run_ts.strftime("%Y%m%d-%H%M%S") + ".parquet"),
+                       compression="zstd")
+        return True
+
+
+SINKS = {cls.name: cls for cls in (SheetsSink, SQLiteSink, JSONLSink, ParquetSink)}
+
+
+def names(selection=None):
+    """'sheets, SQLite' 或 ['sheets', 'sqlite'] → ['sheets', 'sqlite']（未给出时用 OUTPUT_SINKS）；
+    小写、去重，未知名称忽略并提示。判断是否写某个后端一律用它，不对原始字符串做子串匹配"""
+    raw = selection if selection else DEFAULT_SINKS
+    parts = raw.split(",") if isinstance(raw, str) else raw
+    chosen = []
+    for n in (x.strip().lower() for x in parts):
+        if not n or n in chosen:
+            continue
+        if n not in SINKS:
+            print(f"⚠️  未知输出后端: {n}（可选 {', '.join(SINKS)}）")
+            continue
+        chosen.append(n)
+    return chosen
+
+
+def resolve(selection=None):
+    """'sheets,sqlite' → [SheetsSink(), SQLiteSink()]；未知名称忽略并提示"""
+    return [SINKS[n]() for n in names(selection)]
+
+
+def write_each(sheet_id, tab, header, rows, sinks=None, separate_by=None, on_written=None):
+    """并行写入所有选中的后端，返回写入成功的后端名列表；
+    on_written(name)：某个后端写完即回调（可能在工作线程中），供断点记录逐后端的进度"""
+    table  = Table(sheet_id, tab, header, rows, separate_by)
+    chosen = resolve(sinks)
+
+    def run(sink):
+        try:
+            sink.write(table)
+            print(f"  ✓ [{sink.name}] {table.tab}: {len(table.rows)} 行")
+        except Exception as e:
+            print(f"  ❌ [{sink.name}] {table.tab} 写入失败: {e}")
+            return None
+        if on_written:
+            on_written(sink.name)
+        return sink.name
+
+    if not chosen:
+        return []
+    with ThreadPoolExecutor(max_workers=len(chosen)) as ex:
+        done = [n for n in ex.map(run, chosen) if n]
+    if len(done) == len(chosen):
+        run_log.count("written", len(rows))
+    return done
+
+
+def write(sheet_id, tab, header, rows, sinks=None, separate_by=None):
+    """并行写入所有选中的后端；全部成功返回 True"""
+    chosen = names(sinks)
+    if not chosen:
+        return False
+    return len(write_each(sheet_id, tab, header, rows, chosen, separate_by)) == len(chosen)
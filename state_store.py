@@ -0,0 +1,161 @@
+"""
+state_store.py — 跨次运行的小型 JSON 状态文件（缓存、记录等）
+- 默认写本地：Cloud Run 只有 /tmp 可写，但 /tmp 只在同一实例内有效
+- STATE_DIR=gs://bucket/prefix 时写 Cloud Storage，所有实例共享同一份状态
+  （走 google-auth 的 AuthorizedSession + GCS JSON API，不额外引入依赖）
+- create_json / load_json_generation / replace_json / delete_json：只在不存在时创建、
+  按版本号覆盖 / 删除，供租约、多实例合并写入的缓存等使用
+  （GCS 用 ifGenerationMatch 前置条件，本地用 link / mtime）
+"""
+import json, os, tempfile
+from urllib.parse import quote
+
+STATE_DIR = os.environ.get("STATE_DIR", "/tmp")
+SHARED    = STATE_DIR.startswith("gs://")   # 跨实例共享：租约、台账、增量水位等依赖它
+
+_gcs_session = None
+
+
+def state_path(name):
+    if STATE_DIR.startswith("gs://"):
+        return f"{STATE_DIR.rstrip('/')}/{name}"
+    return os.path.join(STATE_DIR, name)
+
+
+def _gcs():
+    global _gcs_session
+    if _gcs_session is None:
+        import google.auth
+        from google.auth.transport.requests import AuthorizedSession
+        creds, _ = google.auth.default(
+            scopes=["https://www.googleapis.com/auth/devstorage.read_write"])
+        _gcs_session = AuthorizedSession(creds)
+    return _gcs_session
+
+
+def _split_gs(path):
+    bucket, _, obj = path[len("gs://"):].partition("/")
+    return bucket, obj
+
+
+def _object_url(path):
+    bucket, obj = _split_gs(path)
+    return f"https://storage.googleapis.com/storage/v1/b/{bucket}/o/{quote(obj, safe='')}"
+
+
+def load_json(path, default):
+    """读取 JSON；文件不存在或损坏时返回 default"""
+    try:
+        if path.startswith("gs://"):
+            r = _gcs().get(_object_url(path), params={"alt": "media"}, timeout=10)
+            if r.status_code != 200:
+                return default
+            return r.json()
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+
+def save_json(path, data):
+    """写入 JSON。本地先写临时文件再 rename（原子）；GCS 单次上传本身即原子"""
+    try:
+        if path.startswith("gs://"):
+            bucket, obj = _split_gs(path)
+            r = _gcs().post(
+                f"https://storage.googleapis.com/upload/storage/v1/b/{bucket}/o",
+                params={"uploadType": "media", "name": obj},
+                data=json.dumps(data, ensure_ascii=False).encode("utf-8"),
+                headers={"Content-Type": "application/json"}, timeout=10)
+            r.raise_for_status()
+            return True
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        return True
+    except Exception as e:
+        print(f"⚠️  {os.path.basename(path)} 写入失败（非致命）: {e}")
+        return False
+
+
+def load_json_generation(path):
+    """(数据, 版本号)；不存在或无法读取时返回 (None, None)。本地以 mtime_ns 作版本号"""
+    try:
+        if path.startswith("gs://"):
+            r = _gcs().get(_object_url(path), params={"alt": "media"}, timeout=10)
+            if r.status_code != 200:
+                return None, None
+            return r.json(), r.headers.get("x-goog-generation")
+        generation = os.stat(path).st_mtime_ns
+        with open(path, encoding="utf-8") as f:
+            return json.load(f), generation
+    except Exception:
+        return None, None
+
+
+def create_json(path, data):
+    """仅当文件不存在时写入，返回是否由本次创建（已存在返回 False，其他错误照常抛出）"""
+    body = json.dumps(data, ensure_ascii=False)
+    if path.startswith("gs://"):
+        bucket, obj = _split_gs(path)
+        r = _gcs().post(
+            f"https://storage.googleapis.com/upload/storage/v1/b/{bucket}/o",
+            params={"uploadType": "media", "name": obj, "ifGenerationMatch": "0"},
+            data=body.encode("utf-8"),
+            headers={"Content-Type": "application/json"}, timeout=10)
+        if r.status_code == 412:
+            return False
+        r.raise_for_status()
+        return True
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(body)
+        os.link(tmp, path)        # 目标已存在时失败，读者不会看到写了一半的文件
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp)
+
+
+def replace_json(path, data, generation):
+    """仅当版本号仍为 generation 时写入（generation=None 表示文件应不存在），返回是否写入；
+    被其他实例抢先写入时返回 False，调用方重读合并后重试"""
+    if generation is None:
+        return create_json(path, data)
+    if path.startswith("gs://"):
+        bucket, obj = _split_gs(path)
+        r = _gcs().post(
+            f"https://storage.googleapis.com/upload/storage/v1/b/{bucket}/o",
+            params={"uploadType": "media", "name": obj, "ifGenerationMatch": generation},
+            data=json.dumps(data, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, timeout=10)
+        if r.status_code == 412:
+            return False
+        r.raise_for_status()
+        return True
+    try:
+        if os.stat(path).st_mtime_ns != generation:
+            return False
+    except FileNotFoundError:
+        return False
+    return save_json(path, data)
+
+
+def delete_json(path, generation=None):
+    """删除文件；给定 generation 时只在版本未变时删除。返回是否删除"""
+    try:
+        if path.startswith("gs://"):
+            params = {"ifGenerationMatch": generation} if generation else {}
+            r = _gcs().delete(_object_url(path), params=params, timeout=10)
+            return r.status_code in (200, 204)
+        if generation is not None and os.stat(path).st_mtime_ns != generation:
+            return False
+        os.remove(path)
+        return True
+    except Exception:
+        return False
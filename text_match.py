@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+text_match.py — 关键词表一次性编译成合并正则，供标题分类 / 过滤共用
+- KeywordMatcher：子串 / 前缀 / 全等匹配，命中多个关键词时按表中顺序取第一个
+  （与原来逐个 `kw in text` 的线性扫描结果完全一致）
+- classify_many：批量分类
+用法：
+  python text_match.py --bench          # 10 万条合成标题，对比线性扫描与编译匹配
+  python text_match.py --bench 500000   # 自定义语料规模
+"""
+
+import os, re, sys, time, random
+
+_MODES = ("contains", "prefix", "exact")
+
+
+def _trie_regex(words):
+    """把关键词集合折叠成前缀树正则：'history|history of art' → 'history(?: of art)?'
+
+    sre 是回溯引擎，平铺的 a|b|c 在每个位置要逐个试全部分支；
+    前缀树形式每个位置只走一条路径，且贪婪可选组保证同一起点取最长关键词。
+    """
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """把 [(keyword, value), ...] 编译成前缀树正则，大小写不敏感
+
+    - 命中多个关键词时返回表中最靠前者，与逐个 `kw in text` 的线性扫描一致：
+      同一起点上所有命中的关键词互为前缀，正则取到最长者后查预计算的
+      "其前缀中最小序号"即可；不同起点逐个推进（每次 +1，重叠命中也不漏）
+    - patterns=[(regex, value), ...] 为原样正则，优先级排在全部关键词之后，
+      在原文（非小写）上匹配，大小写规则由正则自身决定
+    """
+
+    def __init__(self, table, mode="contains", patterns=()):
+        if mode not in _MODES:
+            raise ValueError(f"unknown mode: {mode!r}")
+        if mode != "contains" and patterns:
+            raise ValueError(f"{mode} mode does not accept patterns")
+        self.mode   = mode
+        self.values = [v for _, v in table] + [v for _, v in patterns]
+        # 关键词 → 表中首次出现的序号（重复关键词以靠前者为准）
+        rank = {}
+        for i, (kw, _) in enumerate(table):
+            rank.setdefault(kw.lower().strip() if mode == "exact" else kw.lower(), i)
+        self._rank = rank
+        if mode == "exact":
+            return
+        # 命中关键词 kw 时，同一起点上它的所有前缀关键词也都命中
+        self._best = {kw: min(r for k, r in rank.items() if kw.startswith(k)) for kw in rank}
+        self._re = re.compile(_trie_regex(rank)) if rank else None
+        self._pat_re = (re.compile("|".join(f"(?:{p})" for p, _ in patterns), re.IGNORECASE)
+                        if patterns else None)
+        self._pat_each = [re.compile(p, re.IGNORECASE) for p, _ in patterns]
+
+    def _best_index(self, text):
+        if self.mode == "exact":
+            return self._rank.get(text.lower().strip())
+        if self.mode == "prefix":
+            m = self._re.match(text.lower().strip()) if self._re else None
+            return self._best[m.group()] if m else None
+        best = None
+        if self._re is not None:
+            t, search, pos = text.lower(), self._re.search, 0
+            while True:
+                m = search(t, pos)
+                if m is None:
+                    break
+                i = self._best[m.group()]
+                if best is None or i < best:
+                    best = i
+                    if i == 0:
+                        break
+                pos = m.start() + 1
+        if best is None and self._pat_re is not None and self._pat_re.search(text):
+            base = len(self.values) - len(self._pat_each)
+            best = base + next(j for j, rx in enumerate(self._pat_each) if rx.search(text))
+        return best
+
+    def first(self, text, default=None):
+        """返回命中条目对应的 value；无命中返回 default"""
+        i = self._best_index(text)
+        return default if i is None else self.values[i]
+
+    def matches(self, text):
+        """是否命中任意条目（不关心优先级，命中即返回）"""
+        if self.mode == "contains":
+            if self._re is not None and self._re.search(text.lower()):
+                return True
+            return self._pat_re is not None and self._pat_re.search(text) is not None
+        return self._best_index(text) is not None
+
+    def classify_many(self, texts, default=None):
+        """批量分类，返回与 texts 等长的 value 列表"""
+        first = self.first
+        return [first(t, default) for t in texts]
+
+
+# ── 基准测试 ──────────────────────────────────────────────────────────────
+_FILLER = (
+    "analysis of the effects on income inequality and labour market outcomes "
+    "evidence from panel data in rural and urban china education health care "
+    "lecturer research fellow professor assistant associate postdoctoral "
+    "department of school faculty centre institute university college"
+).split()
+
+
+def _synthetic_titles(n, keywords, hit_rate=0.35, seed=42):
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        words = rnd.choices(_FILLER, k=rnd.randint(6, 16))
+        if rnd.random() < hit_rate:
+            words.insert(rnd.randrange(len(words) + 1), rnd.choice(keywords))
+        out.append(" ".join(words).capitalize())
+    return out
+
+
+def _load_table(module_file, name):
+    """不 import 模块（fetch_jobs 顶层依赖 gspread），直接从源码里取常量表"""
+    import ast
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), module_file)
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+                getattr(t, "id", "") == name for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise RuntimeError(f"{name} not found in {module_file}")
+
+
+def bench(n=100_000):
+    """三张关键词表分别比较原线性扫描与编译匹配的耗时，并校验结果一致"""
+    from fetch_journals import is_book_review
+    from fetch_reports  import is_supplementary
+    the_map      = _load_table("fetch_jobs.py",     "THE_KEYWORD_MAP")
+    review_kws   = _load_table("fetch_journals.py", "BOOK_REVIEW_KEYWORDS")
+    skip_titles  = _load_table("fetch_reports.py",  "_SKIP_TITLES")
+
+    # 原实现（逐条线性扫描 + 每次现编译正则），作为对照组
+    def linear_classify(title):
+        text = title.lower()
+        for kw, subject in the_map:
+            if kw in text:
+                return subject
+        return None
+
+    def linear_book_review(title):
+        t = title.lower()
+        if any(kw in t for kw in review_kws):
+            return True
+        if re.search(r'\bISBN\b', title, re.IGNORECASE):
+            return True
+        if re.search(r'\bpp\.', title) and re.search(r'[£$€]\d', title):
+            return True
+        if re.search(r'\. By [A-Z].+?\.\s+\w+:', title):
+            return True
+        return False
+
+    def linear_supplementary(title):
+        t = title.lower().strip()
+        if t in skip_titles:
+            return True
+        return any(t.startswith(kw) for kw in ("appendix", "errata:", "correction:"))
+
+    # 扩表：在原表后追加 300 个合成关键词，观察关键词表增长时两者的伸缩性
+    rnd = random.Random(7)
+    big_map = the_map + [
+        (f"{rnd.choice(_FILLER)} {''.join(rnd.choices('abcdefghijklmnopqrstuvwxyz', k=6))}",
+         f"Synthetic {i}") for i in range(300)]
+
+    def linear_classify_big(title):
+        text = title.lower()
+        for kw, subject in big_map:
+            if kw in text:
+                return subject
+        return None
+
+    the_matcher = KeywordMatcher(the_map)
+    big_matcher = KeywordMatcher(big_map)
+    cases = [
+        ("THE 学科分类", [kw for kw, _ in the_map],
+         linear_classify, the_matcher.classify_many),
+        ("扩表 x10", [kw for kw, _ in big_map],
+         linear_classify_big, big_matcher.classify_many),
+        ("书评过滤", review_kws + ["ISBN 978-0-00", "pp. 320, £25.00", ". By Jane Doe. London:"],
+         linear_book_review, lambda ts: [is_book_review(t) for t in ts]),
+        ("补充材料过滤", skip_titles + ["Appendix A:", "Correction: "],
+         linear_supplementary, lambda ts: [is_supplementary(t) for t in ts]),
+    ]
+
+    print(f"=== text_match 基准测试：{n:,} 条合成标题 ===")
+    for label, kws, linear_one, compiled_many in cases:
+        titles = _synthetic_titles(n, kws)
+        t0 = time.perf_counter()
+        r_lin = [linear_one(t) for t in titles]
+        t1 = time.perf_counter()
+        r_cmp = compiled_many(titles)
+        t2 = time.perf_counter()
+        same = "一致" if r_lin == r_cmp else "❌ 不一致"
+        print(f"  {label:<8} 线性 {(t1-t0)*1000:8.1f} ms | 编译 {(t2-t1)*1000:8.1f} ms"
+              f" | 加速 {(t1-t0) / max(t2-t1, 1e-9):5.2f}x | 结果{same}")
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        idx = sys.argv.index("--bench")
+        size = int(sys.argv[idx + 1]) if len(sys.argv) > idx + 1 else 100_000
+        bench(size)
+    else:
+        print(__doc__)